@@ -6,6 +6,7 @@ containing zip files with monthly CSVs.
 
 - Use Dask, since total rows surpasses 100m, to read the CSVs in async, standardize the column names and concatenate them. 
 - Use google maps and census apis to obtain standarized address to obtain census level geocoding.
+- Station census blocks/tracts are assigned offline against local 2020 census block polygons.
 """
 
 import os
@@ -27,11 +28,11 @@ warnings.filterwarnings("first")
 
 from dotenv import load_dotenv
 load_dotenv()
-from utils.census_geocode_api import fetch_geocode_coordinates, extract_data
+from utils.census_geocode_api import fetch_geocode_coordinates, geocode_coordinates_offline
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
 from utils import db_utils
-psql_conn = db_utils.get_postgres_conn()
+from utils.partition_migration import migrate_table, load_partitioned
 
 BUCKET_NAME = "tripdata"
 BASE_URL = "https://s3.amazonaws.com/tripdata/"
@@ -109,13 +110,9 @@ def fetch_positions(latitude, longitude, index):
     return fetch_geocode_coordinates(latitude, longitude)
 
 def async_geocode_fetch(latitudes, longitudes):
-    """Fetch geocode data for multiple coordinates in async."""
-    addresses = []
+    """Fetch geocode data for multiple coordinates in async, preserving input order."""
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = [executor.submit(fetch_positions, latitudes[i], longitudes[i], i) for i in range(len(latitudes))]
-        for f in concurrent.futures.as_completed(results):
-            addresses.append(f.result())
-    return addresses
+        return list(executor.map(fetch_positions, latitudes, longitudes, range(len(latitudes))))
 
 def process_ride_data():
     """Process and store Citi Bike ride data from S3 to psql database."""
@@ -140,33 +137,23 @@ def process_ride_data():
 
         dfs_all = dd.concat(df_year_concat, axis=0)
         
-        dfs_all.to_sql("citibike_ride_history_full", psql_conn, if_exists="replace", index=False, chunksize=1_000_000, method="multi")
+        # load into a plain table, then swap it in as monthly partitions with a BRIN index on start_time
+        dfs_all.to_sql("citibike_ride_history_full_load", db_utils.get_manager().url_string, if_exists="replace", index=False, chunksize=1_000_000, method="multi")
+        migrate_table(db_utils.get_engine(), "citibike_ride_history_full", "start_time",
+                      source="citibike_ride_history_full_load", keep_old=False, drop_source=True)
 
 def geocode_stations():
-    """Geocode Citi Bike stations and store results in postgresql database."""
+    """Geocode Citi Bike stations against local census block polygons and store results in postgresql database."""
+    psql_conn = db_utils.get_engine()
     stations = pd.read_sql("SELECT * FROM citibike_stations", psql_conn)
-    lat = list(stations['latitude'])
-    lng = list(stations['longitude'])
-    addresses = async_geocode_fetch(lat, lng)
-
-    geo_data = []
-    for address in addresses:
-        all_dict = {}
-        all_dict.update(extract_data(address, "2020 Census Blocks", ["BLOCK", "CENTLAT", "CENTLON", "AREALAND", "TRACT"]))
-        all_dict.update(extract_data(address, "2020 Census Blocks", ["TRACT"]))
-        geo_data.append(all_dict)
-
-    geo_data_df = pd.DataFrame(geo_data)
-
     stations_con = stations.copy().reset_index()
-    geo_stations = pd.concat([stations_con, geo_data_df], axis=1)
-
-    geo_stations.drop(columns=['CENTLAT', 'CENTLON', 'AREALAND'], inplace=True)
+    geo_stations = geocode_coordinates_offline(stations_con, lat_col='latitude', lng_col='longitude')
     
     geo_stations.to_sql("citibike_stations_geocoded", psql_conn, if_exists="replace", index=False)
 
 def process_and_geocode_data():
     """Process ride data, merge with geocoded station data, and store results."""
+    psql_conn = db_utils.get_engine()
     df = pd.read_sql("SELECT * FROM citibike_ride_history_full", psql_conn)
     
     df['start_station_id'] = pd.to_numeric(df['start_station_id'], errors='coerce')
@@ -182,8 +169,9 @@ def process_and_geocode_data():
                              left_on='end_station_id', right_on='end_station_id', 
                              how='left', validate='many_to_one')
     
-    geocoded_data.to_sql("citibike_rides_geocoded", psql_conn, if_exists="replace", index=False, chunksize=1_000_000, method="multi")
+    load_partitioned(psql_conn, "citibike_rides_geocoded", "start_time", geocoded_data)
 
-process_ride_data()
-geocode_stations()
-process_and_geocode_data()
\ No newline at end of file
+if __name__ == "__main__":
+    process_ride_data()
+    geocode_stations()
+    process_and_geocode_data()
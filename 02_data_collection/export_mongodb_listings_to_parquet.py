@@ -0,0 +1,202 @@
+# export_mongodb_listings_to_parquet.py
+"""
+Purpose: Stream the scraped Zillow listings from MongoDB into a state-partitioned Parquet dataset.
+Replaces the load in load_mongodb_scraped_data.ipynb (find() everything, recursive unnest, dedupe in pandas):
+documents are read in batches through a projected cursor sorted on a (root.zpid, _id) index, so the newest
+scrape of each zpid comes first and older ones are skipped as they stream past. Every batch is flattened
+into a fixed Arrow schema built from the scraper's data_model_entities (same 'root.property.<section>.<key>'
+column names as the notebook), school / price / tax history aggregates are computed on Arrow list arrays
+instead of per-row loops, and the batch is written out before the next one is read, so memory stays at one
+batch regardless of collection size.
+"""
+
+import os
+import sys
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / '01_web_scraper' / 'scraper'))
+from data_model_entities import CensusData, ListingAgent, Location, PictureData, Pricing, PropertyFeatures
+from utils.db_utils import MongoUtils
+
+OUTPUT_DIR = os.getenv('LISTINGS_PARQUET_DIR', 'zillow_listings_parquet')
+BATCH_SIZE = 5_000
+QUERY = {'root.property.overview.state': 'NY'}
+DEDUPE_INDEX = [('root.zpid', 1), ('_id', -1)]  # _id (ObjectId) grows with insert time, i.e. scrape time
+
+# document section under root.property -> entity listing its keys
+SECTIONS = {'location': Location, 'pricing': Pricing, 'propertyFeatures': PropertyFeatures,
+            'listingAgent': ListingAgent, 'pictures': PictureData, 'census': CensusData}
+NESTED_KEYS = {'neighborhoodRegion', 'nearbyCities', 'nearbyNeighborhoods', 'nearbyZipcodes', 'taxHistory',
+               'priceHistory', 'mortgageZHLRates', 'sellingSoon', 'foreclosureTypes', 'listingOffices',
+               'listingAgents', 'propertyPhotos', 'staticMap', 'addressComponents'}
+NUMERIC_KEYS = {'stateId', 'cityId', 'longitude', 'latitude', 'zpid', 'price', 'zestimate', 'zestimateLowPercent',
+                'zestimateHighPercent', 'rentZestimate', 'restimateLowPercent', 'restimateHighPercent',
+                'propertyTaxRate', 'bathrooms', 'bathroomsFull', 'bathroomsHalf', 'bedrooms',
+                'garageParkingCapacity', 'fireplaces', 'parkingCapacity', 'pricePerSquareFoot', 'stories',
+                'yearBuilt'}
+
+# list-of-records fields under root.property and the record fields aggregated per listing
+SCHOOLS = ('schools.schools', pa.struct([('rating', pa.float64()), ('distance', pa.float64()), ('type', pa.string())]))
+HISTORY_MEANS = {'avgPriceChange': ('pricing.priceHistory', 'priceChangeRate'),
+                 'avgTaxIncrease': ('pricing.taxHistory', 'valueIncreaseRate'),
+                 'sellingSoon': ('pricing.sellingSoon', 'percentile')}  # first (model_0) record only
+
+
+def field_type(key: str) -> pa.DataType:
+    if key in NESTED_KEYS:
+        return pa.string()  # JSON text
+    if key in NUMERIC_KEYS:
+        return pa.float64()
+    if key[:2] == 'is' or key[:3] == 'has':
+        return pa.bool_()
+    return pa.string()
+
+
+def listing_schema() -> pa.Schema:
+    """Fixed output schema: entity keys per section, then the derived aggregates."""
+    fields = [pa.field('root.zpid', pa.int64()), pa.field('root.hash_md5', pa.string()),
+              pa.field('root.extractTimestamp', pa.timestamp('us'))]
+    for section, entity in SECTIONS.items():
+        fields += [pa.field(f'root.property.{section}.{key}', field_type(key)) for key in entity().keys]
+    fields += [pa.field(name, pa.float64()) for name in
+               ('avgRating', 'avgDistance', 'schoolCount', 'privateSchoolCount', 'avgPriceChange',
+                'avgTaxIncrease', 'sellingSoon', 'hoaFeeAmount', 'zestimateDiff')]
+    return pa.schema(fields + [pa.field('state', pa.string())])
+
+
+SCHEMA = listing_schema()
+
+
+def projection() -> Dict[str, int]:
+    """Only the fields the schema needs (the notebook dropped e.g. the coreLogic blobs after loading them)."""
+    fields = {name: 1 for name in SCHEMA.names if name.startswith('root.')}
+    fields.update({f'root.property.{SCHOOLS[0]}.{f.name}': 1 for f in SCHOOLS[1]})
+    fields['_id'] = 0
+    return fields
+
+
+def lookup(doc: dict, path: str):
+    for part in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def iter_newest(collection, query: dict = QUERY, batch_size: int = BATCH_SIZE) -> Iterator[List[dict]]:
+    """Batches of documents, only the newest per zpid, in zpid order."""
+    collection.create_index(DEDUPE_INDEX)
+    cursor = collection.find(query, projection(), sort=DEDUPE_INDEX, batch_size=batch_size).hint(DEDUPE_INDEX)
+    batch, last_zpid = [], None
+    for doc in cursor:
+        zpid = lookup(doc, 'root.zpid')
+        if zpid is None or zpid == last_zpid:
+            continue
+        last_zpid = zpid
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def records(values: list, record_type: pa.StructType) -> pa.ListArray:
+    return pa.array([v if isinstance(v, list) else None for v in values], type=pa.list_(record_type))
+
+
+def record_sums(lists: pa.ListArray, field: str):
+    """Per-listing sum and non-null count of one numeric record field, one bincount over all records."""
+    parents = pc.list_parent_indices(lists).to_numpy()
+    values = pc.list_flatten(lists).field(field).to_numpy(zero_copy_only=False).astype(np.float64)
+    present = ~np.isnan(values)
+    sums = np.bincount(parents[present], weights=values[present], minlength=len(lists))
+    counts = np.bincount(parents[present], minlength=len(lists)).astype(np.float64)
+    return sums, counts
+
+
+def mean_or_nan(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def flatten_batch(docs: List[dict]) -> pa.Table:
+    """One batch of documents as a table in SCHEMA."""
+    columns = {}
+    for field in SCHEMA:
+        if not field.name.startswith('root.'):
+            continue
+        values = pd.Series([lookup(doc, field.name) for doc in docs], dtype=object)
+        if field.name.split('.')[-1] in NESTED_KEYS:
+            columns[field.name] = values.map(lambda v: json.dumps(v, default=str), na_action='ignore').astype('string')
+        elif pa.types.is_floating(field.type) or pa.types.is_integer(field.type):
+            columns[field.name] = pd.to_numeric(values, errors='coerce')
+        elif pa.types.is_boolean(field.type):
+            columns[field.name] = values.map({True: True, False: False}).astype('boolean')
+        elif pa.types.is_timestamp(field.type):
+            columns[field.name] = pd.to_datetime(values, format='%d/%m/%Y %H:%M:%S', errors='coerce')
+        else:
+            columns[field.name] = values.map(str, na_action='ignore').astype('string')
+    df = pd.DataFrame(columns)
+
+    schools = records([lookup(doc, f'root.property.{SCHOOLS[0]}') for doc in docs], SCHOOLS[1])
+    rating_sum, rating_count = record_sums(schools, 'rating')
+    df['avgRating'] = mean_or_nan(rating_sum, rating_count)
+    df['avgDistance'] = mean_or_nan(*record_sums(schools, 'distance'))
+    private = pc.equal(pc.list_flatten(schools).field('type'), 'Private').fill_null(False).to_numpy(zero_copy_only=False)
+    df['schoolCount'] = rating_count
+    df['privateSchoolCount'] = np.bincount(pc.list_parent_indices(schools).to_numpy()[private], minlength=len(docs))
+    df.loc[schools.is_null().to_numpy(zero_copy_only=False), ['schoolCount', 'privateSchoolCount']] = np.nan
+
+    for name, (path, field) in HISTORY_MEANS.items():
+        values = [lookup(doc, f'root.property.{path}') for doc in docs]
+        if name == 'sellingSoon':
+            values = [v[:1] if isinstance(v, list) else None for v in values]
+        df[name] = mean_or_nan(*record_sums(records(values, pa.struct([(field, pa.float64())])), field))
+
+    hoa_fee = df['root.property.propertyFeatures.hoaFee'].str.replace(r'HOA Fee:|monthly|[$,\s]', '', regex=True)
+    df['hoaFeeAmount'] = pd.to_numeric(hoa_fee, errors='coerce').astype('float64')
+    df['zestimateDiff'] = df['root.property.pricing.zestimate'] - df['root.property.pricing.price']
+    df['state'] = df['root.property.location.state'].fillna('unknown')
+    return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+
+def export_listings(collection, output_dir: str = OUTPUT_DIR, query: dict = QUERY, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Stream the newest document per zpid into a Parquet dataset partitioned by state.
+
+    :param collection: pymongo collection of scraped listings.
+    :param output_dir: Dataset root, replaced atomically once the export finishes.
+    :param query: Mongo filter, NY listings by default like the notebook.
+    :param batch_size: Documents per cursor batch and per written file.
+    :return: Listings written.
+    """
+    root = Path(output_dir)
+    tmp_root = root.with_name(f'{root.name}.tmp')
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    rows = 0
+    for i, docs in enumerate(iter_newest(collection, query, batch_size)):
+        pq.write_to_dataset(flatten_batch(docs), tmp_root, partition_cols=['state'],
+                            basename_template=f'part-{i:05d}-{{i}}.parquet')
+        rows += len(docs)
+        print(f'Exported {rows} listings')
+    tmp_root.mkdir(parents=True, exist_ok=True)
+    shutil.rmtree(root, ignore_errors=True)
+    tmp_root.rename(root)
+    return rows
+
+
+if __name__ == '__main__':
+    mongo_config = MongoUtils()
+    client = mongo_config.get_mongo_conn()
+    collection = client[mongo_config.mongo_db][mongo_config.mongo_collection]
+    print(f'{export_listings(collection)} listings -> {OUTPUT_DIR}')
@@ -0,0 +1,20 @@
+# migrate_event_tables_to_partitions.py
+"""
+Purpose: One-off migration of the large Citi Bike event tables to monthly range partitions with BRIN
+indexes on start_time, then pre-create partitions for the coming months (safe to rerun monthly).
+"""
+
+import sys
+
+from utils.db_utils import get_engine
+from utils.partition_migration import PARTITIONED_TABLES, ensure_future_partitions, is_partitioned, migrate_table
+
+if __name__ == '__main__':
+    engine = get_engine()
+    tables = sys.argv[1:] or list(PARTITIONED_TABLES)
+    for table in tables:
+        with engine.connect() as conn:
+            partitioned = is_partitioned(conn, table)
+        if not partitioned:
+            migrate_table(engine, table, PARTITIONED_TABLES[table])
+        print(f'{table}: created {ensure_future_partitions(engine, table)}')
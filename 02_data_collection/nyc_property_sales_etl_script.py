@@ -2,12 +2,20 @@
 """
 Purpose: Process and geocode NYC property sales data from Excel files,
 combining data from multiple boroughs and years.
+
+- Rolling sales workbooks are downloaded in parallel into a local cache keyed by ETag/Last-Modified,
+  parsed in parallel with typed columns, and concatenated once.
+- Price metrics and property type filtering are vectorized.
 """
 
 import os
-import re
+import json
 import boto3
+import requests
+import numpy as np
 import pandas as pd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dotenv import load_dotenv
 from utils.census_geocode_api import fetch_geocode_coordinates, extract_data
 from utils import census_geocode_api as census_api
@@ -21,7 +29,10 @@ pd.set_option("display.max_rows", None)
 
 load_dotenv()
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
-psql_conn = db_utils.get_postgres_conn()
+
+CACHE_DIR = os.getenv('ROLLING_SALES_CACHE_DIR', 'Geocoded_Data/rolling_sales_cache')
+BOROUGHS = ['manhattan', 'bronx', 'brooklyn', 'queens', 'statenisland', 'staten_island']
+ROLLING_SALES_URL = 'https://www.nyc.gov/assets/finance/downloads/pdf/rolling_sales/rollingsales_{borough}.xlsx'
 
 COLS = [
     "BOROUGH", "NEIGHBORHOOD", "BUILDING_CLASS_CATEGORY", "TAX_CLASS_PRESENT",
@@ -31,42 +42,99 @@ COLS = [
     "BUILDING_CLASS_SALE", "SALE_PRICE", "SALE_DATE"
 ]
 
-def read_excel_files(links):
-    """Read and combine multiple Excel files into a single DataFrame."""
-    df_combined = pd.DataFrame()
-    for link in links:
+TEXT_COLS = [
+    "NEIGHBORHOOD", "BUILDING_CLASS_CATEGORY", "TAX_CLASS_PRESENT", "EASE-MENT",
+    "BUILDING_CLASS_PRESENT", "ADDRESS", "APARTMENT_NUMBER", "TAX_CLASS_SALE", "BUILDING_CLASS_SALE"
+]
+CATEGORY_COLS = ["NEIGHBORHOOD", "BUILDING_CLASS_CATEGORY", "TAX_CLASS_PRESENT", "BUILDING_CLASS_PRESENT",
+                 "TAX_CLASS_SALE", "BUILDING_CLASS_SALE"]
+NUMERIC_DTYPES = {
+    "BOROUGH": "Int8", "BLOCK": "Int32", "LOT": "Int32", "ZIP_CODE": "Int32",
+    "RESIDENTIAL_UNITS": "float32", "COMMERCIAL_UNITS": "float32", "TOTAL_UNITS": "float32",
+    "LAND_SF": "float64", "GROSS_SF": "float64", "YEAR_BUILT": "Int16", "SALE_PRICE": "float64",
+}
+
+KEEP_BUILDING_CLASS_NUMS = np.r_[1:18, 23, 28, 42:50]
+
+
+def cached_download(link, cache_dir=CACHE_DIR):
+    """Download a workbook unless the cached copy's ETag/Last-Modified still matches the server."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / link.rsplit('/', 1)[-1]
+    meta_path = path.with_name(path.name + '.meta.json')
+    cached_meta = json.loads(meta_path.read_text()) if meta_path.exists() and path.exists() else None
+
+    try:
+        head = requests.head(link, allow_redirects=True, timeout=30)
+        head.raise_for_status()
+        meta = {'etag': head.headers.get('ETag'), 'last_modified': head.headers.get('Last-Modified')}
+    except requests.RequestException:
+        if cached_meta is not None:
+            return path
+        raise
+
+    if cached_meta == meta and any(meta.values()):
+        return path
+
+    response = requests.get(link, timeout=120)
+    response.raise_for_status()
+    tmp_path = path.with_name(path.name + '.part')
+    tmp_path.write_bytes(response.content)
+    os.replace(tmp_path, path)
+    meta_path.write_text(json.dumps(meta))
+    return path
+
+
+def read_workbook(path):
+    """Read a single rolling sales workbook with typed columns."""
+    df = pd.read_excel(path, header=None, skiprows=10, names=COLS,
+                       dtype={col: str for col in TEXT_COLS}, parse_dates=["SALE_DATE"])
+    for col, dtype in NUMERIC_DTYPES.items():
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    return df
+
+
+def read_excel_files(links, cache_dir=CACHE_DIR, max_workers=None):
+    """Download (through the cache) and parse workbooks in parallel, then combine into a single DataFrame."""
+    def download(link):
         try:
-            data = pd.read_excel(link, header=None, skiprows=10)
-            df_combined = df_combined.append(data)
+            return cached_download(link, cache_dir)
         except Exception as e:
             print(f"Error reading file {link}: {e}")
-    df_combined.columns = COLS
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = [path for path in executor.map(download, links) if path is not None]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(read_workbook, paths))
+
+    df_combined = pd.concat(frames, axis=0, ignore_index=True)
+    df_combined[CATEGORY_COLS] = df_combined[CATEGORY_COLS].astype("category")
     return df_combined
 
+
 def filter_property_types(df):
-    df["BULIDING_CLASS_NUM"] = df["BUILDING_CLASS_CATEGORY"].apply(
-        lambda x: re.sub("[^0-9]", "", x.split(" ")[0])
+    df["BULIDING_CLASS_NUM"] = pd.to_numeric(
+        df["BUILDING_CLASS_CATEGORY"].astype(str).str.split(" ", n=1).str[0].str.replace("[^0-9]", "", regex=True),
+        errors="coerce",
     )
-    df["BULIDING_CLASS_NUM"] = pd.to_numeric(df["BULIDING_CLASS_NUM"])
-    keep_nums = list(range(1, 18)) + [23, 28] + list(range(42, 50))
-    return df[df["BULIDING_CLASS_NUM"].isin(keep_nums)]
+    return df[df["BULIDING_CLASS_NUM"].isin(KEEP_BUILDING_CLASS_NUMS)]
+
 
 def calculate_price_metrics(df):
     """calculate ppu and ppsf"""
-    df["PP_UNIT"] = df.apply(
-        lambda row: (
-            row["SALE_PRICE"] / row["TOTAL_UNITS"]
-            if row["TOTAL_UNITS"] != 0 and pd.notna(row["TOTAL_UNITS"])
-            else row["SALE_PRICE"]
-        ),
-        axis=1,
-    )
-    df["PPSF"] = df.apply(
-        lambda row: row["SALE_PRICE"] / row["GROSS_SF"] if row["GROSS_SF"] != 0 else 0,
-        axis=1,
-    )
+    sale_price = df["SALE_PRICE"].to_numpy(dtype=float)
+    total_units = df["TOTAL_UNITS"].to_numpy(dtype=float)
+    gross_sf = df["GROSS_SF"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        has_units = (total_units != 0) & ~np.isnan(total_units)
+        df["PP_UNIT"] = np.where(has_units, sale_price / total_units, sale_price)
+        df["PPSF"] = np.where(gross_sf != 0, sale_price / gross_sf, 0)
     return df
 
+
 def update_location_info(df):
     loc_key = {1: "Manhattan", 2: "Bronx", 3: "Brooklyn", 4: "Queens", 5: "Staten Island"}
     if list(df["BOROUGH"])[0] in loc_key.keys():
@@ -74,6 +142,7 @@ def update_location_info(df):
     df["STATE"] = "NY"
     return df
 
+
 def preprocess_df(df):
     df = df.dropna(subset=["SALE_PRICE"])
     df["SALE_PRICE"] = df["SALE_PRICE"].astype(int)
@@ -86,7 +155,8 @@ def preprocess_df(df):
     df['Year'] = df['Date'].dt.year
     return df
 
-def geocode_sales_data(df, save_path):
+
+def geocode_sales_data(df, save_path, psql_conn):
     geocoded_df = census_api.geocode_multi_batch(
         df,
         address_col="ADDRESS",
@@ -98,32 +168,40 @@ def geocode_sales_data(df, save_path):
     geocoded_df.to_sql("nyc_property_sales_geocoded", psql_conn, if_exists="replace", index=False)
     return geocoded_df
 
-links = []
-for borough in ['manhattan', 'bronx', 'brooklyn', 'queens', 'statenisland', 'staten_island']:
-    links.append(f'https://www.nyc.gov/assets/finance/downloads/pdf/rolling_sales/rollingsales_{borough}.xlsx')
 
-df = read_excel_files(links)
-df = preprocess_df(df)
+def load_rolling_sales(boroughs=BOROUGHS, cache_dir=CACHE_DIR, max_workers=None):
+    """Ingest stage: cached parallel download, single concat and vectorized preprocessing."""
+    links = [ROLLING_SALES_URL.format(borough=borough) for borough in boroughs]
+    return preprocess_df(read_excel_files(links, cache_dir=cache_dir, max_workers=max_workers))
+
+
+def main():
+    psql_conn = db_utils.get_engine()
+    df = load_rolling_sales()
+
+    geocoded_df = geocode_sales_data(df, "Geocoded_Data/All_Boroughs_geocoded.csv", psql_conn)
+
+    df_2023 = pd.read_csv('Geocoded_Data/preprocessed_NOT_geocoded_2023.csv')
+    geocoded_df_2023 = geocode_sales_data(df_2023, "Geocoded_Data/All_Boroughs_geocoded_2023.csv", psql_conn)
 
-geocoded_df = geocode_sales_data(df, "Geocoded_Data/All_Boroughs_geocoded.csv")
+    df_all = pd.read_csv('Geocoded_Data/All_Boroughs_geocoded.csv')
+    df_2023 = pd.read_csv('Geocoded_Data/All_Boroughs_geocoded_2023.csv')
+    df_both = pd.concat([df_all, df_2023], axis=0, ignore_index=True)
+    df_both['Date'] = pd.to_datetime(df_both['SALE_DATE'])
+    df_both['Year'] = df_both['Date'].dt.year
 
-df_2023 = pd.read_csv('Geocoded_Data/preprocessed_NOT_geocoded_2023.csv')
-geocoded_df_2023 = geocode_sales_data(df_2023, "Geocoded_Data/All_Boroughs_geocoded_2023.csv")
 
-df_all = pd.read_csv('Geocoded_Data/All_Boroughs_geocoded.csv')
-df_2023 = pd.read_csv('Geocoded_Data/All_Boroughs_geocoded_2023.csv')
-df_both = pd.concat([df_all, df_2023], axis=0, ignore_index=True)
-df_both['Date'] = pd.to_datetime(df_both['SALE_DATE'])
-df_both['Year'] = df_both['Date'].dt.year
+    df_both.to_csv('Geocoded_Data/All_Boroughs_geocoded_With_2023.csv', index=False)
 
+    s3 = boto3.client('s3')
+    s3_bucket = 'general-scratch'
+    s3_key = 'alt_data/All_Boroughs_geocoded_With_2023.csv'
+    s3.upload_file('Geocoded_Data/All_Boroughs_geocoded_With_2023.csv', s3_bucket, s3_key)
+    print(f"File uploaded to s3://{s3_bucket}/{s3_key}")
 
-df_both.to_csv('Geocoded_Data/All_Boroughs_geocoded_With_2023.csv', index=False)
+    df_both.to_sql("nyc_property_sales_all", psql_conn, if_exists="replace", index=False)
+    print("Data processing and geocoding completed.")
 
-s3 = boto3.client('s3')
-s3_bucket = 'general-scratch'
-s3_key = 'alt_data/All_Boroughs_geocoded_With_2023.csv'
-s3.upload_file('Geocoded_Data/All_Boroughs_geocoded_With_2023.csv', s3_bucket, s3_key)
-print(f"File uploaded to s3://{s3_bucket}/{s3_key}")
 
-df_both.to_sql("nyc_property_sales_all", psql_conn, if_exists="replace", index=False)
-print("Data processing and geocoding completed.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
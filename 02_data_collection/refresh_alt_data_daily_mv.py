@@ -0,0 +1,10 @@
+# refresh_alt_data_daily_mv.py
+"""
+Purpose: Upsert the new dates of every source into its daily summary table and refresh the
+nyc_alt_data_daily materialized view concurrently (replaces rerunning create_nyc_alt_data_daily_mv.sql).
+"""
+
+from utils.daily_summary_refresh import refresh_daily
+
+if __name__ == '__main__':
+    refresh_daily()
@@ -6,15 +6,20 @@ across census tracts.
 
 # %%
 import pandas as pd
-import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from statsmodels.tsa.stattools import grangercausalitytests
 
 import seaborn as sns
 import matplotlib.pyplot as plt
 from sklearn.preprocessing import MinMaxScaler
 
+from utils.alt_data_sources import SOURCES
+from utils.alt_data_store import load_source
+from utils.date_utils import month_key
+from utils.feature_cube import CUBE_DIR, FeatureCube
+from utils.panel_analytics import PanelAnalytics
+from utils.rollup_cube import tract_group
+
 pd.set_option('display.max_columns', None)
 px.defaults.template = "plotly_dark"
 
@@ -24,43 +29,39 @@ px.defaults.template = "plotly_dark"
 # note: pull alt data sources, group by census tract, merge w/ sales data
 
 # %%
-def load_and_preprocess(file_path):
-    df = pd.read_csv(file_path)
-    df['Date'] = pd.to_datetime(df['Date'])
+# Load data from the local Parquet mirror of s3://general-scratch/alt_data, only the needed columns
+def load_and_preprocess(source, columns=('tract',), start=None, end=None):
+    df = load_source(source, columns=list(columns), start=start, end=end)
+    df['Date'] = df['date']
     df['Year'] = df['Date'].dt.year
-    df['yr-month'] = df['Year'].astype(str) + '-' + df['Date'].dt.month.astype(str)
-    df['tract_1000_grp'] = pd.cut(df['tract'], bins=range(0, 303000, 10000), right=True, labels=False) + 1
+    df['month_key'] = month_key(df['Date'])
+    # same groups as the ETL's rollup cube; missing / out of range tracts (-1) are left out of the groupbys
+    df['tract_1000_grp'] = pd.Series(tract_group(df['tract']), index=df.index).where(lambda groups: groups > 0)
     return df
-# Load data from S3
-DATA_DIR = 's3://general-scratch/alt_data'
 
-sales = pd.read_csv(f'{DATA_DIR}/All_Boroughs_geocoded_With_2023.csv')
-complaints = pd.read_csv(f"{DATA_DIR}/DOB_Complaints_Geocoded.csv")
-operating_businesses = pd.read_csv('{DATA_DIR}/Businesses_Operating_Geocoded.csv')
-evictions = pd.read_csv(f'{DATA_DIR}/Evictions_Geocoded.csv')
-restaurants = pd.read_csv(f'{DATA_DIR}/Restaurants_Geocoded.csv')
-health_inspections = pd.read_csv(f'{DATA_DIR}/DOHMH_New_York_City_Restaurant_Inspection_Results.csv')
+sales = load_and_preprocess('sales', columns=SOURCES['sales'].columns)
+# every tract level feed the registry merges with sales
+alt_sources = {name: load_and_preprocess(name, columns=spec.columns) for name, spec in SOURCES.items()
+               if spec.merge_with_sales and spec.geo_col == 'tract'}
+health_inspections = load_source('health_inspections', columns=['Census Tract', 'SCORE'])
 
 
 # %%
 
 def group_by_month_tract(df):
-    return df.groupby(['yr-month', 'tract_1000_grp'], as_index=False).agg({'tract': 'count'}).sort_values(by=['yr-month'])
-
-sales_month_grp = group_by_month_tract(sales)
-complaints_month_grp = group_by_month_tract(complaints)
-evictions_month_grp = group_by_month_tract(evictions)
-restaurants_month_grp = group_by_month_tract(restaurants)
-operating_businesses_month_grp = group_by_month_tract(operating_businesses)
+    return df.groupby(['month_key', 'tract_1000_grp'], as_index=False).agg({'tract': 'count'}).sort_values(by=['month_key'])
 
 # %%
-def merge_with_sales(alt_data, sales_data):
-    return pd.merge(sales_data, alt_data, how='left', on=['yr-month', 'tract_1000_grp'])
+# one (month, tract group, source) cube instead of a merged long frame per source; alt data counts are
+# left joined onto the months/groups with sales, like the old per-source merges
+def build_census_cube(path=f'{CUBE_DIR}/census_tract_groups_monthly'):
+    monthly = sales.groupby(['month_key', 'tract_1000_grp']).agg(sales=('tract', 'count'), SALE_PRICE=('SALE_PRICE', 'mean'))
+    for name, df in alt_sources.items():
+        monthly[name] = group_by_month_tract(df).set_index(['month_key', 'tract_1000_grp'])['tract']
+    cube = FeatureCube.create(path, geos=range(1, 31), sources=monthly.columns, freq='M', overwrite=True)
+    return cube.append_frame(monthly.reset_index(), 'month_key', 'tract_1000_grp')
 
-sales_complaints = merge_with_sales(complaints_month_grp, sales_month_grp)
-sales_evictions = merge_with_sales(evictions_month_grp, sales_month_grp)
-sales_restaurants = merge_with_sales(restaurants_month_grp, sales_month_grp)
-sales_operating_businesses = merge_with_sales(operating_businesses_month_grp, sales_month_grp)
+census_cube = build_census_cube()
 
 # %% [markdown]
 # # Exploratory Data Analysis
@@ -68,17 +69,17 @@ sales_operating_businesses = merge_with_sales(operating_businesses_month_grp, sa
 # note: visualize relationships btwn alt data and sales across tracts
 
 # %%
-def plot_time_series(data, dataset_name):
+def plot_time_series(cube, source, dataset_name):
     fig, axes = plt.subplots(3, 2, figsize=(15, 15))
     fig.suptitle(f'{dataset_name} Count and Average Sale Values per Census Tract Time Series')
     
     for i, ax in enumerate(axes.flatten()):
         tract = i + 1
-        tract_data = data[data['tract_1000_grp'] == float(tract)]
+        tract_data = cube.panel(tract)[[source, 'SALE_PRICE']].dropna(how='all')
         tract_data = (tract_data - tract_data.mean()) / tract_data.std()
         
-        sns.lineplot(x=tract_data['yr-month'], y=tract_data['tract'], color="red", ax=ax, label=dataset_name)
-        sns.lineplot(x=tract_data['yr-month'], y=tract_data['SALE_PRICE'], color="green", ax=ax, label="Avg Market Sale Price")
+        sns.lineplot(x=tract_data.index, y=tract_data[source], color="red", ax=ax, label=dataset_name)
+        sns.lineplot(x=tract_data.index, y=tract_data['SALE_PRICE'], color="green", ax=ax, label="Avg Market Sale Price")
         
         ax.set_title(f"Tract Group {tract}")
         ax.set_ylabel("Normalized Value")
@@ -88,10 +89,8 @@ def plot_time_series(data, dataset_name):
     plt.tight_layout()
     plt.show()
 
-plot_time_series(sales_complaints, "Complaints")
-plot_time_series(sales_evictions, "Evictions")
-plot_time_series(sales_restaurants, "Restaurants")
-plot_time_series(sales_operating_businesses, "Operating Businesses")
+for name in alt_sources:
+    plot_time_series(census_cube, name, name.replace('_', ' ').title())
 
 # %% [markdown]
 # # Granger Causality Analysis
@@ -99,24 +98,9 @@ plot_time_series(sales_operating_businesses, "Operating Businesses")
 # note: check if alt data helps predict sales, look at diff lags
 
 # %%
-def run_granger_tests(data, max_lag=10):
-    results = {}
-    for tract in range(1, 7):
-        tract_data = data[data['tract_1000_grp'] == float(tract)][['tract', 'SALE_PRICE']]
-        tract_data = (tract_data - tract_data.mean()) / tract_data.std()
-        
-        try:
-            granger_results = grangercausalitytests(tract_data, maxlag=max_lag, verbose=False)
-            results[tract] = [granger_results[i+1][0]['ssr_ftest'][1] for i in range(max_lag)]
-        except:
-            results[tract] = [np.nan] * max_lag
-    
-    return pd.DataFrame(results, index=[f'Lag {i}' for i in range(1, max_lag+1)]).T
-
-complaints_granger = run_granger_tests(sales_complaints)
-evictions_granger = run_granger_tests(sales_evictions)
-restaurants_granger = run_granger_tests(sales_restaurants)
-businesses_granger = run_granger_tests(sales_operating_businesses)
+# every (source, tract group) pair in one call, fits spread over the process pool
+panel = PanelAnalytics(census_cube, target='SALE_PRICE', sources=list(alt_sources), geos=range(1, 7))
+granger_results = panel.granger(max_lag=10)
 
 # %%
 def display_granger_results(results, title):
@@ -124,10 +108,8 @@ def display_granger_results(results, title):
     styled.set_caption(f'Granger Causality P-Values for {title} and Sales')
     display(styled)
 
-display_granger_results(complaints_granger, "Complaints")
-display_granger_results(evictions_granger, "Evictions")
-display_granger_results(restaurants_granger, "Restaurants")
-display_granger_results(businesses_granger, "Operating Businesses")
+for name in alt_sources:
+    display_granger_results(granger_results.loc[name], name.replace('_', ' ').title())
 
 # %% [markdown]
 # # Causal Impact Analysis
@@ -135,22 +117,9 @@ display_granger_results(businesses_granger, "Operating Businesses")
 # note: deeper look at causal effects, use pre/post periods
 
 # %%
-def run_causal_impact(data, intervention_point=0.7, tract=1.0):
-    tract_data = data[data['tract_1000_grp'] == float(tract)][['tract', 'SALE_PRICE']]
-    tract_data = (tract_data - tract_data.mean()) / tract_data.std()
-    tract_data.index = pd.to_datetime(data['yr-month'])
-    
-    pre_period = [tract_data.index[0], tract_data.index[int(len(tract_data) * intervention_point)]]
-    post_period = [tract_data.index[int(len(tract_data) * intervention_point) + 1], tract_data.index[-1]]
-    
-    ci = CausalImpact(tract_data, pre_period, post_period)
-    print(ci.summary())
-    ci.plot()
-
-run_causal_impact(sales_complaints, tract=3.0)
-run_causal_impact(sales_evictions, tract=3.0)
-run_causal_impact(sales_restaurants, tract=3.0)
-run_causal_impact(sales_operating_businesses, tract=3.0)
+# pre period = first 70% of each pair's months, counterfactual from a pre period regression on sale price
+impact_results = panel.impact(intervention_point=0.7)
+impact_results.xs(3, level='geo')
 
 # %% [markdown]
 # # forecasting
@@ -159,27 +128,25 @@ run_causal_impact(sales_operating_businesses, tract=3.0)
 
 # %%
 from statsmodels.tsa.stattools import adfuller
-from statsmodels.tsa.arima.model import ARIMA
 
 def test_stationarity(data):
     result = adfuller(data)
     print(f'ADF Statistic: {result[0]}')
     print(f'p-value: {result[1]}')
 
-def fit_arima(data):
-    model = ARIMA(data, order=(1,1,1))
-    results = model.fit()
-    print(results.summary())
-    
-    forecast = results.forecast(steps=12)
+def plot_forecast(data, forecast):
     plt.figure(figsize=(10,5))
     plt.plot(data.index, data, label='Observed')
-    plt.plot(forecast.index, forecast, color='r', label='Forecast')
+    plt.plot(forecast.index, forecast['forecast'], color='r', label='Forecast')
+    plt.fill_between(forecast.index, forecast['lower'], forecast['upper'], color='r', alpha=.2)
     plt.legend()
     plt.show()
 
-# Example for complaints data
-complaints_data = sales_complaints[sales_complaints['tract_1000_grp'] == 1.0].set_index('yr-month')['SALE_PRICE']
-test_stationarity(complaints_data)
-fit_arima(complaints_data)
+# ARIMA(1,1,1) sale price forecasts for every tract group at once
+forecasts = panel.arima(order=(1, 1, 1), steps=12)
+
+# Example for tract group 1
+sale_price = census_cube.panel(1)['SALE_PRICE'].dropna()
+test_stationarity(sale_price)
+plot_forecast(sale_price, forecasts.loc[('SALE_PRICE', 1)])
 # %%
@@ -20,8 +20,6 @@ load_dotenv()
 from utils.census_geocode_api import fetch_geocode_coordinates, extract_data
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
-from utils import db_utils
-psql_conn = db_utils.get_postgres_conn()
 
 st.set_page_config(layout="wide", page_title="ML Feature Exploration", page_icon="🤖")
 st.title("PropertizeAI: ML Feature Exploration")
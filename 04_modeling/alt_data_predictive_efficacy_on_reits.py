@@ -3,18 +3,63 @@ Purpose: Train and compare LSTM models with and without alt data
 in forecasting reit etfs, evaluating their impact on model performance.
 """
 
+import os
+import json
+import math
+import shutil
+import hashlib
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import keras
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from keras.models import Sequential
 from keras.layers import LSTM, Dense, Dropout
 from keras.optimizers import Adam
 from keras.callbacks import EarlyStopping
+from keras.utils import Sequence
+
+VALIDATION_SPLIT = 0.2  # tail of the training windows held out for early stopping, like fit(validation_split=0.2)
+SEED = 42
+EXPERIMENT_CACHE_DIR = os.getenv('ETF_EXPERIMENT_CACHE_DIR', 'etf_experiment_cache')
+MODEL_VERSION = 1  # bump when the model or training code changes beyond its hyperparameters, so cached jobs are retrained
+
+
+class WindowSequence(Sequence):
+    """Batches of look_back windows gathered from a sliding_window_view; only the current batch is copied."""
+
+    def __init__(self, windows, targets, indices, batch_size, shuffle=False, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.windows = windows
+        self.targets = targets
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        if shuffle:
+            self.rng.shuffle(self.indices)
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, i):
+        batch = self.indices[i * self.batch_size:(i + 1) * self.batch_size]
+        return self.windows[batch], self.targets[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
+
 
 class ETFPredictionModel:
-    def __init__(self, df, alt_features, base_features, etfs, look_back=1, epochs=100, batch_size=32, split_ratio=0.8):
+    def __init__(self, df, alt_features, base_features, etfs, look_back=1, epochs=100, batch_size=32, split_ratio=0.8,
+                 seed=SEED, lstm_units=(64, 32), dropout=0.2, learning_rate=0.001, patience=10):
         self.df = df
         self.alt_features = alt_features
         self.base_features = base_features
@@ -23,42 +68,62 @@ class ETFPredictionModel:
         self.epochs = epochs
         self.batch_size = batch_size
         self.split_ratio = split_ratio
+        self.seed = seed
+        self.lstm_units = tuple(lstm_units)
+        self.dropout = dropout
+        self.learning_rate = learning_rate
+        self.patience = patience
 
-    def prepare_data(self, features, target):
-        dataset = self.df[features + [target]].values
-        scaler = MinMaxScaler(feature_range=(0, 1))
-        dataset = scaler.fit_transform(dataset)
+    @property
+    def hyperparameters(self):
+        """Everything besides the data and features that changes a trained model, part of the experiment cache key."""
+        return {'look_back': self.look_back, 'epochs': self.epochs, 'batch_size': self.batch_size,
+                'split_ratio': self.split_ratio, 'seed': self.seed, 'lstm_units': list(self.lstm_units),
+                'dropout': self.dropout, 'learning_rate': self.learning_rate, 'patience': self.patience,
+                'validation_split': VALIDATION_SPLIT, 'model_version': MODEL_VERSION}
+
+    def prepare_data(self, features, target, fit_rows=None):
+        """Windows and targets; the scaler is fitted on the first fit_rows rows (all of them by default)."""
+        dataset = self.df[features + [target]].to_numpy(dtype=np.float64)
+        scaler = MinMaxScaler(feature_range=(0, 1)).fit(dataset[:fit_rows])
+        dataset = scaler.transform(dataset).astype(np.float32)
         
-        X, y = [], []
-        for i in range(len(dataset) - self.look_back):
-            X.append(dataset[i:(i + self.look_back), :-1])
-            y.append(dataset[i + self.look_back, -1])
-        return np.array(X), np.array(y), scaler
+        # X[i] = dataset[i:i + look_back, :-1] as a strided view (samples, look_back, features), no copies
+        X = sliding_window_view(dataset[:-1, :-1], self.look_back, axis=0).transpose(0, 2, 1)
+        y = dataset[self.look_back:, -1]
+        return X, y, scaler
 
     def create_lstm_model(self, input_shape):
-        model = Sequential([
-            LSTM(64, input_shape=input_shape, return_sequences=True),
-            Dropout(0.2),
-            LSTM(32),
-            Dropout(0.2),
-            Dense(1)
-        ])
-        model.compile(optimizer=Adam(learning_rate=0.001), loss='mean_squared_error')
+        layers = []
+        for i, units in enumerate(self.lstm_units):
+            # every LSTM but the last passes its whole sequence on to the next one
+            first = {'input_shape': input_shape} if i == 0 else {}
+            layers += [LSTM(units, return_sequences=i < len(self.lstm_units) - 1, **first), Dropout(self.dropout)]
+        model = Sequential([*layers, Dense(1)])
+        model.compile(optimizer=Adam(learning_rate=self.learning_rate), loss='mean_squared_error')
+        return model
+
+    def fit_lstm(self, X, y, train_size):
+        keras.utils.set_random_seed(self.seed)
+        model = self.create_lstm_model((X.shape[1], X.shape[2]))
+        early_stop = EarlyStopping(monitor='val_loss', patience=self.patience, restore_best_weights=True)
+        
+        fit_size = int(train_size * (1 - VALIDATION_SPLIT))
+        model.fit(WindowSequence(X, y, range(fit_size), self.batch_size, shuffle=True, seed=self.seed),
+                  validation_data=WindowSequence(X, y, range(fit_size, train_size), self.batch_size),
+                  epochs=self.epochs, callbacks=[early_stop], verbose=0)
         return model
 
+    def predict(self, model, X, y, start, stop):
+        return model.predict(WindowSequence(X, y, range(start, stop), self.batch_size), verbose=0)
+
     def train_lstm(self, X, y):
         train_size = int(len(X) * self.split_ratio)
-        X_train, X_test = X[:train_size], X[train_size:]
         y_train, y_test = y[:train_size], y[train_size:]
         
-        model = self.create_lstm_model((X.shape[1], X.shape[2]))
-        early_stop = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
-        
-        model.fit(X_train, y_train, validation_split=0.2, epochs=self.epochs, 
-                  batch_size=self.batch_size, callbacks=[early_stop], verbose=0)
-        
-        train_predict = model.predict(X_train)
-        test_predict = model.predict(X_test)
+        model = self.fit_lstm(X, y, train_size)
+        train_predict = self.predict(model, X, y, 0, train_size)
+        test_predict = self.predict(model, X, y, train_size, len(X))
         
         return train_predict, test_predict, y_train, y_test
 
@@ -86,36 +151,234 @@ class ETFPredictionModel:
         df['Test'] = df['Predicted'][train_size:]
         return df
 
-    def run_experiment(self):
+    def run_job(self, etf, features, weights_path=None):
+        """Train and evaluate one model of etf on features; the predictions frame spans train and test."""
+        X, y, scaler = self.prepare_data(features + [etf], etf)
+        train_size = int(len(X) * self.split_ratio)
+        model = self.fit_lstm(X, y, train_size)
+        if weights_path:
+            model.save_weights(weights_path)
+        y_pred = self.predict(model, X, y, 0, len(X))[:, 0]
+        # only the target (last) column of the fitted scaler is inverted
+        y_true = (y - scaler.min_[-1]) / scaler.scale_[-1]
+        y_pred = (y_pred - scaler.min_[-1]) / scaler.scale_[-1]
+        predictions = self.get_model_predictions(self.df['date'].iloc[self.look_back:].to_numpy(), y_true, y_pred, train_size)
+        return self.evaluate_model(y_true, y_pred), predictions
+
+    def run_experiment(self, max_workers=None, cache_dir=EXPERIMENT_CACHE_DIR):
         """Run experiment comparing models with and without alternative data."""
-        results_treatment = []
-        results_control = []
-        model_predictions = []
-
-        for etf in self.etfs:
-            print(f"Processing ETF: {etf}")
-            
-            # Model with alternative data
-            X, y, scaler = self.prepare_data(self.alt_features + [etf], etf)
-            train_pred, test_pred, y_train, y_test = self.train_lstm(X, y)
-            y_pred = np.concatenate([train_pred, test_pred])
-            y_true = scaler.inverse_transform(np.concatenate([y_train, y_test]).reshape(-1, 1))[:, 0]
-            y_pred = scaler.inverse_transform(y_pred)[:, 0]
-            results = self.evaluate_model(y_true, y_pred)
-            results_treatment.append(results)
-            model_predictions.append(self.get_model_predictions(self.df['date'], y_true, y_pred, len(train_pred)))
-            
-            # Model without alternative data
-            X, y, scaler = self.prepare_data(self.base_features + [etf], etf)
-            train_pred, test_pred, y_train, y_test = self.train_lstm(X, y)
-            y_pred = np.concatenate([train_pred, test_pred])
-            y_true = scaler.inverse_transform(np.concatenate([y_train, y_test]).reshape(-1, 1))[:, 0]
-            y_pred = scaler.inverse_transform(y_pred)[:, 0]
-            results = self.evaluate_model(y_true, y_pred)
-            results_control.append(results)
+        runner = ExperimentRunner(self, cache_dir=cache_dir, max_workers=max_workers)
+        results = runner.run({'treatment': self.alt_features, 'control': self.base_features})
+        results_treatment = [results[(etf, 'treatment')][0] for etf in self.etfs]
+        results_control = [results[(etf, 'control')][0] for etf in self.etfs]
+        model_predictions = [results[(etf, 'treatment')][1] for etf in self.etfs]
 
         return results_treatment, results_control, model_predictions
 
+    def backtest(self, n_folds=5, window='expanding', max_workers=None, **kwargs):
+        """Walk-forward fold metrics of every ETF with (treatment) and without (control) alternative data."""
+        backtester = WalkForwardBacktester(self, n_folds=n_folds, window=window, max_workers=max_workers, **kwargs)
+        return backtester.run({'treatment': self.alt_features, 'control': self.base_features})
+
+
+def _init_worker(threads):
+    # split the cores between workers instead of every TensorFlow runtime claiming all of them
+    if keras.backend.backend() == 'tensorflow':
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        tf.config.experimental.enable_op_determinism()
+
+
+def worker_pool(n_jobs, max_workers=None):
+    """Process pool for n_jobs model fits, the cores split evenly between its workers."""
+    workers = min(max_workers or os.cpu_count(), n_jobs)
+    # spawned workers start with a fresh TensorFlow runtime; forking one that is already running is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(max(1, os.cpu_count() // workers),))
+
+
+def _run_cached_job(args):
+    model, etf, arm, features, job_dir = args
+    job_dir = Path(job_dir)
+    tmp_dir = job_dir.with_name(f'{job_dir.name}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    metrics, predictions = model.run_job(etf, features, weights_path=tmp_dir / 'model.weights.h5')
+    # plain floats, the same types a cached job loads back from metrics.json
+    metrics = {k: float(v) for k, v in metrics.items()}
+    predictions.to_parquet(tmp_dir / 'predictions.parquet')
+    (tmp_dir / 'metrics.json').write_text(json.dumps(metrics))
+    # a job_dir without metrics.json is left over from an interrupted run
+    shutil.rmtree(job_dir, ignore_errors=True)
+    tmp_dir.replace(job_dir)
+    print(f'Trained {etf} ({arm})')
+    return metrics, predictions
+
+
+class ExperimentRunner:
+    """(ETF, feature set) jobs on a process pool, each cached under a hash of its data, features and hyperparameters."""
+
+    def __init__(self, model, cache_dir=EXPERIMENT_CACHE_DIR, max_workers=None):
+        self.model = model
+        self.cache_dir = Path(cache_dir)
+        self.max_workers = max_workers or os.cpu_count()
+
+    def job_key(self, etf, features):
+        columns = list(dict.fromkeys(['date', *features, etf]))
+        digest = hashlib.sha256(pd.util.hash_pandas_object(self.model.df[columns], index=False).to_numpy().tobytes())
+        digest.update(json.dumps([features, etf, self.model.hyperparameters], sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def load(self, job_dir):
+        metrics = json.loads((job_dir / 'metrics.json').read_text())
+        return metrics, pd.read_parquet(job_dir / 'predictions.parquet')
+
+    def run(self, feature_sets):
+        """
+        Results of every (etf, arm) job, training only those without a cached result.
+
+        :param feature_sets: arm name -> feature list, e.g. {'treatment': alt_features, 'control': base_features}.
+        :return: (etf, arm) -> (metrics, predictions frame).
+        """
+        jobs = {(etf, arm): self.cache_dir / f'{etf}-{arm}-{self.job_key(etf, features)}'
+                for etf in self.model.etfs for arm, features in feature_sets.items()}
+        results = {job: self.load(job_dir) for job, job_dir in jobs.items() if (job_dir / 'metrics.json').exists()}
+        pending = [job for job in jobs if job not in results]
+        print(f'{len(results)} cached jobs, {len(pending)} to train')
+        if pending:
+            with worker_pool(len(pending), self.max_workers) as executor:
+                args = [(self.model, etf, arm, feature_sets[arm], str(jobs[(etf, arm)])) for etf, arm in pending]
+                results.update(zip(pending, executor.map(_run_cached_job, args)))
+        return results
+
+
+def _run_walk_forward(args):
+    backtester, etf, arm, features = args
+    folds = backtester.walk_forward(etf, features)
+    print(f'Backtested {etf} ({arm})')
+    return folds
+
+
+class WalkForwardBacktester:
+    """
+    Walk-forward evaluation of the ETF models over several consecutive test periods.
+
+    The first fold is a full fit on the initial training window. Every later fold continues from the previous
+    fold's weights and trains only on the windows that have become available since (the previous fold's test
+    period), with early stopping on the newest part of the training window, so n folds cost little more than
+    one fit. The scaler is fitted on the initial training window only and kept for all folds.
+    """
+
+    def __init__(self, model, n_folds=5, window='expanding', initial_size=None, fine_tune_epochs=None, patience=5,
+                 max_workers=None):
+        """
+        :param model: ETFPredictionModel providing the data, windows and hyperparameters.
+        :param n_folds: Number of consecutive test periods.
+        :param window: 'expanding' (training window starts at the first sample) or 'rolling' (fixed length).
+        :param initial_size: Windows in the first training window (the rolling window length), half of them by
+            default; the windows after it are split into n_folds test periods.
+        :param fine_tune_epochs: Epoch limit of the warm-started folds, model.epochs by default.
+        :param patience: Early stopping patience of the warm-started folds.
+        :param max_workers: Process pool size, every core by default.
+        """
+        if window not in ('expanding', 'rolling'):
+            raise ValueError(f'Unknown window {window}')
+        self.model = model
+        self.n_folds = n_folds
+        self.window = window
+        self.initial_size = initial_size
+        self.fine_tune_epochs = fine_tune_epochs or model.epochs
+        self.patience = patience
+        self.max_workers = max_workers
+
+    def splits(self, n_samples):
+        """(train start, train end, test end) window indices of every fold."""
+        initial_size = self.initial_size or n_samples // 2
+        test_size = (n_samples - initial_size) // self.n_folds
+        if test_size < 1:
+            raise ValueError(f'{n_samples} windows are too few for {self.n_folds} folds after {initial_size} training windows')
+        splits = []
+        for fold in range(self.n_folds):
+            train_end = initial_size + fold * test_size
+            train_start = train_end - initial_size if self.window == 'rolling' else 0
+            test_end = n_samples if fold == self.n_folds - 1 else train_end + test_size
+            splits.append((train_start, train_end, test_end))
+        return splits
+
+    def walk_forward(self, etf, features):
+        """
+        Metrics of every fold for one ETF and feature set.
+
+        :param etf: Target ETF column.
+        :param features: Feature columns.
+        :return: One row per fold: train / test periods, epochs trained and the test metrics.
+        """
+        etf_model = self.model
+        n_samples = len(etf_model.df) - etf_model.look_back
+        splits = self.splits(n_samples)
+        # the scaler sees the rows of the first training window only (its targets end at row train_end + look_back)
+        X, y, scaler = etf_model.prepare_data(features + [etf], etf, fit_rows=splits[0][1] + etf_model.look_back)
+        dates = etf_model.df['date'].iloc[etf_model.look_back:].to_numpy()
+
+        rows, model, fitted_until = [], None, 0
+        for fold, (train_start, train_end, test_end) in enumerate(splits):
+            val_size = max(1, int((train_end - train_start) * VALIDATION_SPLIT))
+            fit_end = train_end - val_size
+            validation = WindowSequence(X, y, range(fit_end, train_end), etf_model.batch_size)
+            if model is None:
+                keras.utils.set_random_seed(etf_model.seed)
+                model = etf_model.create_lstm_model((X.shape[1], X.shape[2]))
+                fit_start, epochs, patience = train_start, etf_model.epochs, etf_model.patience
+            else:
+                # warm start: only the windows that were not trained on yet
+                fit_start, epochs, patience = fitted_until, self.fine_tune_epochs, self.patience
+            epochs_trained = 0
+            if fit_end > fit_start:
+                early_stop = EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)
+                history = model.fit(WindowSequence(X, y, range(fit_start, fit_end), etf_model.batch_size, shuffle=True,
+                                                   seed=etf_model.seed + fold),
+                                    validation_data=validation, epochs=epochs, callbacks=[early_stop], verbose=0)
+                epochs_trained = len(history.history['loss'])
+                fitted_until = fit_end
+
+            y_pred = etf_model.predict(model, X, y, train_end, test_end)[:, 0]
+            y_true = (y[train_end:test_end] - scaler.min_[-1]) / scaler.scale_[-1]
+            y_pred = (y_pred - scaler.min_[-1]) / scaler.scale_[-1]
+            rows.append({'fold': fold, 'train_start': dates[train_start], 'test_start': dates[train_end],
+                         'test_end': dates[test_end - 1], 'trained_windows': max(fit_end - fit_start, 0),
+                         'epochs': epochs_trained, **etf_model.evaluate_model(y_true, y_pred)})
+        return pd.DataFrame(rows)
+
+    def run(self, feature_sets):
+        """
+        Fold metrics of every (etf, arm), the (etf, arm) backtests spread over a process pool.
+
+        :param feature_sets: arm name -> feature list, e.g. {'treatment': alt_features, 'control': base_features}.
+        :return: Metrics indexed by (etf, arm, fold).
+        """
+        jobs = [(etf, arm) for etf in self.model.etfs for arm in feature_sets]
+        with worker_pool(len(jobs), self.max_workers) as executor:
+            folds = list(executor.map(_run_walk_forward, [(self, etf, arm, feature_sets[arm]) for etf, arm in jobs]))
+        folds = pd.concat(folds, keys=jobs, names=['etf', 'arm']).droplevel(-1)
+        return folds.set_index('fold', append=True)
+
+    @staticmethod
+    def summarize(folds, metrics=('MSE', 'RMSE', 'MAE', 'SMAPE')):
+        """Mean and standard deviation of each metric across folds, per (etf, arm)."""
+        return folds[list(metrics)].astype(float).groupby(level=['etf', 'arm']).agg(['mean', 'std'])
+
+    @staticmethod
+    def compare(folds, metric='SMAPE', treatment='treatment', control='control'):
+        """Per ETF: mean metric of each arm and how often the treatment beat the control fold by fold."""
+        values = folds[metric].astype(float).unstack('arm')
+        by_etf = values.groupby(level='etf')
+        comparison = by_etf.mean()[[control, treatment]]
+        comparison['difference'] = comparison[treatment] - comparison[control]
+        comparison['treatment_wins'] = (values[treatment] < values[control]).groupby(level='etf').mean()
+        return comparison
+
+
 def plot_results(control):
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.bar(control.index, control['Difference'], color='#DC143C')
@@ -126,44 +389,50 @@ def plot_results(control):
     fig.tight_layout()
     plt.show()
 
-# Load data and run experiment
-df = pd.read_csv('data_with_etfs.csv')
-alt_features = ['avg_sales', 'sales_count', 'target_ci', 'target_citi', 'target_op', 'target_ev', 'target_hi']
-base_features = ['avg_sales']
-etfs = ['VNQ', 'MORT', 'REM', 'KBWY', 'RWR', 'ICF', 'SCHH', 'IYR', 'USRT', 'REET']
+if __name__ == '__main__':
+    # Load data and run experiment
+    df = pd.read_csv('data_with_etfs.csv')
+    alt_features = ['avg_sales', 'sales_count', 'target_ci', 'target_citi', 'target_op', 'target_ev', 'target_hi']
+    base_features = ['avg_sales']
+    etfs = ['VNQ', 'MORT', 'REM', 'KBWY', 'RWR', 'ICF', 'SCHH', 'IYR', 'USRT', 'REET']
+
+    model = ETFPredictionModel(df, alt_features, base_features, etfs)
+    results_treatment, results_control, model_predictions = model.run_experiment()
 
-model = ETFPredictionModel(df, alt_features, base_features, etfs)
-results_treatment, results_control, model_predictions = model.run_experiment()
+    # Create comparison df
+    etf_lstm_results_treatment = [{etf: results['SMAPE']} for etf, results in zip(etfs, results_treatment)]
+    etf_lstm_results_control = [{etf: results['SMAPE']} for etf, results in zip(etfs, results_control)]
 
-# Create comparison df
-etf_lstm_results_treatment = [{etf: results['SMAPE']} for etf, results in zip(etfs, results_treatment)]
-etf_lstm_results_control = [{etf: results['SMAPE']} for etf, results in zip(etfs, results_control)]
+    etf_lstm_results_treatment = {k: v for d in etf_lstm_results_treatment for k, v in d.items()}
+    etf_lstm_results_control = {k: v for d in etf_lstm_results_control for k, v in d.items()}
 
-etf_lstm_results_treatment = {k: v for d in etf_lstm_results_treatment for k, v in d.items()}
-etf_lstm_results_control = {k: v for d in etf_lstm_results_control for k, v in d.items()}
 
+    control = pd.DataFrame.from_dict(etf_lstm_results_control, orient='index', columns=['Control'])
+    control['Treatment'] = pd.DataFrame.from_dict(etf_lstm_results_treatment, orient='index', columns=['SMAPE'])
+    control['Difference'] = control['Treatment'] - control['Control']
+    control = control.sort_values(by='Difference', ascending=False)
 
-control = pd.DataFrame.from_dict(etf_lstm_results_control, orient='index', columns=['Control'])
-control['Treatment'] = pd.DataFrame.from_dict(etf_lstm_results_treatment, orient='index', columns=['SMAPE'])
-control['Difference'] = control['Treatment'] - control['Control']
-control = control.sort_values(by='Difference', ascending=False)
+    plot_results(control)
+    print(control)
 
-plot_results(control)
-print(control)
 
+    base_mae = [d['MAE'] for d in results_control]
+    treatment_mae = [d['MAE'] for d in results_treatment]
+    compare = pd.DataFrame([base_mae, treatment_mae], index=['control', 'treatment']).T
+    compare['difference'] = compare['control'] - compare['treatment']
+    print(compare)
 
-base_mae = [d['MAE'] for d in results_control]
-treatment_mae = [d['MAE'] for d in results_treatment]
-compare = pd.DataFrame([base_mae, treatment_mae], index=['control', 'treatment']).T
-compare['difference'] = compare['control'] - compare['treatment']
-print(compare)
+    # Calculate average difference and percent difference
+    avg_difference = compare['difference'].mean()
+    tmean = compare['treatment'].mean()
+    cmean = compare['control'].mean()
+    percent_difference = (cmean - tmean) / cmean * 100
 
-# Calculate average difference and percent difference
-avg_difference = compare['difference'].mean()
-tmean = compare['treatment'].mean()
-cmean = compare['control'].mean()
-percent_difference = (cmean - tmean) / cmean * 100
+    print(f"Average MAE difference: {avg_difference}")
+    print(f"Average percent difference: {percent_difference}%")
+    print(f"Treatment mean: {tmean}, Control mean: {cmean}")
 
-print(f"Average MAE difference: {avg_difference}")
-print(f"Average percent difference: {percent_difference}%")
-print(f"Treatment mean: {tmean}, Control mean: {cmean}")
\ No newline at end of file
+    # Walk-forward comparison over several test periods
+    folds = model.backtest(n_folds=5)
+    print(WalkForwardBacktester.summarize(folds))
+    print(WalkForwardBacktester.compare(folds))
@@ -1,3 +1,5 @@
+-- Full rebuild, kept for reference. The view is now maintained incrementally from per-source daily
+-- summary tables by utils/daily_summary_refresh.py (02_data_collection/refresh_alt_data_daily_mv.py).
 DROP MATERIALIZED VIEW IF EXISTS nyc_alt_data_daily;
 CREATE MATERIALIZED VIEW nyc_alt_data_daily AS 
 WITH sales_sub AS (
@@ -0,0 +1,111 @@
+"""
+Purpose: Tests for utils/partition_migration.py against a real Postgres.
+
+Skipped unless ALT_DATA_TEST_DSN points at a scratch database, e.g.
+ALT_DATA_TEST_DSN=postgresql+psycopg2://postgres@localhost:5432/alt_data_test python -m pytest tests
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+DSN = os.getenv('ALT_DATA_TEST_DSN')
+if not DSN:
+    pytest.skip('ALT_DATA_TEST_DSN is not set', allow_module_level=True)
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from utils.partition_migration import (ensure_partitions, load_month, load_partitioned, migrate_table,
+                                       partition_name, partitions)
+
+TABLE = 'partition_migration_test_rides'
+TIME_COL = 'start_time'
+
+
+def rides(month: str, n: int, seed: int = 0) -> pd.DataFrame:
+    """n rides at random times within month."""
+    start = pd.Timestamp(month)
+    seconds = (start + pd.DateOffset(months=1) - start).total_seconds()
+    offsets = np.random.default_rng(seed).integers(0, int(seconds), n)
+    return pd.DataFrame({TIME_COL: start + pd.to_timedelta(offsets, 's'), 'ride_id': np.arange(n) + seed * 10_000})
+
+
+def counts(engine) -> dict:
+    """Rows per partition."""
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f'SELECT tableoid::regclass::text, COUNT(*) FROM {TABLE} GROUP BY 1')).all())
+
+
+def drop(engine) -> None:
+    with engine.begin() as conn:
+        for table in (TABLE, f'{TABLE}_unpartitioned', f'{TABLE}__partitioned'):
+            conn.execute(text(f'DROP TABLE IF EXISTS {table} CASCADE'))
+
+
+@pytest.fixture
+def engine():
+    engine = sa.create_engine(DSN)
+    drop(engine)
+    yield engine
+    drop(engine)
+    engine.dispose()
+
+
+def test_default_rows_are_moved_before_attach(engine):
+    load_partitioned(engine, TABLE, TIME_COL, rides('2020-01-01', 100))
+    # April rows loaded before April's partition exists land in DEFAULT
+    with engine.begin() as conn:
+        rides('2020-04-01', 10, seed=1).to_sql(TABLE, conn, if_exists='append', index=False)
+    assert counts(engine)[f'{TABLE}_default'] == 10
+
+    load_month(engine, TABLE, TIME_COL, rides('2020-04-01', 5, seed=2), '2020-04-01', replace=False)
+    assert counts(engine) == {partition_name(TABLE, '2020-01-01'): 100, partition_name(TABLE, '2020-04-01'): 15}
+
+    with engine.begin() as conn:
+        rides('2020-05-01', 7, seed=3).to_sql(TABLE, conn, if_exists='append', index=False)
+    load_month(engine, TABLE, TIME_COL, rides('2020-05-01', 3, seed=4), '2020-05-01', replace=True)
+    assert counts(engine)[partition_name(TABLE, '2020-05-01')] == 3
+    assert f'{TABLE}_default' not in counts(engine)
+
+
+def test_month_is_attached_through_a_check_constraint(engine):
+    load_partitioned(engine, TABLE, TIME_COL, rides('2020-01-01', 50))
+    load_month(engine, TABLE, TIME_COL, rides('2020-02-01', 20, seed=1), '2020-02-01')
+    part = partition_name(TABLE, '2020-02-01')
+    with engine.connect() as conn:
+        bound = conn.execute(text('SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE relname = :part'),
+                             {'part': part}).scalar()
+        constraints = conn.execute(text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:part) "
+                                        "AND contype = 'c'"), {'part': part}).scalars().all()
+        leftovers = conn.execute(text("SELECT relname FROM pg_class WHERE relname LIKE :stage"),
+                                 {'stage': f'{TABLE}%_stage'}).scalars().all()
+    assert bound == "FOR VALUES FROM ('2020-02-01 00:00:00') TO ('2020-03-01 00:00:00')"
+    assert constraints == [] and leftovers == []
+    assert counts(engine)[part] == 20
+
+    # rows outside the month fail the staging table's CHECK and the whole load rolls back
+    with pytest.raises(sa.exc.IntegrityError):
+        load_month(engine, TABLE, TIME_COL, rides('2020-03-01', 5, seed=2), '2020-02-01')
+    assert counts(engine)[part] == 20
+    with engine.connect() as conn:
+        assert partitions(conn, TABLE) == sorted([f'{TABLE}_default', partition_name(TABLE, '2020-01-01'), part])
+
+
+def test_rerun_is_a_no_op(engine):
+    df = pd.concat([rides('2020-01-01', 40), rides('2020-02-01', 30, seed=1), rides('2020-03-01', 20, seed=2)])
+    with engine.begin() as conn:
+        df.to_sql(TABLE, conn, index=False)
+    migrate_table(engine, TABLE, TIME_COL, keep_old=False)
+    migrated = counts(engine)
+    assert sum(migrated.values()) == len(df)
+
+    load_partitioned(engine, TABLE, TIME_COL, df)
+    load_partitioned(engine, TABLE, TIME_COL, df)
+    assert counts(engine) == migrated
+    with engine.begin() as conn:
+        assert ensure_partitions(conn, TABLE, pd.date_range('2020-01-01', '2020-03-01', freq='MS')) == []
+        rows = pd.read_sql(text(f'SELECT * FROM {TABLE} ORDER BY ride_id'), conn)
+    pd.testing.assert_frame_equal(rows, df.sort_values('ride_id').reset_index(drop=True), check_dtype=False)
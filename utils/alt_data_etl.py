@@ -0,0 +1,192 @@
+"""
+Purpose: ETL engine driven by the source registry (utils/alt_data_sources.py).
+
+Every registered source is loaded from the Parquet mirror, standardized and aggregated in its own worker
+process; all of a source's (period, geography) aggregates come from one RollupCube (utils/rollup_cube.py),
+built from the spec's projected columns only. Each source only reloads the month partitions whose row
+counts changed for that source; workers write those raw partitions (every source column) and their
+aggregate partitions straight to the database, and the sales merges read back just the monthly
+aggregates of the months that changed in sales or in the merged source.
+
+Grouping and merging happen on integer month keys (utils/date_utils.py); the 'yr-month' label the
+database tables are keyed on is only added when a frame is written.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+from utils.alt_data_sources import SOURCES, SourceSpec
+from utils.alt_data_store import load_source
+from utils.db_utils import get_engine
+from utils.date_utils import parse_dates, month_key, month_key_from_label, period_categorical
+from utils.etl_watermarks import (month_partition_counts, changed_partitions, replace_partitions, reset_source,
+                                  save_watermark)
+from utils.rollup_cube import PERIOD_COLUMNS, RollupCube, tract_group
+
+PERIOD_FREQS = {col: freq for freq, col in PERIOD_COLUMNS.items()}
+
+
+def standardize_dates(df, date_col, new_col='date', date_format=None):
+    df[new_col] = parse_dates(df[date_col], date_format)
+    df['year'] = df[new_col].dt.year.astype('Int16')
+    df['month_key'] = month_key(df[new_col])
+    return df
+
+
+def with_month_label(df: pd.DataFrame) -> pd.DataFrame:
+    """Swap the integer month_key for the 'yr-month' label used by the output tables, as an ordered categorical."""
+    if 'month_key' not in df.columns:
+        return df
+    df = df.rename(columns={'month_key': 'yr-month'})
+    df['yr-month'] = period_categorical(df['yr-month'].to_numpy(), 'M')
+    return df
+
+
+def group_by_tract(df, col='tract'):
+    """Group data by census tract."""
+    groups = tract_group(df[col])
+    df['tract_1000_grp'] = np.where(groups > 0, groups, np.nan)
+    return df
+
+
+def prepare_source(spec: SourceSpec, start: str = None, projected: bool = True,
+                   months: Iterable[str] = None) -> pd.DataFrame:
+    """Load, filter, derive and standardize one source (or just some 'YYYY-MM' months of it); projected=False
+    keeps every source column."""
+    columns = None if spec.columns is None or not projected else list(spec.columns)
+    df = load_source(spec.name, columns=columns, start=start, months=months)
+    df = standardize_dates(df, 'date', date_format=spec.date_format)
+    for expr in spec.filters:
+        df = df.query(expr, engine='python')
+    for transform in spec.transforms:
+        df = transform(df)
+    if spec.geo_col:
+        df = group_by_tract(df, spec.geo_col)
+    return df
+
+
+def build_cube(spec: SourceSpec, df: pd.DataFrame) -> RollupCube:
+    """Single pass over the rows at the finest period any of the source's aggregations needs."""
+    freqs = {PERIOD_FREQS[period_col] for period_col, *_ in spec.aggregations.values()}
+    # weeks do not roll up into months or years, so mixing them needs days
+    finest = 'D' if 'D' in freqs or ('W' in freqs and len(freqs) > 1) else min(freqs, key='WMY'.index)
+    value_cols = {col for _, agg, *_ in spec.aggregations.values() for col in agg if col != spec.geo_col}
+    return RollupCube.build(df, sorted(value_cols), freq=finest, tract_col=spec.geo_col, county_col=spec.county_col)
+
+
+def aggregate_source(spec: SourceSpec, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    if not spec.aggregations:
+        return {}
+    cube = build_cube(spec, df)
+    tables = {}
+    for suffix, (period_col, agg, *geo) in spec.aggregations.items():
+        rolled = cube.rollup(PERIOD_FREQS[period_col], geo[0] if geo else 'tract_1000_grp')
+        tables[f'{spec.name}_{suffix}'] = rolled.frame(agg)
+    return tables
+
+
+def source_partition_counts(spec: SourceSpec) -> Tuple[pd.Series, pd.Timestamp]:
+    """Row count per 'YYYY-MM' partition and the last date of a source."""
+    dates = load_source(spec.name, columns=[])['date']
+    return month_partition_counts(dates), dates.max()
+
+
+def process_source(spec: SourceSpec, db_url: str, months: Set[str]) -> List[str]:
+    """
+    Worker: rebuild the given month partitions of one source and its aggregates.
+
+    :param spec: Source to process.
+    :param db_url: SQLAlchemy URL the worker writes to.
+    :param months: 'YYYY-MM' partitions of this source to recompute; yearly aggregates cover the years they fall in.
+    :return: Tables written.
+    """
+    years = {int(month[:4]) for month in months}
+    keys = month_key_from_label(sorted(months))
+    engine = get_engine(db_url)
+    # the raw table keeps every source column (SALE_DATE, ARREST_DATE, ... are read downstream)
+    raw = prepare_source(spec, projected=False, months=months)
+    replace_partitions(with_month_label(raw), spec.name, engine, 'yr-month', sorted(months))
+    del raw
+
+    # yearly aggregates need every month of the touched years, monthly ones just the changed months
+    yearly = any(period_col == 'year' for period_col, *_ in spec.aggregations.values())
+    df = prepare_source(spec, months={f'{year}-{month:02d}' for year in years for month in range(1, 13)}
+                        if yearly else months)
+    # one cube over the loaded rows serves both the yearly and the (filtered) monthly aggregates
+    tables = aggregate_source(spec, df)
+    for name, table in tables.items():
+        if 'year' in table.columns:
+            period_col, partitions = 'year', years
+        else:
+            tables[name] = table = table[table['month_key'].isin(keys)].reset_index(drop=True)
+            period_col, partitions = 'yr-month', months
+        replace_partitions(with_month_label(table), name, engine, period_col, sorted(partitions))
+
+    return [spec.name, *tables]
+
+
+def read_month_partitions(engine, table: str, months: Iterable[str]) -> pd.DataFrame:
+    """Rows of some 'yr-month' partitions of a monthly aggregate table, keyed by month_key again."""
+    if not inspect(engine).has_table(table):
+        return pd.DataFrame(columns=['month_key', 'tract_1000_grp'])
+    query = text(f'SELECT * FROM "{table}" WHERE "yr-month" IN :months').bindparams(bindparam('months', expanding=True))
+    df = pd.read_sql(query, engine, params={'months': sorted(months)})
+    df.insert(0, 'month_key', month_key_from_label(df.pop('yr-month')))
+    return df
+
+
+def reset_projected_raw_tables(engine, specs: Iterable[SourceSpec]) -> None:
+    """Drop raw tables written with projected columns only (no raw date column) so they are rebuilt in full."""
+    inspector = inspect(engine)
+    for spec in specs:
+        if inspector.has_table(spec.name):
+            columns = {col['name'] for col in inspector.get_columns(spec.name)}
+            if spec.date_col not in columns:
+                print(f'Raw table {spec.name} lacks {spec.date_col}, rebuilding every month')
+                reset_source(engine, spec.name, tables=[spec.name])
+
+
+def run_sources(db_url: str, specs: Iterable[SourceSpec] = None, max_workers: int = None) -> Set[str]:
+    """
+    Incrementally load, standardize and aggregate every registered source in parallel.
+
+    :param db_url: SQLAlchemy URL of the output database.
+    :param specs: Sources to run, defaults to every entry in SOURCES.
+    :param max_workers: Process pool size.
+    :return: The month partitions that were recomputed, over all sources.
+    """
+    specs: List[SourceSpec] = list(specs or SOURCES.values())
+    engine = get_engine(db_url)
+    reset_projected_raw_tables(engine, specs)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        partition_counts = dict(zip([spec.name for spec in specs], executor.map(source_partition_counts, specs)))
+        # months are tracked per source, so one late row only rebuilds its own source's month
+        changed = {name: changed_partitions(engine, name, counts) for name, (counts, _) in partition_counts.items()}
+        todo = [spec for spec in specs if changed[spec.name]]
+        if not todo:
+            print('No new or late-arriving partitions, nothing to do.')
+            return set()
+        for spec in todo:
+            months = changed[spec.name]
+            print(f'{spec.name}: recomputing {len(months)} month partitions: {min(months)} .. {max(months)}')
+        list(executor.map(process_source, todo, [db_url] * len(todo), [changed[spec.name] for spec in todo]))
+
+    # Merge sales data with other datasets, for the months that changed on either side
+    if 'sales' in changed:
+        for spec in specs:
+            months = changed['sales'] | changed[spec.name]
+            if spec.merge_with_sales and months:
+                merged = pd.merge(read_month_partitions(engine, 'sales_month', months),
+                                  read_month_partitions(engine, f'{spec.name}_month', months),
+                                  how='right', on=['month_key', 'tract_1000_grp'])
+                replace_partitions(with_month_label(merged), f'sales_{spec.name}', engine, 'yr-month', sorted(months))
+
+    for spec in todo:
+        counts, last_date = partition_counts[spec.name]
+        save_watermark(engine, spec.name, last_date, counts)
+    return set().union(*changed.values())
@@ -0,0 +1,70 @@
+"""
+Purpose: Declarative registry of the alt data sources.
+
+Each SourceSpec says where a feed lives, which column holds its date, which column holds its census
+geography, how to filter/derive columns and which (period, geography) aggregates to build. The ETL engine
+in utils/alt_data_etl.py and the Parquet mirror in utils/alt_data_store.py are both driven from SOURCES,
+so adding a feed is one entry here, e.g.
+
+    SourceSpec('arrests', 'NYPD_Arrests_Geocoded.csv', date_col='ARREST_DATE', date_format='%m/%d/%Y',
+               aggregations={'month': ('month_key', {'tract': 'count'})}, merge_with_sales=True)
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class SourceSpec:
+    name: str
+    path: str                                       # file under DATA_DIR
+    date_col: str                                   # raw date column, parsed into 'date'
+    date_format: Optional[str] = None               # strptime format of date_col, None to infer
+    geo_col: Optional[str] = 'tract'                # census tract column, None for non-geographic feeds
+    county_col: Optional[str] = None                # county FIPS / GEOID column, needed for borough rollups
+    columns: Optional[Tuple[str, ...]] = ('tract',)  # columns to load besides 'date', None loads everything
+    filters: Tuple[str, ...] = ()                   # DataFrame.query expressions applied after loading
+    transforms: Tuple[Callable[[pd.DataFrame], pd.DataFrame], ...] = ()  # module level so they pickle
+    # suffix -> (period key, agg) or (period key, agg, geo level), geo level defaults to 'tract_1000_grp'
+    aggregations: Dict[str, Tuple] = field(default_factory=dict)
+    merge_with_sales: bool = False                  # build sales_<name> from the monthly aggregate
+    numeric_cols: Tuple[str, ...] = ()              # other numeric CSV columns; the rest are mirrored as text
+
+    @property
+    def numeric_columns(self) -> Tuple[str, ...]:
+        """CSV columns mirrored as float64: the geography, the projected columns and numeric_cols."""
+        columns = (self.geo_col, *(self.columns or ()), *self.numeric_cols)
+        return tuple(dict.fromkeys(col for col in columns if col and col not in (self.date_col, self.county_col)))
+
+
+def add_health_grade(df: pd.DataFrame) -> pd.DataFrame:
+    df['GRADE'] = np.select([df['SCORE'] < 14, df['SCORE'] <= 27], ['A', 'B'], default='C')
+    return df
+
+
+COUNT_BY_YEAR = ('year', {'tract': 'count'})
+COUNT_BY_MONTH = ('month_key', {'tract': 'count'})
+
+SOURCES: Dict[str, SourceSpec] = {spec.name: spec for spec in [
+    SourceSpec('sales', 'All_Boroughs_geocoded_With_2023.csv', date_col='SALE_DATE', date_format='%Y-%m-%d',
+               columns=('tract', 'SALE_PRICE'),
+               aggregations={'month': ('month_key', {'SALE_PRICE': 'mean'})}),
+    SourceSpec('complaints', 'DOB_Complaints_Geocoded.csv', date_col='Date Entered', date_format='%m/%d/%Y',
+               aggregations={'month': COUNT_BY_MONTH}, merge_with_sales=True),
+    SourceSpec('operating_businesses', 'Businesses_Operating_Geocoded.csv', date_col='license_creation_date',
+               date_format='%m/%d/%Y',
+               aggregations={'yr': COUNT_BY_YEAR, 'month': COUNT_BY_MONTH}, merge_with_sales=True),
+    SourceSpec('evictions', 'Evictions_Geocoded.csv', date_col='executed_date', date_format='%m/%d/%Y',
+               aggregations={'yr': COUNT_BY_YEAR, 'month': COUNT_BY_MONTH}, merge_with_sales=True),
+    SourceSpec('restaurants', 'Restaurants_Geocoded.csv', date_col='Time of Submission',
+               date_format='%m/%d/%Y %I:%M:%S %p',
+               aggregations={'yr': COUNT_BY_YEAR, 'month': COUNT_BY_MONTH}, merge_with_sales=True),
+    SourceSpec('health_inspections', 'DOHMH_New_York_City_Restaurant_Inspection_Results.csv',
+               date_col='INSPECTION DATE', date_format='%m/%d/%Y',
+               geo_col='Census Tract', columns=('Census Tract', 'SCORE'),
+               filters=('SCORE.notna()',), transforms=(add_health_grade,)),
+    SourceSpec('citi', 'citibike_geocoded_v2.parquet', date_col='start_time', geo_col=None, columns=None),
+]}
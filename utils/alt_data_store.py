@@ -0,0 +1,178 @@
+"""
+Purpose: Local Parquet mirror of the alt data source files kept on S3.
+
+Each source is converted once into typed Parquet partitioned by year, and only re-converted when the
+source's ETag (or mtime for local files) or the way it is normalized (date column and format, numeric
+columns, MIRROR_FORMAT) changes. Readers request just the columns and date range they
+need, so Parquet projection and predicate pushdown skip everything else.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import s3fs
+
+from utils.alt_data_sources import SOURCES
+from utils.date_utils import parse_dates
+
+DATA_DIR = os.getenv('ALT_DATA_DIR', 's3://general-scratch/alt_data')
+MIRROR_DIR = os.getenv('ALT_DATA_MIRROR_DIR', 'alt_data_mirror')
+CHUNK_SIZE = 1_000_000
+MIRROR_FORMAT = 2  # bump when normalize_chunk changes, so every mirror is rebuilt
+
+def source_path(name: str) -> str:
+    return f'{DATA_DIR}/{SOURCES[name].path}'
+
+
+def mirror_path(name: str) -> Path:
+    return Path(MIRROR_DIR) / name
+
+
+def source_version(path: str) -> str:
+    """ETag for S3 objects, mtime/size for local files."""
+    if path.startswith('s3://'):
+        info = s3fs.S3FileSystem(anon=False).info(path)
+        return str(info.get('ETag') or info.get('LastModified'))
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def mirror_version(name: str, path: str) -> str:
+    """Source version plus the normalization settings of its spec; a change in either invalidates the mirror."""
+    spec = SOURCES[name]
+    settings = [MIRROR_FORMAT, spec.date_col, spec.date_format, sorted(numeric_columns(name, path))]
+    return f'{source_version(path)}|{hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]}'
+
+
+def read_manifest(name: str) -> dict:
+    manifest_path = mirror_path(name) / '_manifest.json'
+    return json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+
+def iter_source_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    storage_options = {'anon': False} if path.startswith('s3://') else None
+    if path.endswith('.parquet'):
+        fs = s3fs.S3FileSystem(anon=False) if path.startswith('s3://') else None
+        with (fs.open(path, 'rb') if fs else open(path, 'rb')) as f:
+            for batch in pq.ParquetFile(f).iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+    else:
+        # every column as text, so a column's type never depends on what one chunk happens to hold
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, storage_options=storage_options)
+
+
+def numeric_columns(name: str, path: str) -> List[str]:
+    """Columns mirrored as float64: numeric fields of a Parquet schema, the spec's numeric columns for CSVs."""
+    if path.endswith('.parquet'):
+        fs = s3fs.S3FileSystem(anon=False) if path.startswith('s3://') else None
+        with (fs.open(path, 'rb') if fs else open(path, 'rb')) as f:
+            schema = pq.read_schema(f)
+        return [field.name for field in schema
+                if pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_boolean(field.type)]
+    return list(SOURCES[name].numeric_columns)
+
+
+def normalize_chunk(chunk: pd.DataFrame, date_col: str, numeric_cols: List[str], date_format: str = None) -> pd.DataFrame:
+    """Give every chunk the same types: parsed 'date' + 'year', numeric_cols as float64, everything else strings."""
+    chunk = chunk.copy()
+    chunk['date'] = parse_dates(chunk[date_col], date_format)
+    chunk = chunk.dropna(subset=['date'])
+    chunk['year'] = chunk['date'].dt.year.astype('int16')
+    for col in chunk.columns:
+        if col in ('date', 'year'):
+            continue
+        if col in numeric_cols:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+        elif not pd.api.types.is_datetime64_any_dtype(chunk[col]):
+            chunk[col] = chunk[col].astype('string')
+    return chunk
+
+
+def convert_source(name: str, chunk_size: int = CHUNK_SIZE) -> Path:
+    """Convert a source file into a year-partitioned Parquet dataset under MIRROR_DIR."""
+    path = source_path(name)
+    date_col = SOURCES[name].date_col
+    version = mirror_version(name, path)
+    root = mirror_path(name)
+    tmp_root = root.with_name(f'{name}.tmp')
+    shutil.rmtree(tmp_root, ignore_errors=True)
+
+    numeric_cols = numeric_columns(name, path)
+    schema, rows = None, 0
+    for i, chunk in enumerate(iter_source_chunks(path, chunk_size)):
+        chunk = normalize_chunk(chunk, date_col, numeric_cols, SOURCES[name].date_format)
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        schema = schema or table.schema
+        pq.write_to_dataset(table.cast(schema), tmp_root, partition_cols=['year'],
+                            basename_template=f'part-{i:05d}-{{i}}.parquet')
+        rows += len(chunk)
+
+    tmp_root.mkdir(parents=True, exist_ok=True)
+    (tmp_root / '_manifest.json').write_text(json.dumps({
+        'source': path, 'version': version, 'date_col': date_col, 'rows': rows,
+        'converted_at': datetime.utcnow().isoformat(),
+    }))
+    shutil.rmtree(root, ignore_errors=True)
+    tmp_root.rename(root)
+    print(f'Mirrored {name}: {rows} rows -> {root}')
+    return root
+
+
+def sync_source(name: str, force: bool = False) -> Path:
+    """Return the mirror for a source, converting it first if missing or if the source ETag changed."""
+    manifest = read_manifest(name)
+    if not force and manifest:
+        try:
+            if manifest['version'] == mirror_version(name, source_path(name)):
+                return mirror_path(name)
+        except (OSError, FileNotFoundError) as e:
+            print(f'Could not check {name} source version, using existing mirror: {e}')
+            return mirror_path(name)
+    return convert_source(name)
+
+
+def sync_all(force: bool = False) -> Dict[str, Path]:
+    return {name: sync_source(name, force=force) for name in SOURCES}
+
+
+def load_source(name: str, columns: List[str] = None, start: str = None, end: str = None,
+                sync: bool = True, months: Iterable[str] = None) -> pd.DataFrame:
+    """
+    Load a mirrored source, reading only the requested columns and date range.
+
+    :param name: Source name, a key of utils.alt_data_sources.SOURCES.
+    :param columns: Columns to read in addition to 'date'. None reads every column.
+    :param start: Inclusive lower bound on 'date'.
+    :param end: Inclusive upper bound on 'date'.
+    :param sync: Check the source ETag and refresh the mirror first.
+    :param months: Only these (non-empty) 'YYYY-MM' months, e.g. the partitions an incremental ETL run rebuilds.
+    :return: DataFrame with a typed 'date' column plus the requested columns.
+    """
+    root = sync_source(name) if sync else mirror_path(name)
+    filters = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [('year', '>=', start.year), ('date', '>=', start)]
+    if end is not None:
+        end = pd.Timestamp(end)
+        # a bare date as the upper bound covers that whole day
+        date_filter = ('date', '<', end + pd.Timedelta(days=1)) if end == end.normalize() else ('date', '<=', end)
+        filters += [('year', '<=', end.year), date_filter]
+    if months is not None:
+        # one conjunction per month, OR-ed together, so only those months' rows and year partitions are read
+        periods = [pd.Period(month, 'M') for month in sorted(months)]
+        filters = [filters + [('year', '=', p.year), ('date', '>=', p.start_time), ('date', '<', (p + 1).start_time)]
+                   for p in periods]
+    read_columns = None if columns is None else list(dict.fromkeys(['date', *columns]))
+    df = pd.read_parquet(root, engine='pyarrow', columns=read_columns, filters=filters or None)
+    if 'year' in df.columns:
+        df['year'] = df['year'].astype('int16')
+    return df
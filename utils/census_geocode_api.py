@@ -1,9 +1,70 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import censusgeocode as cg
 import requests
+import numpy as np
 import pandas as pd
+import shapely
+import geopandas as gpd
+from shapely import STRtree
 from pathlib import Path
 pd.options.mode.chained_assignment = None
 
+CENSUS_POLYGONS_PATH = os.getenv('CENSUS_POLYGONS_PATH', 'Geocoded_Data/tl_2020_36_tabblock20.shp')
+GRID_CELL_SIZE = 0.0005  # degrees, roughly 50m; most NYC blocks span several cells
+# census batch response fields besides 'id' (cg.addressbatch / stub_addressbatch)
+GEOCODE_COLUMNS = ['address', 'match', 'matchtype', 'parsed', 'tigerlineid', 'side', 'statefp', 'countyfp',
+                   'tract', 'block', 'lat', 'lon']
+
+# TIGER/Line 2020 block files suffix their fields with '20', tract files do not
+TIGER_FIELD_MAP = {
+    'GEOID20': 'GEOID', 'TRACTCE20': 'TRACT', 'BLOCKCE20': 'BLOCK',
+    'GEOID': 'GEOID', 'TRACTCE': 'TRACT', 'BLOCKCE': 'BLOCK',
+}
+
+
+def normalize_addresses(df: pd.DataFrame, address_col: str, city_col: str, state_col: str, zip_col: str) -> pd.DataFrame:
+    """
+    Normalize the address fields used for batch geocoding so repeated buildings collapse to one key.
+
+    :return: DataFrame with street/city/state/zip columns and an 'address_key' column, indexed like df.
+    """
+    def clean(col):
+        return df[col].astype(str).str.upper().str.strip().str.replace(r'\s+', ' ', regex=True)
+
+    normalized = pd.DataFrame({
+        'street': clean(address_col),
+        'city': clean(city_col),
+        'state': clean(state_col),
+        'zip': clean(zip_col).str.replace(r'\.0$', '', regex=True).str[:5],
+    }, index=df.index)
+    normalized['address_key'] = normalized['street'].str.cat(normalized[['city', 'state', 'zip']], sep='|')
+    return normalized
+
+
+def stub_addressbatch(batch_path: str) -> list:
+    """
+    Offline stand-in for cg.addressbatch. Reads the same headerless id,street,city,state,zip file
+    and returns deterministic fake matches in the census batch response format.
+    """
+    batch = pd.read_csv(batch_path, header=None, names=['id', 'street', 'city', 'state', 'zip'], dtype=str)
+    results = []
+    for row in batch.itertuples(index=False):
+        seed = int(hashlib.md5(f'{row.street}|{row.zip}'.encode()).hexdigest()[:8], 16)
+        results.append({
+            'id': row.id, 'address': f'{row.street}, {row.city}, {row.state}, {row.zip}',
+            'match': True, 'matchtype': 'Exact', 'parsed': f'{row.street}, {row.city}, {row.state}, {row.zip}',
+            'tigerlineid': str(seed % 10**9), 'side': 'L', 'statefp': '36', 'countyfp': '061',
+            'tract': f'{seed % 300000:06d}', 'block': f'{seed % 5000:04d}',
+            'lat': 40.5 + (seed % 10000) / 20000, 'lon': -74.25 + (seed // 10000 % 10000) / 20000,
+        })
+    return results
+
 
 def geocode_multi_batch(df,
                         address_col: str,
@@ -12,69 +73,104 @@ def geocode_multi_batch(df,
                         zip_col: str,
                         batch_size: int = 9000,
                         auto_save: bool = True,
-                        save_path: str = 'geocoded_addresses.csv'):
+                        save_path: str = 'geocoded_addresses.csv',
+                        max_workers: int = 4,
+                        retries: int = 3,
+                        geocoder=None):
     """
-    This function geocodes a list of addresses provided in a DataFrame, in chunks based on the batch_size.
+    This function geocodes the addresses provided in a DataFrame through the census batch endpoint.
+
+    Addresses are normalized and deduplicated before submission, unique addresses are split into batches
+    that are submitted concurrently (each through its own temp file), and every finished batch is
+    checkpointed under '<save_path>.batches/' so an interrupted run resumes with the remaining batches.
 
     :param df: DataFrame containing addresses to geocode.
     :param address_col: Name of the column in the input DataFrame containing the street address.
     :param city_col: Name of the column in the input DataFrame containing the city.
     :param state_col: Name of the column in the input DataFrame containing the state.
     :param zip_col: Name of the column in the input DataFrame containing the zip code.
-    :param batch_size: The size of each batch for geocoding. Default is 9000.
-    :param auto_save: Whether to automatically save geocoded results to a file. Default is True.
+    :param batch_size: The number of unique addresses per batch. Default is 9000.
+    :param auto_save: Whether to save the merged geocoded results to save_path. Default is True.
     :param save_path: File path to save geocoded results if auto_save is True. Default is 'geocoded_addresses.csv'.
+    :param max_workers: Number of batches in flight at once. Default is 4.
+    :param retries: Attempts per batch before giving up. Default is 3.
+    :param geocoder: Callable taking a batch file path and returning census batch results.
+                     Defaults to cg.addressbatch; pass stub_addressbatch to run offline.
     :return: DataFrame containing the original input data and the geocoded results.
     """
+    geocoder = geocoder or cg.addressbatch
+    normalized = normalize_addresses(df, address_col, city_col, state_col, zip_col)
+    unique_addresses = (normalized.drop_duplicates('address_key')
+                        .sort_values('address_key')
+                        .reset_index(drop=True))
+    unique_addresses['batch_id'] = unique_addresses.index // batch_size
+    print(f'{len(unique_addresses)} unique addresses out of {len(df)} rows.')
 
-    def create_batch(chunk):
-        """
-        Creates a batch for geocoding by subsetting the relevant columns.
+    checkpoint_dir = Path(f'{save_path}.batches')
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = checkpoint_dir / 'checkpoint.json'
+    fingerprint = hashlib.sha256(f'{batch_size}|'.encode() + '\n'.join(unique_addresses['address_key']).encode()).hexdigest()
 
-        :param chunk: DataFrame containing a chunk of addresses.
-        :return: DataFrame with columns needed for geocoding.
-        """
-        chunk.reset_index(drop=True,inplace=True)
-        chunk['id'] = chunk.index
-        columns = [address_col, city_col, state_col, zip_col]
-        batch_input_df = chunk[columns].reset_index(drop=True)
-        batch_input_df.columns = ['street', 'city', 'state', 'zip']
-        return batch_input_df
-
-    def process_batch(batch, current_chunk_index):
-        print("Processing batch")
+    checkpoint = json.loads(checkpoint_path.read_text()) if checkpoint_path.exists() else {}
+    if checkpoint.get('fingerprint') != fingerprint:
+        checkpoint = {'fingerprint': fingerprint, 'completed': []}
+    completed = set(checkpoint['completed'])
+
+    def save_checkpoint():
+        tmp_path = checkpoint_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'fingerprint': fingerprint, 'completed': sorted(completed)}))
+        os.replace(tmp_path, checkpoint_path)
+
+    def process_batch(batch):
         """
-        Processes the batch by geocoding the addresses and returning the results.
+        Geocodes one batch through a private temp file, retrying with backoff on failure.
 
-        :param batch: DataFrame containing a batch of addresses.
-        :param current_chunk_index: Index of the current chunk being processed.
-        :return: DataFrame with the geocoding results.
+        :param batch: DataFrame of unique addresses sharing a batch_id.
+        :return: DataFrame with the geocoding results keyed by address_key.
         """
-        batch_filename = f'current_chunk.csv'
-        batch.to_csv(batch_filename, index=True, header=False)
-        return pd.DataFrame.from_dict(cg.addressbatch(batch_filename))
+        batch_input_df = batch[['street', 'city', 'state', 'zip']].reset_index(drop=True)
+        for attempt in range(1, retries + 1):
+            try:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    batch_filename = os.path.join(tmp_dir, 'batch.csv')
+                    batch_input_df.to_csv(batch_filename, index=True, header=False)
+                    batch_output_df = pd.DataFrame.from_dict(geocoder(batch_filename))
+                break
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f'Batch {batch["batch_id"].iloc[0]} failed ({e}), retry {attempt} of {retries - 1}.')
+                time.sleep(2 ** attempt)
+        batch_output_df['id'] = batch_output_df['id'].astype(int)
+        batch_output_df['address_key'] = batch['address_key'].to_numpy()[batch_output_df['id']]
+        return batch_output_df.drop(columns='id')
 
-    chunks = [df[i:i + batch_size] for i in range(0, len(df), batch_size)]
-    output_dfs = []
+    pending = [batch for batch_id, batch in unique_addresses.groupby('batch_id') if batch_id not in completed]
+    n_batches = unique_addresses['batch_id'].nunique()
+    if completed:
+        print(f'Resuming: {len(completed)} of {n_batches} batches already geocoded.')
 
-    for index, chunk in enumerate(chunks):
-        
-        batch_input_df = create_batch(chunk)
-        batch_output_df = process_batch(batch_input_df, index)
-        batch_output_df['id'] = batch_output_df['id'].astype(int)
-        output_df = chunk.merge(batch_output_df, on='id')
-        output_dfs.append(output_df)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_batch, batch): batch['batch_id'].iloc[0] for batch in pending}
+        for future in as_completed(futures):
+            batch_id = int(futures[future])
+            future.result().to_csv(checkpoint_dir / f'batch_{batch_id}.csv', index=False)
+            completed.add(batch_id)
+            save_checkpoint()
+            print(f'Processed {len(completed)} of {n_batches} batches.')
 
-        if auto_save:
-            file_path = Path(save_path)
-            if file_path.exists():
-                output_df.to_csv(file_path, index=False, header=False, mode='a')
-            else:
-                output_df.to_csv(file_path, index=False, header=True, mode='w')
-        if index % 2 == 0 and index != 0:
-            print(f'Processed {index} of {len(chunks)} chunks.')
+    batches = [pd.read_csv(checkpoint_dir / f'batch_{batch_id}.csv', dtype={'tract': str, 'block': str,
+                                                                             'statefp': str, 'countyfp': str})
+               for batch_id in sorted(completed)]
+    # no input rows means no batches; keep the output columns anyway
+    geocoded = (pd.concat(batches, ignore_index=True) if batches
+                else pd.DataFrame(columns=GEOCODE_COLUMNS + ['address_key'], dtype=object))
+    output_df = df.assign(address_key=normalized['address_key']).merge(geocoded, on='address_key', how='left')
+    output_df = output_df.drop(columns='address_key')
 
-    return pd.concat(output_dfs, axis=0, ignore_index=True)
+    if auto_save:
+        output_df.to_csv(save_path, index=False)
+    return output_df
 
 
 def fetch_geocode_address(full_address=None, street=None, city=None, state=None):
@@ -123,4 +219,146 @@ def fetch_google_api_data(lat, lng, api_key):
 def estimate_address_from_coordinates(lat, lng, GOOGLE_MAPS_API_KEY):
     api_data = fetch_google_api_data(lat, lng, GOOGLE_MAPS_API_KEY)
     return api_data['results'][0]['formatted_address'] if api_data["status"] == "OK" else {'error': 'Failed to find an address for the given coordinates'}
-    
+
+
+class CensusPolygonIndex:
+    """
+    Offline point-in-polygon lookup over local 2020 census block or tract polygons (TIGER/Line shapefiles).
+
+    Points are first resolved through a regular grid whose cells lie entirely inside a single polygon,
+    which is plain integer arithmetic. Only points in cells straddling a boundary fall back to an STRtree query,
+    so no census API calls are made.
+    """
+
+    def __init__(self, polygons, attributes: pd.DataFrame, cell_size: float = None, bounds: tuple = None,
+                 max_cells: int = 10_000_000):
+        self.polygons = np.asarray(polygons)
+        self.tree = STRtree(self.polygons)
+        self.fields = list(attributes.columns)
+        # extra trailing row of None so unmatched points (index -1) resolve without masking
+        self._attributes = {col: np.append(attributes[col].to_numpy(dtype=object), None) for col in self.fields}
+        self.grid = None
+        if cell_size:
+            self.build_grid(cell_size, bounds, max_cells)
+
+    @classmethod
+    def from_file(cls, path: str = CENSUS_POLYGONS_PATH, cell_size: float = GRID_CELL_SIZE, bounds: tuple = None):
+        """
+        Load a census polygon file into an index.
+
+        :param path: Any file readable by geopandas, e.g. tl_2020_36_tabblock20.shp or tl_2020_36_tract.shp.
+        :param cell_size: Grid cell size in degrees. None disables the grid and always queries the STRtree.
+        :param bounds: (min_lng, min_lat, max_lng, max_lat) covered by the grid. Defaults to the polygons' extent.
+        :return: CensusPolygonIndex exposing whichever of GEOID/TRACT/BLOCK the file carries.
+        """
+        gdf = gpd.read_file(path)
+        if gdf.crs is not None and gdf.crs.to_epsg() not in (4269, 4326):
+            gdf = gdf.to_crs(4326)
+        fields = {src: dst for src, dst in TIGER_FIELD_MAP.items() if src in gdf.columns}
+        attributes = gdf[list(fields)].rename(columns=fields).reset_index(drop=True)
+        return cls(gdf.geometry.values, attributes, cell_size=cell_size, bounds=bounds)
+
+    def build_grid(self, cell_size: float, bounds: tuple = None, max_cells: int = 10_000_000):
+        """
+        Precompute, for every grid cell, the polygon that fully contains it (-1 for cells crossing a boundary).
+
+        :param cell_size: Cell size in degrees, coarsened if the grid would exceed max_cells.
+        :param bounds: (min_lng, min_lat, max_lng, max_lat) covered by the grid.
+        :param max_cells: Upper bound on the number of cells held in memory.
+        """
+        min_x, min_y, max_x, max_y = bounds if bounds else shapely.total_bounds(self.polygons)
+        cell_size = max(cell_size, np.sqrt((max_x - min_x) * (max_y - min_y) / max_cells))
+        nx = max(int(np.ceil((max_x - min_x) / cell_size)), 1)
+        ny = max(int(np.ceil((max_y - min_y) / cell_size)), 1)
+
+        grid = np.full((nx, ny), -1, dtype=np.int64)
+        ys = min_y + np.arange(ny) * cell_size
+        rows_per_chunk = max(500_000 // ny, 1)
+        for start in range(0, nx, rows_per_chunk):
+            xs = min_x + np.arange(start, min(start + rows_per_chunk, nx)) * cell_size
+            gx, gy = np.meshgrid(xs, ys, indexing='ij')
+            cells = shapely.box(gx.ravel(), gy.ravel(), gx.ravel() + cell_size, gy.ravel() + cell_size)
+            cell_idx, polygon_idx = self.tree.query(cells, predicate='within')
+            grid[start:start + len(xs)].ravel()[cell_idx] = polygon_idx
+
+        self.grid = grid
+        self.grid_origin = (min_x, min_y)
+        self.cell_size = cell_size
+
+    def _query_tree(self, lat: np.ndarray, lng: np.ndarray, batch_size: int) -> np.ndarray:
+        matches = np.full(len(lat), -1, dtype=np.int64)
+        for start in range(0, len(lat), batch_size):
+            end = start + batch_size
+            points = shapely.points(lng[start:end], lat[start:end])
+            point_idx, polygon_idx = self.tree.query(points, predicate='intersects')
+            # points on a shared boundary hit several polygons; reversed assignment keeps the first hit
+            matches[start + point_idx[::-1]] = polygon_idx[::-1]
+        return matches
+
+    def query_indices(self, lat, lng, batch_size: int = 1_000_000) -> np.ndarray:
+        """
+        Find the polygon containing each point.
+
+        :param lat: Array-like of latitudes.
+        :param lng: Array-like of longitudes.
+        :param batch_size: Number of points handed to the STRtree per query.
+        :return: Array of polygon positions aligned with the input, -1 where no polygon matched.
+        """
+        lat = np.asarray(lat, dtype=float)
+        lng = np.asarray(lng, dtype=float)
+        if self.grid is None:
+            return self._query_tree(lat, lng, batch_size)
+
+        nx, ny = self.grid.shape
+        with np.errstate(invalid='ignore'):
+            ix = np.floor((lng - self.grid_origin[0]) / self.cell_size)
+            iy = np.floor((lat - self.grid_origin[1]) / self.cell_size)
+            on_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+
+        matches = np.full(len(lat), -1, dtype=np.int64)
+        matches[on_grid] = self.grid[ix[on_grid].astype(np.int64), iy[on_grid].astype(np.int64)]
+
+        unresolved = np.flatnonzero((matches < 0) & np.isfinite(lat) & np.isfinite(lng))
+        if len(unresolved):
+            matches[unresolved] = self._query_tree(lat[unresolved], lng[unresolved], batch_size)
+        return matches
+
+    def lookup(self, lat, lng, dedupe: bool = True, batch_size: int = 1_000_000) -> pd.DataFrame:
+        """
+        Assign census geographies to arrays of coordinates.
+
+        :param lat: Array-like of latitudes.
+        :param lng: Array-like of longitudes.
+        :param dedupe: Only query each distinct coordinate pair once. Ride and complaint data repeat locations heavily.
+        :param batch_size: Number of points handed to the STRtree per query.
+        :return: DataFrame with one row per input point (same order) and GEOID/TRACT/BLOCK columns.
+        """
+        coords = np.column_stack([np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)])
+        if dedupe and len(coords):
+            unique_coords, inverse = np.unique(coords, axis=0, return_inverse=True)
+            matches = self.query_indices(unique_coords[:, 0], unique_coords[:, 1], batch_size)[inverse.ravel()]
+        else:
+            matches = self.query_indices(coords[:, 0], coords[:, 1], batch_size)
+        return pd.DataFrame({col: values[matches] for col, values in self._attributes.items()})
+
+
+@lru_cache(maxsize=4)
+def load_census_index(path: str = CENSUS_POLYGONS_PATH) -> CensusPolygonIndex:
+    """Load (once per process) the polygon index for a census file."""
+    return CensusPolygonIndex.from_file(path)
+
+
+def geocode_coordinates_offline(df: pd.DataFrame, lat_col: str, lng_col: str,
+                                path: str = CENSUS_POLYGONS_PATH) -> pd.DataFrame:
+    """
+    Append GEOID/TRACT/BLOCK columns to a DataFrame of points using the local polygon index.
+
+    :param df: DataFrame with coordinate columns, e.g. citibike stations, complaints or evictions.
+    :param lat_col: Name of the latitude column.
+    :param lng_col: Name of the longitude column.
+    :param path: Census polygon file to index.
+    :return: Copy of df with the census geography columns appended.
+    """
+    geo = load_census_index(path).lookup(df[lat_col].to_numpy(), df[lng_col].to_numpy())
+    geo.index = df.index
+    return pd.concat([df, geo], axis=1)
@@ -0,0 +1,125 @@
+"""
+Purpose: Incremental refresh of the nyc_alt_data_daily materialized view.
+
+Each source in python_query_defs.DAILY_SOURCES is summarized per date into daily_<name> (primary key on
+the date). A refresh only re-aggregates raw rows from LOOKBACK_DAYS before the last summarized date onwards
+(rows arriving later than that for older dates need a larger lookback_days) and upserts them, then the view, which joins the small summary tables, is
+refreshed CONCURRENTLY against its unique index so readers are never blocked. Date columns are read as
+their information_schema type says: text dates go through to_date, real dates are compared directly.
+"""
+
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from utils.db_utils import get_backend, read_sql
+from utils.query_cache import QueryCache
+from utils.python_query_defs import (DAILY_MV, DAILY_MV_INDEX, DAILY_SOURCES, DailySource, build_range_query,
+                                     date_column_query, daily_mv_query, daily_summary_select, daily_summary_upsert)
+
+# days before the last summarized date that every refresh recomputes, to pick up late-arriving rows
+LOOKBACK_DAYS = 31
+
+
+def date_column_types(con, sources: Iterable[DailySource]) -> Dict[str, str]:
+    """Source name -> information_schema data_type of its raw date column; sources without the table are left out."""
+    sources = list(sources)
+    found = read_sql(date_column_query(sources), con)
+    types = {(row.table_name, row.column_name): row.data_type for row in found.itertuples()}
+    return {s.name: types[(s.table, s.date_col)] for s in sources if (s.table, s.date_col) in types}
+
+
+def ensure_summary_table(conn, source: DailySource, column_type: Optional[str] = None) -> bool:
+    """
+    Create daily_<name> with the column types of its aggregate query; True if it was created.
+    Without the raw table the summary is created empty with numeric columns, so the view still has them.
+    """
+    if inspect(conn).has_table(source.summary_table):
+        return False
+    if inspect(conn).has_table(source.table):
+        select = daily_summary_select(source, column_type=column_type)
+    else:
+        select = 'SELECT NULL :: date AS date' + ''.join(f', NULL :: numeric AS {col}' for col in source.measures)
+    conn.execute(text(f'CREATE TABLE {source.summary_table} AS {select}\nWITH NO DATA'))
+    conn.execute(text(f'ALTER TABLE {source.summary_table} ADD PRIMARY KEY (date)'))
+    return True
+
+
+def refresh_summary(conn, source: DailySource, lookback_days: int = LOOKBACK_DAYS) -> int:
+    """
+    Upsert the daily summary of one source from its last summarized date onwards.
+
+    :param conn: Connection inside a transaction.
+    :param source: Source to summarize.
+    :param lookback_days: Also recompute this many days before the last summarized date, for late rows.
+    :return: Number of dates written.
+    """
+    column_type = date_column_types(conn, [source]).get(source.name)
+    ensure_summary_table(conn, source, column_type)
+    if not inspect(conn).has_table(source.table):
+        print(f'{source.table} does not exist, {source.summary_table} left as is')
+        return 0
+    last = conn.execute(text(f'SELECT MAX(date) FROM {source.summary_table}')).scalar()
+    # the last summarized day may have been partial, so it is always recomputed
+    since = last - timedelta(days=lookback_days) if last else date.min
+    return conn.execute(text(daily_summary_upsert(source, column_type)), {'since': since}).rowcount
+
+
+def ensure_daily_mv(conn) -> bool:
+    """Create the view over the summaries with its unique index; replaces a view built by the old full-scan SQL."""
+    if conn.execute(text('SELECT 1 FROM pg_indexes WHERE indexname = :name'), {'name': DAILY_MV_INDEX}).scalar():
+        return False
+    conn.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS {DAILY_MV}'))
+    conn.execute(text(f'CREATE MATERIALIZED VIEW {DAILY_MV} AS {daily_mv_query()}'))
+    conn.execute(text(f'CREATE UNIQUE INDEX {DAILY_MV_INDEX} ON {DAILY_MV} (event_date)'))
+    return True
+
+
+def refresh_daily(engine=None, sources: Iterable[str] = None, lookback_days: int = LOOKBACK_DAYS) -> Dict[str, int]:
+    """
+    Bring the daily summaries up to date and refresh nyc_alt_data_daily without blocking readers.
+
+    :param engine: SQLAlchemy engine, defaults to the configured backend from db_utils.
+    :param sources: Names in DAILY_SOURCES to refresh, defaults to all of them.
+    :param lookback_days: Days before each source's last summarized date to recompute.
+    :return: Dates written per source.
+    """
+    engine = engine or get_backend()
+    if engine.name == 'duckdb':
+        print(f'{DAILY_MV}: DuckDB backend aggregates the mirror on read, nothing to refresh')
+        return {}
+    written = {}
+    for name in sources or DAILY_SOURCES:
+        with engine.begin() as conn:
+            written[name] = refresh_summary(conn, DAILY_SOURCES[name], lookback_days)
+        print(f'{DAILY_SOURCES[name].summary_table}: {written[name]} dates upserted')
+
+    with engine.begin() as conn:
+        for source in DAILY_SOURCES.values():
+            ensure_summary_table(conn, source)
+        created = ensure_daily_mv(conn)
+    if not created:
+        with engine.begin() as conn:
+            conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {DAILY_MV}'))
+    print(f'{DAILY_MV} {"created" if created else "refreshed concurrently"}')
+    return written
+
+
+def read_alt_data(start=None, end=None, granularity: str = 'day', sources: Iterable[str] = None, engine=None,
+                  use_summaries: bool = True, cache: QueryCache = None) -> pd.DataFrame:
+    """
+    Date range of the joined sources at day/week/month granularity, see python_query_defs.build_range_query.
+    Pass cache (e.g. query_cache.get_query_cache()) to serve repeated reads from the local result cache;
+    an engine given alongside it is the one read (and cached under), not the cache's default.
+    Without an engine it reads from the configured backend (db_utils.get_backend), Postgres or DuckDB.
+    """
+    column_types = None
+    if not use_summaries:
+        column_types = date_column_types(engine or get_backend(), [DAILY_SOURCES[name] for name in sources or DAILY_SOURCES])
+    sql, params = build_range_query(start, end, granularity, sources, use_summaries=use_summaries,
+                                    column_types=column_types)
+    if cache is not None:
+        return cache.read_sql(sql, params, engine=engine, parse_dates=['period'])
+    return read_sql(sql, engine, params=params, parse_dates=['period'])
@@ -0,0 +1,115 @@
+"""
+Purpose: Fast, typed date handling shared by the ETL and analysis code.
+
+- parse_dates parses each distinct date string once, with an explicit format when one is known.
+- day/week/month keys are int32 ordinals, so groupby/merge hash integers instead of strings.
+- String labels ('YYYY-MM' etc.) are only produced at output, from the unique keys.
+"""
+
+import numpy as np
+import pandas as pd
+
+NAT_KEY = np.iinfo(np.int32).min
+FREQS = ('D', 'W', 'M')
+
+
+def parse_dates(values, fmt: str = None) -> pd.Series:
+    """
+    Parse a column of dates, parsing every distinct value only once.
+
+    :param values: Series of strings (or already datetime-like values).
+    :param fmt: strptime format, e.g. '%m/%d/%Y'. Values that do not match fall back to inference.
+    :return: datetime64 Series aligned with values, NaT where unparseable.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    if fmt:
+        parsed = pd.to_datetime(pd.Series(uniques), format=fmt, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype='datetime64[ns]')
+    missed = parsed.isna().to_numpy()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(pd.Series(uniques[missed]), errors='coerce', format='mixed').to_numpy()
+    result = parsed.to_numpy().take(codes)
+    result[codes == -1] = np.datetime64('NaT')
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+def _as_datetime64(dates) -> np.ndarray:
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]')
+
+
+def _to_key(ordinals: np.ndarray, nat: np.ndarray) -> np.ndarray:
+    keys = ordinals.astype(np.int32)
+    keys[nat] = NAT_KEY
+    return keys
+
+
+def day_key(dates) -> np.ndarray:
+    """Days since 1970-01-01."""
+    dt = _as_datetime64(dates)
+    return _to_key(dt.astype('datetime64[D]').astype(np.int64), np.isnat(dt))
+
+
+def week_key(dates) -> np.ndarray:
+    """ISO weeks (Monday start) since the week of 1970-01-01."""
+    dt = _as_datetime64(dates)
+    return _to_key((dt.astype('datetime64[D]').astype(np.int64) + 3) // 7, np.isnat(dt))
+
+
+def month_key(dates) -> np.ndarray:
+    """Months since 1970-01."""
+    dt = _as_datetime64(dates)
+    return _to_key(dt.astype('datetime64[M]').astype(np.int64), np.isnat(dt))
+
+
+PERIOD_KEYS = {'D': day_key, 'W': week_key, 'M': month_key}
+
+
+def period_key(dates, freq: str) -> np.ndarray:
+    return PERIOD_KEYS[freq](dates)
+
+
+def key_start(keys, freq: str) -> np.ndarray:
+    """First day of each period key as datetime64[D]."""
+    keys = np.asarray(keys, dtype=np.int64)
+    if freq == 'D':
+        return keys.astype('datetime64[D]')
+    if freq == 'W':
+        return (keys * 7 - 3).astype('datetime64[D]')
+    return keys.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def _format_keys(keys: np.ndarray, freq: str) -> np.ndarray:
+    starts = pd.DatetimeIndex(key_start(keys, freq))
+    if freq == 'D':
+        return starts.strftime('%Y-%m-%d').to_numpy()
+    if freq == 'W':
+        return starts.strftime('%G-%V').to_numpy()
+    return starts.strftime('%Y-%m').to_numpy()
+
+
+def period_label(keys, freq: str) -> np.ndarray:
+    """Output labels for period keys: 'YYYY-MM-DD' (D), ISO 'YYYY-WW' (W), 'YYYY-MM' (M). Formats unique keys only."""
+    keys = np.asarray(keys)
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    valid = uniques != NAT_KEY
+    labels = np.full(len(uniques), None, dtype=object)
+    labels[valid] = _format_keys(uniques[valid], freq)
+    return labels[inverse.ravel()]
+
+
+def period_categorical(keys, freq: str) -> pd.Categorical:
+    """Ordered categorical of period labels, with categories spanning every period between the min and max key."""
+    keys = np.asarray(keys)
+    valid = keys[keys != NAT_KEY]
+    full_range = np.arange(valid.min(), valid.max() + 1) if len(valid) else np.array([], dtype=np.int64)
+    codes = np.where(keys == NAT_KEY, -1, keys - (full_range[0] if len(full_range) else 0))
+    return pd.Categorical.from_codes(codes, categories=_format_keys(full_range, freq), ordered=True)
+
+
+def month_key_from_label(labels) -> np.ndarray:
+    """Inverse of period_label(..., 'M') for 'YYYY-MM' strings."""
+    return month_key(pd.to_datetime(pd.Series(labels), format='%Y-%m'))
@@ -1,11 +1,163 @@
 import dotenv
 import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple
 dotenv.load_dotenv()
 import custom_utils
 import pymongo
 import pandas as pd
 import psycopg2
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+DEFAULT_DB_SERVICE = 'alt_data_db'
+DB_BACKENDS = ('postgres', 'duckdb')
+LOCAL_DB_URL = 'postgresql://darien:@localhost:5432/alt_data'
+
+
+class ConnectionManager:
+    """
+    Pooled SQLAlchemy engines (sync psycopg2 + async psycopg) for one database, created on first use.
+
+    Configure with a URL or a libpq service name (~/.pg_service.conf); nothing connects until an engine,
+    connection or session is first requested, so importing modules that hold a manager is free.
+    """
+
+    def __init__(self, url: str = None, service: str = DEFAULT_DB_SERVICE, pool_size: int = 5,
+                 max_overflow: int = 10, pool_recycle: int = 1800, echo: bool = False):
+        self.url = make_url(url) if url else make_url(f'postgresql+psycopg2:///?service={service}')
+        self.engine_kwargs = dict(pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle,
+                                  pool_pre_ping=True, echo=echo)
+        self._engine = None
+        self._async_engine = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ConnectionManager':
+        """ALT_DATA_DB_URL wins over ALT_DATA_DB_SERVICE (default 'alt_data_db'); pool size from ALT_DATA_DB_POOL_SIZE."""
+        return cls(url=os.getenv('ALT_DATA_DB_URL'),
+                   service=os.getenv('ALT_DATA_DB_SERVICE', DEFAULT_DB_SERVICE),
+                   pool_size=int(os.getenv('ALT_DATA_DB_POOL_SIZE', 5)),
+                   max_overflow=int(os.getenv('ALT_DATA_DB_MAX_OVERFLOW', 10)))
+
+    @property
+    def url_string(self) -> str:
+        """URL with the password kept, for tools that want a URI (dask.to_sql, worker processes)."""
+        return self.url.render_as_string(hide_password=False)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    kwargs = self.engine_kwargs if self.url.get_backend_name() != 'sqlite' else {'echo': self.engine_kwargs['echo']}
+                    self._engine = create_engine(self.url, **kwargs)
+        return self._engine
+
+    @property
+    def async_engine(self):
+        if self._async_engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            with self._lock:
+                if self._async_engine is None:
+                    async_url = self.url.set(drivername='postgresql+psycopg') \
+                        if self.url.get_backend_name() == 'postgresql' else self.url
+                    self._async_engine = create_async_engine(async_url, **self.engine_kwargs)
+        return self._async_engine
+
+    @contextmanager
+    def connect(self):
+        """Pooled connection inside a transaction, committed on exit; what pandas read_sql/to_sql want."""
+        with self.engine.begin() as conn:
+            yield conn
+
+    @contextmanager
+    def session(self):
+        """ORM session, committed on success and rolled back on error."""
+        with Session(self.engine) as session, session.begin():
+            yield session
+
+    @asynccontextmanager
+    async def async_session(self):
+        from sqlalchemy.ext.asyncio import AsyncSession
+        async with AsyncSession(self.async_engine) as session, session.begin():
+            yield session
+
+    def raw_connection(self):
+        """Pooled DBAPI (psycopg2) connection for legacy callers; close() hands it back to the pool."""
+        return self.engine.raw_connection()
+
+    def pool_stats(self) -> Dict[str, object]:
+        if self._engine is None:
+            return {'created': False}
+        pool = self._engine.pool
+        stats = {'created': True, 'status': pool.status()}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+    def dispose(self) -> None:
+        """Close pooled connections, e.g. in a forked worker or at shutdown."""
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+        self._async_engine = None
+
+
+_managers: Dict[Tuple[Optional[str], Optional[str]], ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(url: str = None, service: str = None) -> ConnectionManager:
+    """Shared ConnectionManager per URL/service; with no arguments it is configured from the environment."""
+    key = (url, service)
+    with _managers_lock:
+        if key not in _managers:
+            if key == (None, None):
+                _managers[key] = ConnectionManager.from_env()
+            else:
+                _managers[key] = ConnectionManager(url=url, service=service or DEFAULT_DB_SERVICE)
+        return _managers[key]
+
+
+def get_engine(url: str = None, service: str = None):
+    return get_manager(url, service).engine
+
+
+def get_backend(backend: str = None):
+    """
+    What analysis reads run against: the pooled Postgres engine, or with ALT_DATA_BACKEND=duckdb the
+    embedded DuckDB backend over the local Parquet mirror (utils/duckdb_backend.py), which needs no server.
+    """
+    backend = backend or os.getenv('ALT_DATA_BACKEND', 'postgres')
+    if backend not in DB_BACKENDS:
+        raise ValueError(f'ALT_DATA_BACKEND must be one of {DB_BACKENDS}, got {backend!r}')
+    if backend == 'duckdb':
+        from utils.duckdb_backend import get_duckdb
+        return get_duckdb()
+    return get_engine()
+
+
+def read_sql(sql, con=None, params: dict = None, **kwargs) -> pd.DataFrame:
+    """pd.read_sql against con or the configured backend; %(name)s placeholders work on both."""
+    con = get_backend() if con is None else con
+    if getattr(con, 'name', None) == 'duckdb':
+        return con.read_sql(sql, params=params, **kwargs)
+    return pd.read_sql(sql, con, params=params, **kwargs)
+
+
+def _forget_pools_after_fork():
+    # pooled sockets belong to the parent; a forked worker must open its own
+    for manager in _managers.values():
+        if manager._engine is not None:
+            manager._engine.dispose(close=False)
+        manager._async_engine = None
+
+
+os.register_at_fork(after_in_child=_forget_pools_after_fork)
 
 
 class MongoUtils:
@@ -47,8 +199,7 @@ def get_mongo_conn():
 def get_postgres_conn(use_service: bool = True):
     try:
         if use_service:
-            connection = psycopg2.connect(service='alt_data_db')
-            return connection
+            return get_manager().raw_connection()
         else:
             from custom_utils.onepassword_wrapper import OnePasswordWrapper
             wrapper = OnePasswordWrapper()
@@ -83,5 +234,4 @@ def get_aws_psql_conn():
 
 
 def get_local_psql_conn():
-    engine = create_engine('postgresql://darien:@localhost:5432/alt_data')
-    return engine.connect().connection
\ No newline at end of file
+    return get_manager(LOCAL_DB_URL).raw_connection()
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+Purpose: Embedded DuckDB backend over the local Parquet mirror, for running the analysis without Postgres.
+
+Every mirrored source (utils/alt_data_store.py) is exposed as a view under its Postgres table name, and the
+daily summaries plus nyc_alt_data_daily are views that aggregate those on the fly, so the same SQL
+(join_datasets_daily.sql, nyc_alt_data_analysis.sql, python_query_defs.build_range_query) runs unchanged
+with DuckDB's vectorized engine, reading only the columns and year partitions a query touches.
+Select it with ALT_DATA_BACKEND=duckdb; db_utils.get_backend / db_utils.read_sql then route here.
+"""
+
+import os
+import re
+import json
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import duckdb
+import pandas as pd
+
+from utils.alt_data_store import MIRROR_DIR
+from utils.python_query_defs import DAILY_MV, DAILY_SOURCES, date_column_query, daily_mv_query, daily_summary_select
+
+DUCKDB_PATH = os.getenv('ALT_DATA_DUCKDB_PATH', ':memory:')
+DUCKDB_THREADS = os.getenv('ALT_DATA_DUCKDB_THREADS')
+
+# Postgres table -> (mirrored source, select list over its Parquet rows)
+TABLE_VIEWS = {
+    'sales': ('sales', '* REPLACE ("date" AS "SALE_DATE")'),
+    'complaints': ('complaints', '*'),
+    'businesses': ('operating_businesses', '*'),
+    'evictions': ('evictions', '*'),
+    'restaurants': ('restaurants', '*'),
+    'health_inspections': ('health_inspections', '*'),
+    'citibike_rides_geocoded': ('citi', '*'),
+}
+# Postgres tables that are themselves aggregates of a mirrored one
+DERIVED_VIEWS = {
+    'citibike_daily': ('citibike_rides_geocoded',
+                       'SELECT "date" :: date AS date, COUNT(*) AS num_rides FROM citibike_rides_geocoded GROUP BY 1'),
+}
+
+# Postgres functions used by the sql_queries files that DuckDB spells differently
+COMPAT_MACROS = [
+    """CREATE OR REPLACE MACRO to_char(ts, fmt) AS
+       strftime(ts, replace(replace(replace(replace(replace(replace(replace(replace(fmt,
+           'IYYY', '%G'), 'IW', '%V'), 'YYYY', '%Y'), 'MM', '%m'), 'DD', '%d'), 'HH24', '%H'), 'MI', '%M'), 'SS', '%S'))""",
+]
+
+# calculate_corr(primary_col) from nyc_alt_data_analysis.sql is plpgsql; the table macro below returns the same
+# (col_name, correlation) rows: correlation of 12 month differences of monthly averages, feature -> daily column
+YOY_FEATURES = {'yoy_sale': 'avg_price', 'yoy_rest_app': 'new_restaurants', 'yoy_prop_count': 'total_sales',
+                'yoy_311': 'complaints', 'yoy_new_biz': 'new_businesses', 'yoy_evict': 'evictions',
+                'yoy_rest_insp': 'avg_health_inspection', 'yoy_rest_insp_ct': 'total_inspections',
+                'yoy_arrest': 'num_arrests', 'yoy_job_ct': 'jobs_filed'}
+
+
+def calculate_corr_macro() -> str:
+    averages = ', '.join(f'AVG({col}) AS {feature}' for feature, col in YOY_FEATURES.items())
+    diffs = ', '.join(f'{f} - LAG({f}, 12) OVER (ORDER BY month) AS {f}' for f in YOY_FEATURES)
+    return f"""CREATE OR REPLACE MACRO calculate_corr(primary_col) AS TABLE
+WITH monthly AS (SELECT date_trunc('month', event_date) AS month, {averages} FROM {DAILY_MV} GROUP BY 1),
+     yoy AS (SELECT month, {diffs} FROM monthly),
+     yoy_long AS (UNPIVOT yoy ON COLUMNS(* EXCLUDE (month)) INTO NAME col_name VALUE value),
+     pairs AS (SELECT other.col_name, corr(p.value, other.value) AS r
+               FROM yoy_long p JOIN yoy_long other ON p.month = other.month
+               WHERE p.col_name = primary_col
+               GROUP BY other.col_name)
+-- like the plpgsql loop, a NULL correlation (no overlapping months) comes back as 1
+SELECT f.col_name, CASE WHEN pairs.r != 1 THEN pairs.r ELSE 1 END AS correlation
+FROM (SELECT unnest({list(YOY_FEATURES)}) AS col_name) f
+    LEFT JOIN pairs ON f.col_name = pairs.col_name"""
+
+
+_SQL_TOKEN = re.compile(r"'(?:''|[^'])*'|\"(?:\"\"|[^\"])*\"|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$|;", re.S)
+_PG_FUNCTION = re.compile(r'^\s*create\s+(?:or\s+replace\s+)?function\s+(\w+)', re.I)
+
+
+def split_statements(sql: str) -> List[str]:
+    """Split a script on semicolons outside quotes, comments and $$ bodies."""
+    statements, start = [], 0
+    for token in _SQL_TOKEN.finditer(sql):
+        if token.group() == ';':
+            statements.append(sql[start:token.start()])
+            start = token.end()
+    statements.append(sql[start:])
+    uncommented = (_SQL_TOKEN.sub(lambda t: '' if t.group().startswith(('--', '/*')) else t.group(), s) for s in statements)
+    return [s.strip() for s in uncommented if s.strip()]
+
+
+_AGGREGATED_COLUMN = re.compile(r'\(\s*"?([^"()*]+?)"?\s*\)')
+_PYFORMAT = re.compile(r'%\((\w+)\)s')
+_NUMERIC_CAST = re.compile(r'::\s*numeric\b(?!\s*\()', re.I)
+_TO_DATE = re.compile(r"\bto_date\((\"(?:[^\"]|\"\")+\"|'(?:[^']|'')*'|\w+),\s*'([^']*)'\)", re.I)
+TO_DATE_FORMATS = {'YYYY': '%Y', 'MM': '%m', 'DD': '%d'}
+
+
+def _strptime(match: re.Match) -> str:
+    fmt = match.group(2)
+    for pg, strftime in TO_DATE_FORMATS.items():
+        fmt = fmt.replace(pg, strftime)
+    return f"strptime({match.group(1)}, '{fmt}') :: date"
+
+
+def to_duckdb_sql(sql: str, params: dict = None) -> str:
+    """
+    Rewrite the Postgres spellings DuckDB reads differently: %(name)s placeholders (what pd.read_sql on
+    psycopg2 takes) become $name, bare ::numeric casts, arbitrary precision in Postgres but DECIMAL(18,3)
+    in DuckDB, become DOUBLE, and to_date(col, 'MM/DD/YYYY') becomes strptime with a constant format.
+    """
+    sql = _NUMERIC_CAST.sub(':: DOUBLE', sql)
+    sql = _TO_DATE.sub(_strptime, sql)
+    if not params:
+        return sql
+    return _PYFORMAT.sub(r'$\1', sql).replace('%%', '%')
+
+
+class DuckDBBackend:
+    """DuckDB connection with Postgres-named views over the Parquet mirror, created on first use."""
+
+    name = 'duckdb'  # like an SQLAlchemy engine's dialect name, so callers can tell backends apart
+
+    def __init__(self, mirror_dir: str = MIRROR_DIR, database: str = DUCKDB_PATH, threads: int = DUCKDB_THREADS):
+        self.mirror_dir = Path(mirror_dir)
+        self.database = database
+        self.threads = threads
+        self.views: Dict[str, List[str]] = {}  # view -> mirrored sources it reads
+        self._con = None
+        self._lock = threading.Lock()
+
+    @property
+    def con(self) -> duckdb.DuckDBPyConnection:
+        if self._con is None:
+            with self._lock:
+                if self._con is None:
+                    con = duckdb.connect(self.database)
+                    # Postgres sorts NULL as the largest value, which window ranks in the analysis SQL rely on
+                    con.execute("SET default_null_order = 'nulls_last_on_asc_first_on_desc'")
+                    if self.threads:
+                        con.execute(f'SET threads = {int(self.threads)}')
+                    self._register_views(con)
+                    self._con = con
+        return self._con
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """Cursor on the shared database; one per thread, DuckDB connections are not thread safe."""
+        return self.con.cursor()
+
+    def _dataset(self, source: str) -> str:
+        return f"read_parquet('{(self.mirror_dir / source).as_posix()}/**/*.parquet', hive_partitioning = true)"
+
+    def _register_views(self, con: duckdb.DuckDBPyConnection) -> None:
+        mirrored = {p.name for p in self.mirror_dir.glob('*') if p.is_dir() and any(p.rglob('*.parquet'))}
+        # every mirror is also a view under its directory name (e.g. nypd_arrests, operating_businesses, which
+        # the ETL writes and DAILY_SOURCES reads), next to its old Postgres aliases
+        tables = {**{source: (source, '*') for source in mirrored}, **TABLE_VIEWS}
+        for table, (source, select) in tables.items():
+            if source in mirrored:
+                con.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT {select} FROM {self._dataset(source)}')
+                self.views[table] = [source]
+        for table, (parent, query) in DERIVED_VIEWS.items():
+            if parent in self.views and table not in self.views:
+                con.execute(f'CREATE OR REPLACE VIEW "{table}" AS {query}')
+                self.views[table] = self.views[parent]
+
+        for s in DAILY_SOURCES.values():
+            if s.table not in self.views:
+                # empty stand-in for a source that was never mirrored, so the joins keep their columns
+                measured = [col for expr in s.measures.values() for col in _AGGREGATED_COLUMN.findall(expr)]
+                date_type = 'VARCHAR' if s.date_format else 'TIMESTAMP'
+                columns = [f'NULL :: {date_type} AS "{s.date_col}"', *(f'NULL :: DOUBLE AS "{c}"' for c in measured)]
+                con.execute(f'CREATE OR REPLACE VIEW "{s.table}" AS SELECT {", ".join(columns)} WHERE false')
+                self.views[s.table] = []
+            column_type = con.execute(date_column_query([s])).fetchone()
+            select = daily_summary_select(s, column_type=column_type and column_type[2])
+            con.execute(f'CREATE OR REPLACE VIEW {s.summary_table} AS {to_duckdb_sql(select)}')
+            self.views[s.summary_table] = self.views[s.table]
+        con.execute(f'CREATE OR REPLACE VIEW {DAILY_MV} AS {daily_mv_query()}')
+        self.views[DAILY_MV] = sorted({src for s in DAILY_SOURCES.values() for src in self.views[s.summary_table]})
+        for macro in [*COMPAT_MACROS, calculate_corr_macro()]:
+            con.execute(macro)
+        print(f'DuckDB backend: {len(mirrored)} mirrored sources from {self.mirror_dir}, {len(self.views)} views')
+
+    def read_sql(self, sql: str, params: dict = None, parse_dates: Iterable[str] = None,
+                 index_col: str = None) -> pd.DataFrame:
+        """
+        pd.read_sql equivalent; the query text can be the Postgres version.
+
+        :param sql: Query with %(name)s (or $name) placeholders.
+        :param params: Placeholder values.
+        :param parse_dates: Columns to convert to datetime64.
+        :param index_col: Column to set as the index.
+        :return: Query result.
+        """
+        df = self.cursor().execute(to_duckdb_sql(sql, params), params or None).df()
+        for col in parse_dates or ():
+            df[col] = pd.to_datetime(df[col])
+        return df.set_index(index_col) if index_col else df
+
+    def execute(self, sql: str, params: dict = None) -> duckdb.DuckDBPyConnection:
+        return self.cursor().execute(to_duckdb_sql(sql, params), params or None)
+
+    def read_sql_file(self, path: str) -> List[pd.DataFrame]:
+        """
+        Run every query of a .sql file (e.g. sql_queries/nyc_alt_data_analysis.sql), one frame each.
+        plpgsql function definitions are skipped; the ones the queries call exist here as macros.
+        """
+        cursor = self.cursor()
+        frames = []
+        for statement in split_statements(Path(path).read_text()):
+            function = _PG_FUNCTION.match(statement)
+            if function:
+                print(f'Skipping Postgres function {function.group(1)} in {path}, served by a DuckDB macro')
+                continue
+            frames.append(cursor.execute(to_duckdb_sql(statement)).df())
+        return frames
+
+    def freshness(self, tables: Iterable[str]) -> Dict[str, list]:
+        """Fingerprint from the mirror manifests of the sources behind each view; nothing is scanned."""
+        self.con  # views (and their sources) are registered on connect
+        fingerprint = {}
+        for table in tables:
+            sources = self.views.get(table.strip('"'), [])
+            manifests = [self.mirror_dir / source / '_manifest.json' for source in sources]
+            fingerprint[table] = [f"{m.get('version')}@{m.get('converted_at')}" for m in
+                                  (json.loads(path.read_text()) if path.exists() else {} for path in manifests)]
+        return fingerprint
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+            self.views = {}
+
+
+_default_backend = None
+
+
+def get_duckdb() -> DuckDBBackend:
+    """Shared backend over MIRROR_DIR, created on first use."""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = DuckDBBackend()
+    return _default_backend
+
+
+def _forget_connection_after_fork():
+    # a forked worker must not share the parent's DuckDB handle
+    if _default_backend is not None:
+        _default_backend._con = None
+
+
+os.register_at_fork(after_in_child=_forget_connection_after_fork)
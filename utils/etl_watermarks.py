@@ -0,0 +1,74 @@
+"""
+Purpose: Watermark and partition bookkeeping for incremental alt data aggregation.
+
+Per source we store the last processed date (etl_watermarks) and the row count of every
+'yr-month' partition seen at that time (etl_partition_counts). Comparing fresh counts against
+the stored ones gives the new and late-arriving months, and only those partitions are
+recomputed and swapped into the aggregate tables.
+"""
+
+from datetime import datetime
+from typing import Iterable, Set
+
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+from utils.date_utils import month_key, period_label
+
+WATERMARK_TABLE = 'etl_watermarks'
+PARTITION_TABLE = 'etl_partition_counts'
+
+
+def month_partition_counts(dates: pd.Series) -> pd.Series:
+    """Row count per 'YYYY-MM' partition."""
+    counts = pd.Series(month_key(dates)).value_counts().sort_index()
+    counts.index = period_label(counts.index.to_numpy(), 'M')
+    return counts
+
+
+def read_watermarks(engine) -> pd.DataFrame:
+    if not inspect(engine).has_table(WATERMARK_TABLE):
+        return pd.DataFrame(columns=['source', 'last_date', 'updated_at'])
+    return pd.read_sql(f'SELECT * FROM {WATERMARK_TABLE}', engine)
+
+
+def read_partition_counts(engine, source: str) -> pd.Series:
+    if not inspect(engine).has_table(PARTITION_TABLE):
+        return pd.Series(dtype='int64')
+    stored = pd.read_sql(text(f'SELECT yr_month, row_count FROM {PARTITION_TABLE} WHERE source = :source'),
+                         engine, params={'source': source})
+    return stored.set_index('yr_month')['row_count']
+
+
+def changed_partitions(engine, source: str, counts: pd.Series) -> Set[str]:
+    """Months that are new, late-arriving (count changed) or emptied since the last run."""
+    stored = read_partition_counts(engine, source)
+    aligned = pd.concat([counts.rename('current'), stored.rename('stored')], axis=1).fillna(0)
+    return set(aligned.index[aligned['current'] != aligned['stored']])
+
+
+def replace_partitions(df: pd.DataFrame, table: str, engine, key_col: str, keys: Iterable) -> None:
+    """Upsert partitions: delete the given partition keys from the table and insert their recomputed rows."""
+    keys = list(keys)
+    with engine.begin() as conn:
+        if inspect(conn).has_table(table) and keys:
+            delete = text(f'DELETE FROM "{table}" WHERE "{key_col}" IN :keys').bindparams(bindparam('keys', expanding=True))
+            conn.execute(delete, {'keys': keys})
+        df.to_sql(table, conn, if_exists='append', index=False)
+
+
+def reset_source(engine, source: str, tables: Iterable[str] = ()) -> None:
+    """Forget a source's partition counts (and drop the given tables) so the next run rebuilds every month."""
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+        if inspect(conn).has_table(PARTITION_TABLE):
+            conn.execute(text(f'DELETE FROM {PARTITION_TABLE} WHERE source = :source'), {'source': source})
+
+
+def save_watermark(engine, source: str, last_date, counts: pd.Series) -> None:
+    """Record the last processed date and partition counts for a source."""
+    watermark = pd.DataFrame([{'source': source, 'last_date': pd.Timestamp(last_date), 'updated_at': datetime.utcnow()}])
+    partitions = pd.DataFrame({'source': source, 'yr_month': counts.index, 'row_count': counts.to_numpy()})
+    replace_partitions(watermark, WATERMARK_TABLE, engine, 'source', [source])
+    replace_partitions(partitions, PARTITION_TABLE, engine, 'source', [source])
@@ -0,0 +1,164 @@
+"""
+Purpose: Dense (period, geography, source) feature store in a memory-mapped file.
+
+The census analysis kept one long DataFrame per source and filtered data[data['tract_1000_grp'] == tract]
+inside every loop. A FeatureCube holds all sources for all geographies in one float array, NaN where a
+source has no value, with the coordinates (period frequency and first period, geography codes, source
+names) in coords.json next to it. The array is period-major, so appending new periods only appends bytes
+to the file, and readers that mapped the shorter file stay valid. A geography's multi-source panel or a
+source's geography panel is an index into the mapped array, returned as a DataFrame over the same memory.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from utils.date_utils import key_start
+
+CUBE_DIR = os.getenv('ALT_DATA_CUBE_DIR', 'feature_cubes')
+VALUES_FILE = 'values.bin'
+COORDS_FILE = 'coords.json'
+
+
+class FeatureCube:
+    """Period-major memory-mapped array of shape (periods, geographies, sources)."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        coords = json.loads((self.path / COORDS_FILE).read_text())
+        self.freq = coords['freq']
+        self.start = coords['start']  # date_utils key of the first period, None while empty
+        self.length = coords['length']
+        self.dtype = np.dtype(coords['dtype'])
+        self.geos = coords['geos']
+        self.sources = coords['sources']
+        self._geo_index = {geo: i for i, geo in enumerate(self.geos)}
+        self._source_index = {source: i for i, source in enumerate(self.sources)}
+        self._values = None
+
+    @classmethod
+    def create(cls, path: str, geos: Iterable, sources: Iterable[str], freq: str = 'D', dtype: str = 'float64',
+               overwrite: bool = False) -> 'FeatureCube':
+        """
+        Empty cube with fixed coordinates.
+
+        :param path: Directory for the data file and coords.json.
+        :param geos: Geography codes (e.g. tract groups 1..30), in axis order.
+        :param sources: Source / feature names, in axis order.
+        :param freq: Period of the time axis, 'D', 'W' or 'M' (date_utils keys).
+        :param dtype: Stored float type.
+        :param overwrite: Replace an existing cube at path.
+        :return: FeatureCube with no periods.
+        """
+        path = Path(path)
+        if path.exists():
+            if not overwrite:
+                raise FileExistsError(f'Feature cube already exists at {path}')
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        (path / VALUES_FILE).touch()
+        geos = [g.item() if isinstance(g, np.generic) else g for g in geos]
+        coords = {'freq': freq, 'start': None, 'length': 0, 'dtype': np.dtype(dtype).name,
+                  'geos': geos, 'sources': list(sources)}
+        (path / COORDS_FILE).write_text(json.dumps(coords))
+        return cls(path)
+
+    @property
+    def shape(self) -> tuple:
+        return self.length, len(self.geos), len(self.sources)
+
+    @property
+    def end(self) -> int:
+        """Key of the first period not yet stored."""
+        return None if self.start is None else self.start + self.length
+
+    @property
+    def values(self) -> np.ndarray:
+        """Read-only mapping of the whole array."""
+        if self._values is None or len(self._values) != self.length:
+            if self.length == 0:
+                self._values = np.empty(self.shape, dtype=self.dtype)
+            else:
+                self._values = np.memmap(self.path / VALUES_FILE, dtype=self.dtype, mode='r', shape=self.shape)
+        return self._values
+
+    def periods(self, rows: slice = slice(None)) -> pd.DatetimeIndex:
+        """First day of each stored period (of a row slice)."""
+        keys = np.arange(self.length)[rows] + (self.start or 0)
+        return pd.DatetimeIndex(key_start(keys, self.freq).astype('datetime64[ns]'))
+
+    def rows(self, start_key: int = None, end_key: int = None) -> slice:
+        """Row slice for period keys start_key .. end_key (inclusive); offsets, no search."""
+        if self.start is None:
+            return slice(0, 0)
+        lo = 0 if start_key is None else max(int(start_key) - self.start, 0)
+        hi = self.length if end_key is None else min(int(end_key) - self.start + 1, self.length)
+        return slice(lo, max(hi, lo))
+
+    def append(self, block: np.ndarray, start_key: int = None) -> 'FeatureCube':
+        """
+        Append periods to the end of the time axis.
+
+        :param block: (periods, geographies, sources) values.
+        :param start_key: Period key of block[0], the current end by default; periods in between are NaN.
+        :return: self
+        """
+        if block.shape[1:] != self.shape[1:]:
+            raise ValueError(f'Block shape {block.shape} does not match cube shape {self.shape}')
+        start_key = self.end if start_key is None else start_key
+        if start_key is None:
+            raise ValueError('The first append needs a start_key')
+        if self.end is not None and start_key < self.end:
+            raise ValueError(f'Feature cube is append only: period {start_key} is before the end ({self.end})')
+        gap = 0 if self.end is None else start_key - self.end
+        with open(self.path / VALUES_FILE, 'ab') as f:
+            if gap:
+                f.write(np.full((gap,) + self.shape[1:], np.nan, dtype=self.dtype).tobytes())
+            f.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+        self.start = start_key if self.start is None else self.start
+        self.length += gap + len(block)
+        self._write_coords()
+        return self
+
+    def append_frame(self, df: pd.DataFrame, time_col: str, geo_col: str) -> 'FeatureCube':
+        """Append long format rows (period key, geography, one column per source) as new periods."""
+        df = df[df[geo_col].notna()]
+        unknown = set(df[geo_col].unique()) - set(self._geo_index)
+        if unknown:
+            raise ValueError(f'Geographies not in the cube: {sorted(unknown)}')
+        if df.empty:
+            return self
+        keys = df[time_col].to_numpy(dtype=np.int64)
+        if self.end is not None and keys.min() < self.end:
+            raise ValueError(f'Feature cube is append only: period {keys.min()} is before the end ({self.end})')
+        first = int(keys.min()) if self.end is None else self.end
+        block = np.full((int(keys.max()) - first + 1,) + self.shape[1:], np.nan, dtype=self.dtype)
+        geo_idx = df[geo_col].map(self._geo_index).to_numpy()
+        for col in [c for c in df.columns if c in self._source_index]:
+            block[keys - first, geo_idx, self._source_index[col]] = df[col].to_numpy(dtype=np.float64)
+        return self.append(block, start_key=first)
+
+    def _write_coords(self) -> None:
+        coords = {'freq': self.freq, 'start': self.start, 'length': self.length, 'dtype': self.dtype.name,
+                  'geos': self.geos, 'sources': self.sources}
+        tmp_path = self.path / f'{COORDS_FILE}.tmp'
+        tmp_path.write_text(json.dumps(coords))
+        tmp_path.replace(self.path / COORDS_FILE)
+
+    def panel(self, geo, sources: List[str] = None, start_key: int = None, end_key: int = None) -> pd.DataFrame:
+        """Periods x sources of one geography, a view into the mapped array (a copy when sources picks columns)."""
+        rows = self.rows(start_key, end_key)
+        values = self.values[rows, self._geo_index[geo]]
+        frame = pd.DataFrame(values, index=self.periods(rows), columns=self.sources, copy=False)
+        return frame if sources is None else frame[sources]
+
+    def source(self, name: str, start_key: int = None, end_key: int = None) -> pd.DataFrame:
+        """Periods x geographies of one source, a view into the mapped array."""
+        rows = self.rows(start_key, end_key)
+        values = self.values[rows, :, self._source_index[name]]
+        return pd.DataFrame(values, index=self.periods(rows), columns=self.geos, copy=False)
@@ -0,0 +1,287 @@
+"""
+Purpose: Vectorized Granger causality (ssr F-test) for many features against one target.
+
+Reproduces the 'ssr_ftest' p-values of statsmodels grangercausalitytests(data[[col, target]], maxlag=max_lag + 1)
+without fitting two OLS models per feature and lag or computing the three unused test variants. Every
+feature's lagged design is built once per lag, padded to a common length with zero rows (which add nothing
+to a least squares fit), and all features are solved together with one stacked QR. The restricted model
+(own lags + constant) is the leading block of the unrestricted one, so a single factorization gives both
+residual sums of squares.
+
+sliding_granger_pvalues runs the same test for every window data[date >= start] at once: per feature and
+lag the Gram matrix of [X | y] is accumulated backwards over rows, so each window's X'X and X'y are a
+reverse cumulative sum, and its SSRs come from a batched Cholesky of those small matrices instead of a refit.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from tqdm import tqdm
+
+RANK_TOL = 1e-10  # |R_kk| below this (relative to the largest) marks a rank deficient design
+CHOLESKY_RANK_TOL = 1e-7  # same test on a Cholesky factor of the normal equations, which carries half the digits
+
+
+def aggregate_rows(values: np.ndarray, agg_lags: int) -> np.ndarray:
+    """Mean of consecutive blocks of agg_lags rows (last block may be short), like groupby(arange // agg_lags).mean()."""
+    if agg_lags == 1:
+        return values
+    groups = np.arange(len(values)) // agg_lags
+    counts = np.bincount(groups).astype(np.float64)
+    return np.column_stack([np.bincount(groups, weights=values[:, j]) / counts for j in range(values.shape[1])])
+
+
+def feature_pairs(data: pd.DataFrame, target_col: str, date_col: str = 'date',
+                  agg_lags: int = 1) -> Dict[str, np.ndarray]:
+    """(n, 2) array of [feature, target] per feature, rows with a missing value in either dropped."""
+    target = data[target_col].to_numpy(dtype=np.float64)
+    pairs = {}
+    for col in data.columns:
+        if col in (date_col, target_col):
+            continue
+        values = np.column_stack([data[col].to_numpy(dtype=np.float64), target])
+        pairs[col] = aggregate_rows(values[~np.isnan(values).any(axis=1)], agg_lags)
+    return pairs
+
+
+def lagged_design(pairs: np.ndarray, lengths: np.ndarray, lag: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Stacked regression for one lag over zero padded series.
+
+    :param pairs: (features, n_max, 2) [y, x] series, zero beyond each feature's length.
+    :param lengths: Series length per feature.
+    :param lag: Number of lags of y and x.
+    :return: y (features, rows), X (features, rows, 2 * lag + 1) ordered [y lags, constant, x lags], and the
+        valid row mask; rows past a feature's end are all zero.
+    """
+    n_max = pairs.shape[1]
+    t = np.arange(lag, n_max)
+    valid = t[None, :] < lengths[:, None]
+    own = [pairs[:, t - k, 0] for k in range(1, lag + 1)]
+    cross = [pairs[:, t - k, 1] for k in range(1, lag + 1)]
+    X = np.stack(own + [np.ones((len(pairs), len(t)))] + cross, axis=2) * valid[:, :, None]
+    return pairs[:, t, 0] * valid, X, valid
+
+
+def _ssr_qr(y: np.ndarray, X: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Residual sums of squares on the first k columns and on all columns, plus a full rank flag.
+
+    Only R of [X | y] is needed: its last column is Q'y, whose final entry squared is the unrestricted SSR and
+    whose entries past k add the part of y the extra columns explain back onto the restricted SSR.
+    """
+    R = np.linalg.qr(np.concatenate([X, y[:, :, None]], axis=2), mode='r')
+    qy = R[:, :, -1]
+    ssr_joint = qy[:, -1] ** 2
+    ssr_own = ssr_joint + (qy[:, k:-1] ** 2).sum(axis=1)
+    diag = np.abs(np.diagonal(R[:, :-1, :-1], axis1=1, axis2=2))
+    full_rank = (diag > RANK_TOL * diag.max(axis=1, keepdims=True)).all(axis=1)
+    return ssr_own, ssr_joint, full_rank
+
+
+def _ssr_lstsq(y: np.ndarray, X: np.ndarray) -> Tuple[float, int]:
+    """Minimum norm fit (what statsmodels OLS does via pinv) for a rank deficient design."""
+    params = np.linalg.lstsq(X, y, rcond=None)[0]
+    return float(((y - X @ params) ** 2).sum()), int(np.linalg.matrix_rank(X))
+
+
+def granger_pvalues(data: pd.DataFrame, max_lag: int, target_col: str = 'avg_price', date_col: str = 'date',
+                    agg_lags: int = 1, debug: bool = False, test_lag: int = None) -> pd.DataFrame:
+    """
+    ssr F-test p-values of every feature against the target for lags 1..max_lag.
+
+    Like the statsmodels loop it replaces, the test runs up to max_lag + 1 and a feature is dropped when any
+    of those lags is infeasible (too few observations, a constant lag column, a perfect fit).
+
+    :param data: Date column, target column and feature columns.
+    :param max_lag: Largest lag reported.
+    :param target_col: Column whose lags enter the unrestricted model (second column of the statsmodels input).
+    :param date_col: Column to ignore.
+    :param agg_lags: Average this many consecutive rows before testing.
+    :param debug: Print why features were dropped.
+    :param test_lag: Largest lag tested (statsmodels maxlag), max_lag + 1 by default.
+    :return: DataFrame indexed by feature, columns 'Lag {i * agg_lags}'.
+    """
+    test_lag = max_lag + 1 if test_lag is None else test_lag
+    columns = [f'Lag {i * agg_lags}' for i in range(1, max_lag + 1)]
+    pairs = {}
+    for col, values in feature_pairs(data, target_col, date_col, agg_lags).items():
+        if len(values) <= 3 * test_lag + 1:
+            if debug:
+                print(f'Error with {col}, Insufficient observations ({len(values)}) for lag {test_lag}')
+        elif not np.isfinite(values).all():
+            if debug:
+                print(f'Error with {col}, x contains NaN or inf values.')
+        else:
+            pairs[col] = values
+    if not pairs:
+        return pd.DataFrame(columns=columns, dtype=np.float64)
+
+    names = list(pairs)
+    lengths = np.array([len(v) for v in pairs.values()])
+    padded = np.zeros((len(names), lengths.max(), 2))
+    for i, values in enumerate(pairs.values()):
+        padded[i, :len(values)] = values
+
+    # changes[f, i, c]: value changes in series c of feature f up to row i, so a slice is constant when
+    # its endpoints have the same count
+    changes = np.concatenate([np.zeros((len(names), 1, 2)), np.cumsum(padded[:, 1:] != padded[:, :-1], axis=1)], axis=1)
+    feasible = np.ones(len(names), dtype=bool)
+    pvalues = np.full((len(names), max_lag), np.nan)
+    for lag in range(1, test_lag + 1):
+        y, X, valid = lagged_design(padded, lengths, lag)
+        rows = valid.sum(axis=1)
+        # a constant lag column (besides the intercept) makes statsmodels refuse the whole feature;
+        # lag k covers rows lag - k .. length - 1 - k of each series
+        k = np.arange(1, lag + 1)
+        first, last = lag - k, lengths[:, None] - 1 - k
+        features = np.arange(len(names))[:, None]
+        feasible &= (changes[features, last] != changes[features, first[None, :]]).all(axis=(1, 2))
+
+        ssr_own, ssr_joint, full_rank = _ssr_qr(y, X, lag + 1)
+        rank = np.full(len(names), 2 * lag + 1)
+        for i in np.flatnonzero(~full_rank):
+            m = rows[i]
+            ssr_own[i] = _ssr_lstsq(y[i, :m], X[i, :m, :lag + 1])[0]
+            ssr_joint[i], rank[i] = _ssr_lstsq(y[i, :m], X[i, :m])
+
+        y_mean = y.sum(axis=1) / rows
+        tss = (((y - y_mean[:, None]) * valid) ** 2).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            feasible &= (tss != 0) & (ssr_joint != 0) & (ssr_joint / tss >= np.finfo(float).eps)
+            df_resid = rows - rank
+            fstat = (ssr_own - ssr_joint) / ssr_joint / lag * df_resid
+        if lag <= max_lag:
+            pvalues[:, lag - 1] = stats.f.sf(fstat, lag, df_resid)
+
+    if debug:
+        for col in np.array(names)[~feasible]:
+            print(f'Error with {col}, constant lag column or perfect fit')
+    return pd.DataFrame(pvalues[feasible], index=np.array(names)[feasible], columns=columns)
+
+
+def _window_tests(gram: np.ndarray, lag: int):
+    """_ssr_qr from the Gram matrices of [X | y]: their Cholesky factor is R of the augmented design."""
+    L = np.linalg.cholesky(gram)
+    r = L[:, -1, :]  # last column of the upper factor, i.e. Q'y
+    ssr_joint = r[:, -1] ** 2
+    ssr_own = ssr_joint + (r[:, lag + 1:-1] ** 2).sum(axis=1)
+    diag = np.abs(np.diagonal(L[:, :-1, :-1], axis1=1, axis2=2))
+    full_rank = (diag > CHOLESKY_RANK_TOL * diag.max(axis=1, keepdims=True)).all(axis=1)
+    return ssr_own, ssr_joint, full_rank
+
+
+def _scan_feature(pair: np.ndarray, starts: np.ndarray, max_lag: int) -> np.ndarray:
+    """
+    p-values (len(starts), max_lag) of one [y, x] series for the windows pair[start:].
+
+    :param pair: (n, 2) feature and target, no missing values.
+    :param starts: First row of every window.
+    :param max_lag: Largest lag reported; feasibility is checked up to max_lag + 1 like granger_pvalues.
+    :return: p-values, NaN where the window is infeasible.
+    """
+    n, test_lag = len(pair), max_lag + 1
+    unique_starts, window_of = np.unique(starts, return_inverse=True)
+    nonfinite_after = np.cumsum((~np.isfinite(pair)).any(axis=1)[::-1])[::-1]
+    feasible = (n - unique_starts > 3 * test_lag + 1) & (np.append(nonfinite_after, 0)[unique_starts] == 0)
+    changes = np.concatenate([[[0, 0]], np.cumsum(pair[1:] != pair[:-1], axis=0)])
+    pvalues = np.full((len(unique_starts), max_lag), np.nan)
+    for lag in range(1, test_lag + 1):
+        k = np.arange(1, lag + 1)
+        # lag k of a window starting at j covers rows j + lag - k .. n - 1 - k of each series
+        first = np.clip(unique_starts[:, None] + lag - k, 0, n - 1)
+        feasible &= (changes[n - 1 - k] != changes[first]).all(axis=(1, 2))
+
+        t = np.arange(lag, n)
+        z = np.column_stack([pair[t - j, 0] for j in k] + [np.ones(len(t))] + [pair[t - j, 1] for j in k] + [pair[t, 0]])
+        # gram[j] = Z[j:]' Z[j:], the window starting at j uses rows t >= j + lag
+        gram = np.cumsum(np.einsum('ti,tj->tij', z, z)[::-1], axis=0)[::-1]
+        idx = np.flatnonzero(feasible)
+        grams = gram[unique_starts[idx]]
+        try:
+            ssr_own, ssr_joint, full_rank = _window_tests(grams, lag)
+        except np.linalg.LinAlgError:
+            ssr_own, ssr_joint, full_rank = (np.full(len(idx), np.nan), np.full(len(idx), np.nan),
+                                             np.zeros(len(idx), dtype=bool))
+        rows = n - unique_starts[idx] - lag
+        rank = np.full(len(idx), 2 * lag + 1)
+        for i in np.flatnonzero(~full_rank):
+            window = z[unique_starts[idx[i]]:]
+            ssr_own[i] = _ssr_lstsq(window[:, -1], window[:, :lag + 1])[0]
+            ssr_joint[i], rank[i] = _ssr_lstsq(window[:, -1], window[:, :-1])
+
+        tss = grams[:, -1, -1] - grams[:, lag, -1] ** 2 / rows
+        with np.errstate(invalid='ignore', divide='ignore'):
+            feasible[idx] &= (tss > 0) & (ssr_joint > 0) & (ssr_joint / tss >= np.finfo(float).eps)
+            df_resid = rows - rank
+            fstat = (ssr_own - ssr_joint) / ssr_joint / lag * df_resid
+        if lag <= max_lag:
+            pvalues[idx, lag - 1] = stats.f.sf(fstat, lag, df_resid)
+    pvalues[~feasible] = np.nan
+    return pvalues[window_of]
+
+
+_scan_cache: Dict[str, pd.DataFrame] = {}
+
+
+def scan_key(data: pd.DataFrame, *args) -> str:
+    """Hash of the frame's contents, column names and the scan arguments."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    digest.update(repr((list(data.columns), args)).encode())
+    return digest.hexdigest()
+
+
+def sliding_granger_pvalues(data: pd.DataFrame, max_lag: int, target_col: str = 'avg_price', date_col: str = 'date',
+                            max_workers: int = None, progress: bool = True) -> pd.DataFrame:
+    """
+    granger_pvalues of data[data[date_col] >= start] for every start date, in one pass per feature.
+
+    :param data: Date column, target column and feature columns.
+    :param max_lag: Largest lag reported.
+    :param target_col: Target column.
+    :param date_col: Column the windows start on.
+    :param max_workers: Process pool size for the per-feature scans, 1 runs them in this process.
+    :param progress: Show a tqdm bar over features.
+    :return: DataFrame indexed by (start date, feature), columns 'Lag i'; NaN rows where the window is too
+        short or otherwise infeasible (granger_pvalues drops those features). Memoized on the inputs.
+    """
+    key = scan_key(data, max_lag, target_col, date_col)
+    if key in _scan_cache:
+        return _scan_cache[key].copy()
+
+    data = data.sort_values(date_col, kind='stable')
+    dates = data[date_col].to_numpy()
+    window_rows = np.searchsorted(dates, dates, side='left')  # date >= start keeps rows from the first such date
+    target = data[target_col].to_numpy(dtype=np.float64)
+    features, pairs, starts = [], [], []
+    for col in data.columns:
+        if col in (date_col, target_col):
+            continue
+        values = np.column_stack([data[col].to_numpy(dtype=np.float64), target])
+        kept = np.flatnonzero(~np.isnan(values).any(axis=1))
+        features.append(col)
+        pairs.append(values[kept])
+        starts.append(np.searchsorted(kept, window_rows))
+
+    max_lags = [max_lag] * len(features)
+    if max_workers == 1:
+        results = map(_scan_feature, pairs, starts, max_lags)
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+        results = executor.map(_scan_feature, pairs, starts, max_lags)
+    try:
+        pvalues = list(tqdm(results, total=len(features), desc='Granger window scan', disable=not progress))
+    finally:
+        if max_workers != 1:
+            executor.shutdown()
+
+    index = pd.MultiIndex.from_product([data[date_col], features], names=[date_col, 'feature'])
+    stacked = np.stack(pvalues, axis=1).reshape(len(dates) * len(features), max_lag) if features else np.empty((0, max_lag))
+    result = pd.DataFrame(stacked, index=index, columns=[f'Lag {i}' for i in range(1, max_lag + 1)])
+    _scan_cache[key] = result
+    return result.copy()
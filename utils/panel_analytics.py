@@ -0,0 +1,143 @@
+"""
+Purpose: Granger tests, ARIMA forecasts and pre/post impact estimates for every (source, geography)
+series of a FeatureCube in one call.
+
+The census analysis looped over tract groups and datasets, re-normalizing each pair and running one
+statsmodels fit at a time. PanelAnalytics z-scores every source against the target for all geographies at
+once (each pair over the periods where both are present, like dropna then (x - mean) / std), and fans
+the fits out over a process pool: one task per geography for Granger (all its sources in one batched
+granger_pvalues call), one per series for ARIMA and impact. Results come back as tidy frames indexed by
+(source, geo).
+"""
+
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from scipy import stats
+from statsmodels.tsa.arima.model import ARIMA
+
+from utils.date_utils import key_start
+from utils.feature_cube import FeatureCube
+from utils.granger_engine import granger_pvalues
+
+
+def normalize_pairs(sources: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Z-score every (period, geo, source) pair against the target over the periods where both are present.
+
+    :param sources: (periods, geos, sources) values.
+    :param target: (periods, geos) target values.
+    :return: normalized sources, the target normalized per pair (periods, geos, sources), and the pair mask.
+    """
+    target = np.broadcast_to(target[:, :, None], sources.shape)
+    present = ~np.isnan(sources) & ~np.isnan(target)
+
+    def zscore(values):
+        count = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(present, values, 0).sum(axis=0) / count
+            var = np.where(present, (values - mean) ** 2, 0).sum(axis=0) / (count - 1)
+            return np.where(present, (values - mean) / np.sqrt(var), np.nan)
+
+    return zscore(sources), zscore(target), present
+
+
+def _granger_task(args) -> pd.DataFrame:
+    geo, data, target, max_lag = args
+    # the F-test is invariant to rescaling either series, so one target column serves every pair;
+    # granger_pvalues drops each pair's missing rows itself
+    result = granger_pvalues(data, max_lag, target_col=target, date_col=None, test_lag=max_lag)
+    sources = [c for c in data.columns if c != target]
+    result = result.reindex(sources)
+    result.index = pd.MultiIndex.from_product([sources, [geo]], names=['source', 'geo'])
+    return result
+
+
+def _arima_task(args) -> pd.DataFrame:
+    source, geo, keys, values, freq, order, steps = args
+    keep = ~np.isnan(values)
+    if keep.sum() <= sum(order) + 2:
+        return pd.DataFrame()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        fit = ARIMA(values[keep], order=order).fit()
+    forecast = fit.get_forecast(steps)
+    interval = forecast.conf_int()
+    periods = key_start(keys[keep][-1] + np.arange(1, steps + 1), freq).astype('datetime64[ns]')
+    return pd.DataFrame({'source': source, 'geo': geo, 'period': periods, 'forecast': forecast.predicted_mean,
+                         'lower': interval[:, 0], 'upper': interval[:, 1], 'aic': fit.aic})
+
+
+def _impact_task(args) -> dict:
+    source, geo, response, covariate, intervention_point = args
+    keep = ~np.isnan(response) & ~np.isnan(covariate)
+    response, covariate = response[keep], covariate[keep]
+    split = int(len(response) * intervention_point) + 1  # pre period ends at that row, like the old pre_period
+    row = {'source': source, 'geo': geo, 'pre_periods': split, 'post_periods': len(response) - split}
+    if split < 4 or len(response) - split < 1:
+        return row
+    fit = sm.OLS(response[:split], sm.add_constant(covariate[:split])).fit()
+    prediction = fit.get_prediction(sm.add_constant(covariate[split:], has_constant='add'))
+    effect = response[split:] - prediction.predicted_mean
+    se = np.sqrt(np.mean(prediction.se_obs ** 2) / len(effect))
+    return {**row, 'actual': response[split:].mean(), 'predicted': prediction.predicted_mean.mean(),
+            'abs_effect': effect.mean(), 'p_value': 2 * stats.norm.sf(abs(effect.mean()) / se)}
+
+
+class PanelAnalytics:
+    """Every source against one target, for every geography of a FeatureCube."""
+
+    def __init__(self, cube: FeatureCube, target: str = 'SALE_PRICE', sources: Iterable[str] = None,
+                 geos: Iterable = None, max_workers: int = None):
+        """
+        :param cube: Feature cube holding the target and the sources.
+        :param target: Source of the cube every other one is tested against.
+        :param sources: Sources to analyse, every other source by default.
+        :param geos: Geographies to analyse, all by default.
+        :param max_workers: Process pool size, every core by default.
+        """
+        self.cube = cube
+        self.target = target
+        self.sources: List[str] = [s for s in (sources or cube.sources) if s != target]
+        self.geos = list(cube.geos if geos is None else geos)
+        self.max_workers = max_workers or os.cpu_count()
+        geo_idx = [cube.geos.index(g) for g in self.geos]
+        values = cube.values[:, geo_idx]
+        self.raw = values[:, :, [cube.sources.index(s) for s in self.sources]]
+        self.raw_target = values[:, :, cube.sources.index(target)]
+        self.normalized, self.normalized_target, self.present = normalize_pairs(self.raw, self.raw_target)
+
+    def _map(self, fn, tasks: list) -> list:
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(fn, tasks, chunksize=max(1, len(tasks) // (4 * self.max_workers))))
+
+    def granger(self, max_lag: int = 10) -> pd.DataFrame:
+        """ssr F-test p-values (target causing source, statsmodels maxlag=max_lag), (source, geo) x 'Lag i'."""
+        tasks = [(geo, pd.DataFrame({**dict(zip(self.sources, self.normalized[:, g].T)), self.target: self.raw_target[:, g]}),
+                  self.target, max_lag) for g, geo in enumerate(self.geos)]
+        return pd.concat(self._map(_granger_task, tasks)).sort_index()
+
+    def arima(self, order: tuple = (1, 1, 1), steps: int = 12, columns: Iterable[str] = None) -> pd.DataFrame:
+        """Forecasts of the raw series (the target by default) past each one's last observed period."""
+        columns = [self.target] if columns is None else list(columns)
+        keys = np.arange(self.cube.length) + (self.cube.start or 0)
+        tasks = [(col, geo, keys, self.raw_target[:, g] if col == self.target else self.raw[:, g, self.sources.index(col)],
+                  self.cube.freq, order, steps) for col in columns for g, geo in enumerate(self.geos)]
+        return pd.concat(self._map(_arima_task, tasks), ignore_index=True).set_index(['source', 'geo', 'period'])
+
+    def impact(self, intervention_point: float = 0.7) -> pd.DataFrame:
+        """
+        Pre/post effect per series: the source regressed on the target over the first intervention_point of
+        its periods, and the post period compared with that model's counterfactual.
+
+        :param intervention_point: Share of each pair's periods in the pre period.
+        :return: (source, geo) x actual / predicted post period means, mean absolute effect and its p-value.
+        """
+        tasks = [(source, geo, self.normalized[:, g, s], self.normalized_target[:, g, s], intervention_point)
+                 for s, source in enumerate(self.sources) for g, geo in enumerate(self.geos)]
+        return pd.DataFrame(self._map(_impact_task, tasks)).set_index(['source', 'geo'])
@@ -0,0 +1,250 @@
+"""
+Purpose: Monthly range partitioning with BRIN indexes for the large event tables.
+
+The Citi Bike ride tables hold 100M+ rows that arrive in time order, so a BRIN index on the time column is a
+few MB instead of a multi-GB B-tree, and monthly partitions let range scans skip whole months. This module
+- migrates a plain table (or a freshly loaded copy) into a partitioned one and swaps it in,
+- creates partitions for new months ahead of time,
+- bulk loads a month into a detached staging table and attaches it, so the live table is never rewritten.
+Rows with no time value land in a DEFAULT partition.
+"""
+
+import re
+import io
+import csv
+from typing import Dict, Iterable, List
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+PARTITIONED_TABLES: Dict[str, str] = {
+    'citibike_ride_history_full': 'start_time',
+    'citibike_rides_geocoded': 'start_time',
+}
+BRIN_PAGES_PER_RANGE = 32
+_PARTITION_SUFFIX = re.compile(r'(_p\d{4}_\d{2}|_default)$')
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def month_starts(start, end) -> List[pd.Timestamp]:
+    """First day of every month from start's month through end's month."""
+    return list(pd.date_range(pd.Timestamp(start).to_period('M').to_timestamp(),
+                              pd.Timestamp(end).to_period('M').to_timestamp(), freq='MS'))
+
+
+def partition_name(table: str, month) -> str:
+    return f'{table}_p{pd.Timestamp(month):%Y_%m}'
+
+
+def time_expr(conn, table: str, time_col: str) -> str:
+    """Time column as a timestamp; text columns (CSV loads) are cast."""
+    data_type = conn.execute(text("""
+        SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :col
+    """), {'table': table, 'col': time_col}).scalar()
+    return f'{quote(time_col)}::timestamp' if data_type in ('text', 'character varying') else quote(time_col)
+
+
+def partitions(conn, table: str) -> List[str]:
+    return conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname
+    """), {'table': quote(table)}).scalars().all()
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+                             {'table': quote(table)}).scalar())
+
+
+def create_partitioned_table(conn, table: str, time_col: str, like: str) -> None:
+    """Partitioned parent with like's columns, the time column typed as timestamp, plus a DEFAULT partition."""
+    columns = conn.execute(text("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(:table) AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """), {'table': quote(like)}).all()
+    definitions = ', '.join(f'{quote(name)} {"timestamp" if name == time_col else col_type}' for name, col_type in columns)
+    conn.execute(text(f'CREATE TABLE {quote(table)} ({definitions}) PARTITION BY RANGE ({quote(time_col)})'))
+    conn.execute(text(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT'))
+
+
+def ensure_partitions(conn, table: str, months: Iterable) -> List[str]:
+    """Create the monthly partitions that do not exist yet; returns the ones created."""
+    existing = set(partitions(conn, table))
+    created = []
+    for month in months:
+        name = partition_name(table, month)
+        if name in existing:
+            continue
+        lo, hi = pd.Timestamp(month), pd.Timestamp(month) + pd.DateOffset(months=1)
+        conn.execute(text(f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+                          f"FOR VALUES FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')"))
+        created.append(name)
+    return created
+
+
+def create_brin_index(conn, table: str, time_col: str, pages_per_range: int = BRIN_PAGES_PER_RANGE) -> None:
+    """BRIN on the partitioned parent, which creates it on every current and future partition."""
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {quote(f"{table}_{time_col}_brin")} ON {quote(table)} '
+                      f'USING brin ({quote(time_col)}) WITH (pages_per_range = {pages_per_range})'))
+
+
+def rename_partitions(conn, parent: str, prefix: str) -> None:
+    """Name every partition (and its indexes) after prefix, e.g. after the parent was renamed."""
+    for name in partitions(conn, parent):
+        suffix = _PARTITION_SUFFIX.search(name)
+        if not suffix:
+            continue
+        new_name = prefix + suffix.group(1)
+        if name != new_name:
+            conn.execute(text(f'ALTER TABLE {quote(name)} RENAME TO {quote(new_name)}'))
+        indexes = conn.execute(text('SELECT indexname FROM pg_indexes WHERE tablename = :table ORDER BY indexname'),
+                               {'table': new_name}).scalars().all()
+        for i, index in enumerate(indexes):
+            index_name = f'{new_name}_idx{i or ""}'
+            if index != index_name:
+                conn.execute(text(f'ALTER INDEX {quote(index)} RENAME TO {quote(index_name)}'))
+
+
+def migrate_table(engine, table: str, time_col: str, source: str = None, keep_old: bool = True,
+                  drop_source: bool = False) -> None:
+    """
+    Rebuild a table as monthly range partitions with a BRIN index on its time column and swap it in.
+
+    :param engine: SQLAlchemy engine (Postgres 11+).
+    :param table: Table to (re)create as partitioned.
+    :param time_col: Partition key, cast to timestamp if stored as text.
+    :param source: Table to copy rows from, defaults to table itself (in place migration).
+    :param keep_old: Keep the previous table as <table>_unpartitioned instead of dropping it.
+    :param drop_source: Drop source after the swap (when it is a separate staging/load table).
+    """
+    source = source or table
+    staging = f'{table}__partitioned'
+    with engine.begin() as conn:
+        cast = time_expr(conn, source, time_col)
+        lo, hi = conn.execute(text(f'SELECT MIN({cast}), MAX({cast}) FROM {quote(source)}')).one()
+        conn.execute(text(f'DROP TABLE IF EXISTS {quote(staging)} CASCADE'))
+        create_partitioned_table(conn, staging, time_col, like=source)
+        if lo is not None:
+            ensure_partitions(conn, staging, month_starts(lo, hi))
+        columns = conn.execute(text(f'SELECT * FROM {quote(source)} LIMIT 0')).keys()
+        select = ', '.join(cast if col == time_col else quote(col) for col in columns)
+        print(f'Copying {source} into {len(partitions(conn, staging))} partitions of {table}...')
+        # one scan of the source; Postgres routes every row to its month partition
+        conn.execute(text(f'INSERT INTO {quote(staging)} ({", ".join(map(quote, columns))}) '
+                          f'SELECT {select} FROM {quote(source)}'))
+        create_brin_index(conn, staging, time_col)
+
+    with engine.begin() as conn:
+        if inspect(conn).has_table(table):
+            old = f'{table}_unpartitioned'
+            conn.execute(text(f'DROP TABLE IF EXISTS {quote(old)} CASCADE'))
+            if keep_old:
+                conn.execute(text(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}'))
+                rename_partitions(conn, old, old)
+            else:
+                conn.execute(text(f'DROP TABLE {quote(table)} CASCADE'))
+        conn.execute(text(f'ALTER TABLE {quote(staging)} RENAME TO {quote(table)}'))
+        rename_partitions(conn, table, table)
+        conn.execute(text(f'ALTER INDEX {quote(f"{staging}_{time_col}_brin")} RENAME TO {quote(f"{table}_{time_col}_brin")}'))
+        if drop_source and source != table:
+            conn.execute(text(f'DROP TABLE IF EXISTS {quote(source)} CASCADE'))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text(f'ANALYZE {quote(table)}'))
+    print(f'{table} is now partitioned by month on {time_col}')
+
+
+def ensure_future_partitions(engine, table: str, months_ahead: int = 3) -> List[str]:
+    """Create partitions from the current month through months_ahead, e.g. from a scheduled job."""
+    now = pd.Timestamp.now()
+    with engine.begin() as conn:
+        return ensure_partitions(conn, table, month_starts(now, now + pd.DateOffset(months=months_ahead)))
+
+
+def copy_rows(table, conn, keys, data_iter):
+    """pandas to_sql method that streams rows through COPY instead of INSERT statements."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+    name = f'{quote(table.schema)}.{quote(table.name)}' if table.schema else quote(table.name)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f'COPY {name} ({", ".join(map(quote, keys))}) FROM STDIN WITH CSV', buffer)
+
+
+def load_month(engine, table: str, time_col: str, df: pd.DataFrame, month, replace: bool = True) -> None:
+    """
+    Load one month of rows into a detached staging table and attach it as that month's partition.
+
+    The staging table gets a CHECK constraint matching the partition bounds, so ATTACH does not have to
+    scan it, and the live table only sees a brief metadata lock for the detach/attach. Rows of the month
+    sitting in the DEFAULT partition (loaded before the month's partition existed) are moved out first, in
+    the same transaction, since ATTACH refuses a range the DEFAULT partition still has rows in; ATTACH
+    still scans the DEFAULT partition, which stays small (NULL times only).
+
+    :param replace: Replace the month's existing rows; otherwise they are copied into the staging table first.
+    """
+    lo = pd.Timestamp(month)
+    hi = lo + pd.DateOffset(months=1)
+    part, stage = partition_name(table, lo), f'{partition_name(table, lo)}_stage'
+    bounds = f"FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')"
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {quote(stage)}'))
+        conn.execute(text(f'CREATE TABLE {quote(stage)} (LIKE {quote(table)} INCLUDING DEFAULTS)'))
+        df.to_sql(stage, conn, if_exists='append', index=False, method=copy_rows, chunksize=500_000)
+        exists = part in partitions(conn, table)
+        if exists and not replace:
+            conn.execute(text(f'INSERT INTO {quote(stage)} SELECT * FROM {quote(part)}'))
+        default = quote(table + '_default')
+        in_month = f"{quote(time_col)} >= '{lo:%Y-%m-%d}' AND {quote(time_col)} < '{hi:%Y-%m-%d}'"
+        if replace:
+            conn.execute(text(f'DELETE FROM {default} WHERE {in_month}'))
+        else:
+            conn.execute(text(f'WITH moved AS (DELETE FROM {default} WHERE {in_month} RETURNING *) '
+                              f'INSERT INTO {quote(stage)} SELECT * FROM moved'))
+        conn.execute(text(f"ALTER TABLE {quote(stage)} ADD CONSTRAINT {quote(stage + '_range')} CHECK "
+                          f"({quote(time_col)} IS NOT NULL AND {quote(time_col)} >= '{lo:%Y-%m-%d}' "
+                          f"AND {quote(time_col)} < '{hi:%Y-%m-%d}')"))
+        if exists:
+            conn.execute(text(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(part)}'))
+            conn.execute(text(f'DROP TABLE {quote(part)}'))
+        conn.execute(text(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(stage)} FOR VALUES {bounds}'))
+        conn.execute(text(f'ALTER TABLE {quote(stage)} RENAME TO {quote(part)}'))
+        conn.execute(text(f"ALTER TABLE {quote(part)} DROP CONSTRAINT {quote(stage + '_range')}"))
+
+
+def load_partitioned(engine, table: str, time_col: str, df: pd.DataFrame, replace: bool = True) -> None:
+    """
+    Bulk load a DataFrame month by month through load_month, creating the partitioned table if needed.
+
+    :param replace: Replace the table's contents, like to_sql(if_exists='replace'): every month present in df
+        is swapped in and the partitions of months absent from df are truncated (kept, so pre-created future
+        months stay). Otherwise append to the existing rows. Use load_month to replace single months.
+    """
+    times = pd.to_datetime(df[time_col])
+    df = df.assign(**{time_col: times})
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table):
+            if inspect(conn).has_table(table):
+                raise ValueError(f'{table} exists but is not partitioned, run migrate_table first')
+            template = f'{table}__template'
+            df.head(0).to_sql(template, conn, if_exists='replace', index=False)
+            create_partitioned_table(conn, table, time_col, like=template)
+            create_brin_index(conn, table, time_col)
+            conn.execute(text(f'DROP TABLE {quote(template)}'))
+    loaded = set()
+    for month, rows in df[times.notna()].groupby(times.dt.to_period('M')):
+        load_month(engine, table, time_col, rows, month.to_timestamp(), replace=replace)
+        loaded.add(partition_name(table, month.to_timestamp()))
+        print(f'Loaded {len(rows)} rows into {partition_name(table, month.to_timestamp())}')
+    with engine.begin() as conn:
+        if replace:
+            stale = [p for p in partitions(conn, table) if p not in loaded and p != f'{table}_default']
+            conn.execute(text(f'TRUNCATE {", ".join(map(quote, [f"{table}_default", *stale]))}'))
+            if stale:
+                print(f'Emptied {len(stale)} month partitions not in the load')
+        if times.isna().any():
+            df[times.isna()].to_sql(table, conn, if_exists='append', index=False, method=copy_rows)
@@ -1,3 +1,8 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Tuple
+
+import pandas as pd
+
 
 
 sql_data_daily_query = """
@@ -122,4 +127,185 @@ FROM sales_sub s
          LEFT JOIN restaurants_sub r ON s.yr_week = r.yr_week
          LEFT JOIN health_inspections_sub h ON s.yr_week = h.yr_week
 ORDER BY s.yr_week;
-"""
\ No newline at end of file
+"""
+
+TEXT_TYPES = ('text', 'character varying', 'character', 'varchar')
+
+# Daily summary tables behind the nyc_alt_data_daily materialized view (see utils/daily_summary_refresh.py).
+# Every source is summarized once per real date into daily_<name>; summary columns are additive (counts and
+# sums, never averages) so days can be re-aggregated into weeks or months exactly.
+@dataclass(frozen=True)
+class DailySource:
+    name: str
+    table: str                  # raw source table
+    date_col: str               # date (or timestamp) column of the raw table, indexed
+    measures: Dict[str, str]    # summary column -> aggregate over raw rows
+    columns: Dict[str, str]     # output column -> aggregate over summary rows
+    date_format: str = None     # to_date format for when date_col holds text dates
+
+    @property
+    def summary_table(self) -> str:
+        return f'daily_{self.name}'
+
+    def parses_text(self, column_type: str = None) -> bool:
+        """
+        Whether date_col needs to_date: it has a date_format and is text. column_type is its
+        information_schema data_type (see date_column_query); None means unknown and assumes text.
+        sql_queries/date_field_optimization_and_indexing.sql converts these columns to date.
+        """
+        return bool(self.date_format) and (column_type is None or column_type.lower() in TEXT_TYPES)
+
+    def date_expr(self, column_type: str = None) -> str:
+        """date_col as a date."""
+        if self.parses_text(column_type):
+            return f"to_date(\"{self.date_col}\", '{self.date_format}')"
+        return f'"{self.date_col}" :: date'
+
+    def filter_expr(self, column_type: str = None) -> str:
+        """What date bounds are compared with: the bare column (so its index serves them) unless it is text."""
+        return self.date_expr(column_type) if self.parses_text(column_type) else f'"{self.date_col}"'
+
+
+DAILY_SOURCES: Dict[str, DailySource] = {source.name: source for source in [
+    # the ETL's parsed date; SALE_DATE is the raw text
+    DailySource('sales', 'sales', 'date',
+                measures={'total_sales': 'COUNT(*)', 'price_sum': 'SUM("SALE_PRICE")', 'price_count': 'COUNT("SALE_PRICE")'},
+                columns={'avg_price': 'SUM(price_sum) / NULLIF(SUM(price_count), 0)', 'total_sales': 'SUM(total_sales)'}),
+    DailySource('complaints', 'complaints', 'date',
+                measures={'complaints': 'COUNT(*)'}, columns={'complaints': 'SUM(complaints)'}),
+    # written by the ETL as operating_businesses (duckdb_backend maps the old businesses table to it too)
+    DailySource('businesses', 'operating_businesses', 'date',
+                measures={'new_businesses': 'COUNT(*)'}, columns={'new_businesses': 'SUM(new_businesses)'}),
+    DailySource('evictions', 'evictions', 'date',
+                measures={'evictions': 'COUNT(*)'}, columns={'evictions': 'SUM(evictions)'}),
+    DailySource('restaurants', 'restaurants', 'date',
+                measures={'new_restaurants': 'COUNT(*)'}, columns={'new_restaurants': 'SUM(new_restaurants)'}),
+    DailySource('health_inspections', 'health_inspections', 'date',
+                measures={'score_sum': 'SUM("SCORE")', 'score_count': 'COUNT("SCORE")', 'total_inspections': 'COUNT(*)'},
+                columns={'avg_health_inspection': 'SUM(score_sum) / NULLIF(SUM(score_count), 0)',
+                         'total_inspections': 'SUM(total_inspections)'}),
+    DailySource('arrests', 'nypd_arrests', 'ARREST_DATE',
+                measures={'num_arrests': 'COUNT(*)'}, columns={'num_arrests': 'SUM(num_arrests)'},
+                date_format='MM/DD/YYYY'),
+    DailySource('jobs_filed', 'job_application_filings', 'Pre- Filing Date',
+                measures={'jobs_filed': 'COUNT(*)'}, columns={'jobs_filed': 'SUM(jobs_filed)'},
+                date_format='MM/DD/YYYY'),
+    DailySource('citibike', 'citibike_daily', 'date',
+                measures={'num_rides': 'SUM(num_rides)'}, columns={'citibike_rides': 'SUM(num_rides)'}),
+]}
+
+DAILY_MV = 'nyc_alt_data_daily'
+DAILY_MV_INDEX = f'{DAILY_MV}_event_date_idx'
+
+
+def date_column_query(sources: Iterable[DailySource]) -> str:
+    """information_schema types of the sources' date columns, one (table_name, column_name, data_type) row each."""
+    pairs = ', '.join(f"('{s.table}', '{s.date_col}')" for s in sources)
+    return f"""
+SELECT table_name, column_name, data_type
+FROM information_schema.columns
+WHERE (table_name, column_name) IN ({pairs})"""
+
+
+def daily_summary_select(source: DailySource, incremental: bool = False, column_type: str = None) -> str:
+    """
+    Aggregate raw rows per date; incremental adds a :since lower bound the date index can serve.
+    column_type is date_col's information_schema type, so date columns are compared without to_date.
+    """
+    measures = ''.join(f'\n     , {expr} AS {col}' for col, expr in source.measures.items())
+    since = f'\n  AND {source.filter_expr(column_type)} >= :since' if incremental else ''
+    return f"""
+SELECT {source.date_expr(column_type)} AS date{measures}
+FROM {source.table}
+WHERE "{source.date_col}" IS NOT NULL{since}
+GROUP BY 1"""
+
+
+def daily_summary_upsert(source: DailySource, column_type: str = None) -> str:
+    cols = ', '.join(source.measures)
+    updates = ', '.join(f'{col} = EXCLUDED.{col}' for col in source.measures)
+    return f"""
+INSERT INTO {source.summary_table} (date, {cols}){daily_summary_select(source, incremental=True, column_type=column_type)}
+ON CONFLICT (date) DO UPDATE SET {updates}"""
+
+
+def daily_mv_query(sources: Dict[str, DailySource] = None) -> str:
+    """Join the daily summaries on their date keys, driven by sales like the original view."""
+    sources = list((sources or DAILY_SOURCES).values())
+    subs = ',\n'.join(
+        f"""     {s.name}_sub AS (
+                      SELECT date, {', '.join(f'{expr} AS {col}' for col, expr in s.columns.items())}
+                      FROM {s.summary_table}
+                      GROUP BY date
+                  )""" for s in sources)
+    columns = ''.join(f'\n     , {s.name}_sub.{col}' for s in sources for col in s.columns)
+    joins = ''.join(f'\n    LEFT JOIN {s.name}_sub ON {sources[0].name}_sub.date = {s.name}_sub.date' for s in sources[1:])
+    return f"""
+WITH {subs.lstrip()}
+SELECT {sources[0].name}_sub.date AS event_date{columns}
+FROM {sources[0].name}_sub{joins}
+ORDER BY {sources[0].name}_sub.date
+"""
+
+
+GRANULARITIES = ('day', 'week', 'month')
+
+
+def build_range_query(start=None, end=None, granularity: str = 'day', sources: Iterable[str] = None,
+                      use_summaries: bool = True, column_types: Dict[str, str] = None) -> Tuple[str, Dict[str, object]]:
+    """
+    Build a parameterized query over a date range at a given granularity.
+
+    Every source is filtered on its indexed date column first and then grouped with date_trunc, so a
+    one year dashboard query only touches that year's rows. Periods are the first day of the
+    day/week (ISO, Monday)/month as a real date.
+
+    :param start: Inclusive first date, None for no lower bound.
+    :param end: Inclusive last date, None for no upper bound.
+    :param granularity: 'day', 'week' or 'month'.
+    :param sources: Names in DAILY_SOURCES; the first one drives the join. Defaults to all of them.
+    :param use_summaries: Read the daily_<name> summary tables (see daily_summary_refresh) rather than raw tables.
+    :param column_types: Source name -> information_schema type of its raw date column (date_column_query),
+        used without summaries so date columns are filtered directly; missing sources are assumed text.
+    :return: (sql, params) with %(name)s placeholders, e.g. for pd.read_sql(sql, engine, params=params).
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of {GRANULARITIES}, got {granularity!r}')
+    sources = [DAILY_SOURCES[name] for name in (sources or DAILY_SOURCES)]
+    column_types = column_types or {}
+    params = {}
+    if start is not None:
+        params['start'] = pd.Timestamp(start).date()
+    if end is not None:
+        params['end'] = (pd.Timestamp(end) + pd.Timedelta(days=1)).date()
+
+    subs = []
+    for s in sources:
+        date_col = 'date' if use_summaries else s.filter_expr(column_types.get(s.name))
+        bounds = [f'{date_col} >= %(start)s' if 'start' in params else None,
+                  f'{date_col} < %(end)s' if 'end' in params else None]
+        where = ' AND '.join(b for b in bounds if b)
+        where = f'\n                      WHERE {where}' if where else ''
+        if use_summaries:
+            rows = s.summary_table
+        else:
+            measures = ', '.join(f'{expr} AS {col}' for col, expr in s.measures.items())
+            rows = f'(SELECT {s.date_expr(column_types.get(s.name))} AS date, {measures} FROM {s.table}{where} GROUP BY 1) AS raw'
+            where = ''
+        columns = ', '.join(f'{expr} AS {col}' for col, expr in s.columns.items())
+        subs.append(f"""     {s.name}_sub AS (
+                      SELECT date_trunc('{granularity}', date) :: date AS period, {columns}
+                      FROM {rows}{where}
+                      GROUP BY 1
+                  )""")
+
+    ctes = ',\n'.join(subs).lstrip()
+    columns = ''.join(f'\n     , {s.name}_sub.{col}' for s in sources for col in s.columns)
+    joins = ''.join(f'\n    LEFT JOIN {s.name}_sub ON {sources[0].name}_sub.period = {s.name}_sub.period' for s in sources[1:])
+    sql = f"""
+WITH {ctes}
+SELECT {sources[0].name}_sub.period{columns}
+FROM {sources[0].name}_sub{joins}
+ORDER BY {sources[0].name}_sub.period
+"""
+    return sql, params
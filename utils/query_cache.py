@@ -0,0 +1,235 @@
+"""
+Purpose: Local, freshness-aware cache of alt data query results.
+
+Results are stored as Parquet under QUERY_CACHE_DIR, keyed by a hash of the normalized SQL text plus its
+parameters. Each entry remembers a freshness fingerprint of the tables it read (Postgres catalog stats:
+relfilenode, which changes on a full MV refresh, plus insert/update/delete counters, which change on
+writes and concurrent refreshes; max(date) where the date column is known). A lookup re-probes that
+fingerprint, which is a few catalog/index lookups instead of re-aggregating the tables, and serves the
+Parquet file only if nothing changed; on the DuckDB backend the fingerprint is the version of the mirrored
+sources behind each view. The directory is kept under max_bytes by evicting least recently
+used entries.
+
+The insert/update/delete counters come from Postgres' cumulative statistics, which each backend flushes
+asynchronously (about once a second, and only after its transaction ends), so a write that changes neither
+relfilenode nor max(date) can go unnoticed for a moment after it commits; entries older than max_age are
+never served, which bounds that. The index file is shared by processes through an exclusive file lock
+(POSIX), re-read under the lock before every change.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.db_utils import get_backend, read_sql
+from utils.python_query_defs import DAILY_MV, DAILY_SOURCES
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock is per process only
+    fcntl = None
+
+QUERY_CACHE_DIR = os.getenv('ALT_DATA_QUERY_CACHE_DIR', 'query_cache')
+QUERY_CACHE_MAX_BYTES = int(os.getenv('ALT_DATA_QUERY_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+QUERY_CACHE_MAX_AGE = int(os.getenv('ALT_DATA_QUERY_CACHE_MAX_AGE', 6 * 3600))  # seconds
+
+# tables whose date column is known get max(date) (an index lookup) added to their fingerprint
+DATE_COLUMNS = {DAILY_MV: 'event_date',
+                **{s.table: s.date_col for s in DAILY_SOURCES.values()},
+                **{s.summary_table: 'date' for s in DAILY_SOURCES.values()}}
+
+_QUOTED = re.compile(r"('(?:''|[^'])*'|\"(?:\"\"|[^\"])*\")")
+_TABLE_REF = re.compile(r'\b(?:from|join)\s+("(?:[^"]|"")+"|[a-z_][\w$]*(?:\.[a-z_][\w$]*)?)')
+_CTE_NAME = re.compile(r'(?:\bwith|,)\s+([a-z_][\w$]*)\s+as\s*\(')
+
+PG_TABLE_STATS = """
+SELECT c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, s.n_live_tup
+FROM pg_class c
+    LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid
+WHERE c.oid = to_regclass(:name)
+"""
+
+
+def normalize_sql(sql: str) -> str:
+    """Drop comments, collapse whitespace and lowercase everything outside quoted strings/identifiers."""
+    parts = _QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        unquoted = re.sub(r'--[^\n]*', ' ', parts[i])
+        unquoted = re.sub(r'/\*.*?\*/', ' ', unquoted, flags=re.S)
+        parts[i] = re.sub(r'\s+', ' ', unquoted).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def query_tables(sql: str) -> List[str]:
+    """Tables/views a query reads (FROM/JOIN targets that are not its own CTEs)."""
+    normalized = normalize_sql(sql)
+    ctes = set(_CTE_NAME.findall(normalized))
+    tables = [t.strip('"') for t in _TABLE_REF.findall(normalized)]
+    return sorted({t for t in tables if t not in ctes})
+
+
+def engine_id(engine) -> str:
+    """Database a result came from: the URL without its password, or the DuckDB mirror directory."""
+    if engine.name == 'duckdb':
+        return f'duckdb:{Path(engine.mirror_dir).resolve()}'
+    return engine.url.render_as_string(hide_password=True)
+
+
+def cache_key(sql: str, params: dict = None, database: str = None) -> str:
+    payload = json.dumps([normalize_sql(sql), params or {}, database], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class QueryCache:
+    """Parquet result cache with freshness probes, LRU eviction and hit/miss counters."""
+
+    def __init__(self, engine=None, cache_dir: str = QUERY_CACHE_DIR, max_bytes: int = QUERY_CACHE_MAX_BYTES,
+                 max_age: int = QUERY_CACHE_MAX_AGE):
+        self._engine = engine
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = timedelta(seconds=max_age) if max_age else None
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.cache_dir / '_index.json'
+        self._lock_path = self.cache_dir / '_index.lock'
+        self._index: Dict[str, dict] = self._load_index()
+
+    @property
+    def engine(self):
+        return self._engine or get_backend()
+
+    def _load_index(self) -> Dict[str, dict]:
+        return json.loads(self._index_path.read_text()) if self._index_path.exists() else {}
+
+    @contextmanager
+    def _locked_index(self):
+        """Index as other processes left it, written back on exit; threads and processes take turns."""
+        with self._lock, open(self._lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._index = self._load_index()
+                yield self._index
+                self._save_index()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self) -> None:
+        tmp_path = self._index_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self._index))
+        tmp_path.replace(self._index_path)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.parquet'
+
+    def freshness(self, tables: Iterable[str], engine=None) -> Dict[str, list]:
+        """Cheap fingerprint per table; any change invalidates the entries that read it."""
+        engine = engine or self.engine
+        if engine.name == 'duckdb':
+            return engine.freshness(tables)
+        fingerprint = {}
+        with engine.connect() as conn:
+            is_postgres = conn.dialect.name == 'postgresql'
+            for table in tables:
+                quoted = '.'.join('"' + part.replace('"', '""') + '"' for part in table.split('.'))
+                if is_postgres:
+                    row = conn.execute(text(PG_TABLE_STATS), {'name': quoted}).first()
+                    probe = list(row) if row else [None]
+                else:
+                    probe = [conn.execute(text(f'SELECT COUNT(*) FROM {quoted}')).scalar()]
+                if table in DATE_COLUMNS:
+                    probe.append(conn.execute(text(f'SELECT MAX("{DATE_COLUMNS[table]}") FROM {quoted}')).scalar())
+                fingerprint[table] = [str(value) for value in probe]
+        return fingerprint
+
+    def read_sql(self, sql: str, params: dict = None, tables: Iterable[str] = None, engine=None,
+                 **read_kwargs) -> pd.DataFrame:
+        """
+        db_utils.read_sql through the cache.
+
+        :param sql: Query text, %(name)s placeholders for params.
+        :param params: Query parameters, part of the cache key.
+        :param tables: Tables to probe for freshness, parsed from the SQL when omitted.
+        :param engine: Database to read, the cache's engine by default; part of the cache key.
+        :param read_kwargs: Passed to db_utils.read_sql on a miss (e.g. parse_dates).
+        :return: Query result.
+        """
+        engine = engine or self.engine
+        key = cache_key(sql, params, engine_id(engine))
+        tables = sorted(tables) if tables is not None else query_tables(sql)
+        fingerprint = self.freshness(tables, engine)
+        with self._locked_index() as index:
+            entry = index.get(key)
+            expired = entry and self.max_age and datetime.now() - datetime.fromisoformat(entry['created']) > self.max_age
+            if entry and not expired and entry['freshness'] == fingerprint and self._entry_path(key).exists():
+                entry['last_access'] = datetime.now().isoformat()
+                self.stats['hits'] += 1
+                # read while holding the lock so another process cannot evict the file in between
+                return pd.read_parquet(self._entry_path(key))
+            self.stats['stale' if entry else 'misses'] += 1
+
+        df = read_sql(sql, engine, params=params, **read_kwargs)
+        self.put(key, df, sql=normalize_sql(sql), params=params, freshness=fingerprint)
+        # hand back the stored copy so hits and misses have identical dtypes
+        return pd.read_parquet(self._entry_path(key)) if key in self._index else df
+
+    def put(self, key: str, df: pd.DataFrame, **meta) -> None:
+        path = self._entry_path(key)
+        tmp_path = path.with_suffix('.tmp')
+        df.to_parquet(tmp_path, index=True)
+        tmp_path.replace(path)
+        now = datetime.now().isoformat()
+        with self._locked_index() as index:
+            index[key] = {**meta, 'params': json.loads(json.dumps(meta.get('params') or {}, default=str)),
+                          'bytes': path.stat().st_size, 'created': now, 'last_access': now}
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        total = sum(entry['bytes'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)['bytes']
+            self._entry_path(key).unlink(missing_ok=True)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, table: str = None) -> int:
+        """Drop every entry (or only those reading table); returns the number dropped."""
+        with self._locked_index() as index:
+            keys = [k for k, e in index.items() if table is None or table in e['freshness']]
+            for key in keys:
+                index.pop(key)
+                self._entry_path(key).unlink(missing_ok=True)
+        return len(keys)
+
+    def report(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['stale']
+        summary = {**self.stats, 'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                   'entries': len(self._index), 'bytes': sum(e['bytes'] for e in self._index.values())}
+        print(f"Query cache: {summary['hits']} hits, {summary['misses']} misses, {summary['stale']} stale, "
+              f"{summary['evictions']} evicted, {summary['entries']} entries / {summary['bytes'] / 1e6:.1f} MB")
+        return summary
+
+
+_default_cache = None
+
+
+def get_query_cache() -> QueryCache:
+    """Shared cache on the default engine, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = QueryCache()
+    return _default_cache
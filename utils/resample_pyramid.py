@@ -0,0 +1,183 @@
+"""
+Purpose: Daily, weekly, monthly and quarterly aggregates of an alt data time series, built once.
+
+A ResamplePyramid keeps a sum and a non-null count per column for every bucket between the first and
+last date at each level (D/W/M/Q), so any level's mean (or sum / count) is a division at read time and
+equals set_index(date).resample(freq).mean(), empty buckets included. Buckets are integer ordinals
+(date_utils keys, quarters = months // 3) over dense arrays, so a date range is an offset slice.
+append adds new days by touching only the buckets those days fall in; days that were already loaded
+are replaced, so re-pulling the last few days of a source is safe.
+"""
+
+import hashlib
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.date_utils import NAT_KEY, day_key, key_start
+
+PYRAMID_FREQS = ('D', 'W', 'M', 'Q')
+# pandas resample aliases (old and new spellings) -> pyramid level
+FREQ_ALIASES = {'D': 'D', 'W': 'W', 'W-SUN': 'W', 'M': 'M', 'ME': 'M', 'Q': 'Q', 'QE': 'Q', 'Q-DEC': 'Q', 'QE-DEC': 'Q'}
+
+
+def day_to_bucket(days: np.ndarray, freq: str) -> np.ndarray:
+    """Bucket ordinal at freq of each day ordinal."""
+    if freq == 'D':
+        return days
+    if freq == 'W':
+        return (days + 3) // 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    return months if freq == 'M' else months // 3
+
+
+def bucket_label(buckets: np.ndarray, freq: str) -> pd.DatetimeIndex:
+    """Timestamp pandas labels each bucket with: the day itself, or the last day of the week/month/quarter."""
+    buckets = np.asarray(buckets, dtype=np.int64)
+    if freq in ('D', 'W'):
+        # key_start + 6 is the Sunday that closes a Monday-start week, like resample('W') (W-SUN)
+        ends = key_start(buckets, freq) + (6 if freq == 'W' else 0)
+    else:
+        last_month = buckets if freq == 'M' else buckets * 3 + 2
+        ends = (last_month + 1).astype('datetime64[M]').astype('datetime64[D]') - 1
+    return pd.DatetimeIndex(ends.astype('datetime64[ns]'))
+
+
+class ResamplePyramid:
+    """Sum and count per column for every bucket of every level, dense between the first and last date."""
+
+    def __init__(self, columns: List[str], date_col: str = 'date', freqs: Iterable[str] = PYRAMID_FREQS):
+        self.columns = list(columns)
+        self.date_col = date_col
+        self.freqs = tuple(freqs)
+        self.date_dtype = np.dtype('datetime64[ns]')
+        # level -> (first bucket ordinal, sums (buckets, columns), counts (buckets, columns))
+        self.levels: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {
+            freq: (0, np.zeros((0, len(self.columns))), np.zeros((0, len(self.columns)))) for freq in self.freqs}
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, date_col: str = 'date', columns: Iterable[str] = None,
+              freqs: Iterable[str] = PYRAMID_FREQS) -> 'ResamplePyramid':
+        """
+        Aggregate a (daily) frame into every level.
+
+        :param df: Rows with a tz-naive datetime column; several rows per day are fine.
+        :param date_col: Datetime column.
+        :param columns: Numeric columns to aggregate, every other column by default.
+        :param freqs: Levels to keep.
+        :return: ResamplePyramid
+        """
+        if isinstance(df[date_col].dtype, pd.DatetimeTZDtype):
+            raise ValueError(f'{date_col} is tz-aware; buckets are tz-naive days, use tz_localize(None) or resample')
+        columns = [c for c in df.columns if c != date_col] if columns is None else list(columns)
+        pyramid = cls(columns, date_col=date_col, freqs=freqs)
+        if pd.api.types.is_datetime64_dtype(df[date_col]):
+            pyramid.date_dtype = df[date_col].dtype
+        pyramid.append(df)
+        return pyramid
+
+    def _daily(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per day sums and counts of df's rows, days ascending."""
+        days = day_key(df[self.date_col]).astype(np.int64)
+        keep = days != NAT_KEY
+        values = df.loc[keep, self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        idx, uniques = pd.factorize(days[keep], sort=True)
+        sums = np.zeros((len(uniques), len(self.columns)))
+        counts = np.zeros((len(uniques), len(self.columns)))
+        np.add.at(sums, idx, np.where(present, values, 0.0))
+        np.add.at(counts, idx, present)
+        return uniques, sums, counts
+
+    def _extend(self, freq: str, lo: int, hi: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        """Grow a level's arrays so buckets lo..hi exist."""
+        start, sums, counts = self.levels[freq]
+        if len(sums):
+            lo, hi = min(lo, start), max(hi, start + len(sums) - 1)
+        if not len(sums) or lo < start or hi >= start + len(sums):
+            grown = np.zeros((2, hi - lo + 1, len(self.columns)))
+            offset = start - lo
+            grown[0, offset:offset + len(sums)] = sums
+            grown[1, offset:offset + len(sums)] = counts
+            self.levels[freq] = (lo, grown[0], grown[1])
+        return self.levels[freq]
+
+    def append(self, df: pd.DataFrame) -> 'ResamplePyramid':
+        """Add new rows, updating only the buckets their days fall in. Days already present are replaced."""
+        days, sums, counts = self._daily(df)
+        if not len(days):
+            return self
+        # take out the current contribution of any day being reloaded before adding the new one
+        if 'D' in self.levels:
+            start, day_sums, day_counts = self.levels['D']
+            loaded = (days >= start) & (days < start + len(day_sums))
+            previous = days[loaded] - start
+            delta_sums, delta_counts = sums.copy(), counts.copy()
+            delta_sums[loaded] -= day_sums[previous]
+            delta_counts[loaded] -= day_counts[previous]
+        else:
+            delta_sums, delta_counts = sums, counts
+
+        for freq in self.freqs:
+            buckets = day_to_bucket(days, freq)
+            start, level_sums, level_counts = self._extend(freq, int(buckets[0]), int(buckets[-1]))
+            idx = buckets - start
+            np.add.at(level_sums, idx, delta_sums)
+            np.add.at(level_counts, idx, delta_counts)
+        return self
+
+    def buckets(self, freq: str, start=None, end=None) -> slice:
+        """Array slice of a level covering the buckets that contain start .. end (inclusive)."""
+        first, sums, _ = self.levels[freq]
+        lo = 0 if start is None else int(day_to_bucket(day_key([start]).astype(np.int64), freq)[0]) - first
+        hi = len(sums) if end is None else int(day_to_bucket(day_key([end]).astype(np.int64), freq)[0]) - first + 1
+        return slice(max(lo, 0), max(min(hi, len(sums)), 0))
+
+    def aggregate(self, freq: str, agg: str = 'mean', start=None, end=None) -> pd.DataFrame:
+        """
+        One level as a frame, like set_index(date_col).resample(freq).agg().reset_index().
+
+        :param freq: 'D', 'W', 'M', 'Q' or a pandas alias of those ('ME', 'QE', 'W-SUN', ...).
+        :param agg: 'mean', 'sum' or 'count'.
+        :param start: First date to include (its whole bucket is returned).
+        :param end: Last date to include.
+        :return: date_col plus one column per aggregated column; mean is NaN for empty buckets.
+        """
+        freq = FREQ_ALIASES[freq]
+        first, sums, counts = self.levels[freq]
+        rows = self.buckets(freq, start, end)
+        sums, counts = sums[rows], counts[rows]
+        if agg == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.where(counts > 0, sums / counts, np.nan)
+        elif agg == 'sum':
+            values = sums
+        elif agg == 'count':
+            values = counts.astype(np.int64)
+        else:
+            raise ValueError(f'Unknown aggregate {agg}')
+        labels = bucket_label(np.arange(rows.start, rows.stop) + first, freq)
+        frame = pd.DataFrame(values, columns=self.columns)
+        frame.insert(0, self.date_col, labels.astype(self.date_dtype))
+        return frame
+
+
+_pyramids: Dict[str, ResamplePyramid] = {}
+MAX_CACHED_PYRAMIDS = 8
+
+
+def frame_key(df: pd.DataFrame, date_col: str) -> str:
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(repr((date_col, list(df.columns))).encode())
+    return digest.hexdigest()
+
+
+def get_pyramid(df: pd.DataFrame, date_col: str = 'date') -> ResamplePyramid:
+    """Pyramid of a frame, built on first request and reused while the frame's contents are unchanged."""
+    key = frame_key(df, date_col)
+    if key not in _pyramids:
+        if len(_pyramids) >= MAX_CACHED_PYRAMIDS:
+            _pyramids.pop(next(iter(_pyramids)))
+        _pyramids[key] = ResamplePyramid.build(df, date_col=date_col)
+    return _pyramids[key]
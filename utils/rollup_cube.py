@@ -0,0 +1,188 @@
+"""
+Purpose: One-pass multi-resolution rollups of the alt data sources.
+
+A RollupCube holds counts and sums per occupied (period, geography) cell. It is built from the raw rows
+with a single np.bincount over combined integer keys at the finest requested resolution, and every
+coarser period (day -> week/month -> year) or geography (tract -> tract group / borough) is derived from
+those cells through lookup arrays, without rescanning the rows. Means are sum / count at read time.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.date_utils import NAT_KEY, period_key
+
+GEO_LEVELS = ('tract', 'tract_1000_grp', 'borough')
+PERIOD_LEVELS = ('D', 'W', 'M', 'Y')
+PERIOD_COLUMNS = {'D': 'day_key', 'W': 'week_key', 'M': 'month_key', 'Y': 'year'}
+TRACT_RADIX = 1_000_000   # tract level geo code = borough * TRACT_RADIX + 6 digit tract
+DENSE_LIMIT = 2 ** 26     # largest combined key range reduced with a dense bincount
+
+# tract -> tract_1000_grp, same buckets as pd.cut(tract, bins=range(0, 303000, 10000), right=True) + 1
+TRACT_GROUP_LOOKUP = np.full(TRACT_RADIX, -1, dtype=np.int16)
+TRACT_GROUP_LOOKUP[1:300001] = np.arange(300000) // 10000 + 1
+
+# county FIPS -> borough code (same codes as the rolling sales BOROUGH column), 0 = unknown
+BOROUGH_BY_COUNTY = np.zeros(1000, dtype=np.int8)
+BOROUGH_BY_COUNTY[[61, 5, 47, 81, 85]] = [1, 2, 3, 4, 5]
+BOROUGH_NAMES = {0: 'Unknown', 1: 'Manhattan', 2: 'Bronx', 3: 'Brooklyn', 4: 'Queens', 5: 'Staten Island'}
+
+
+def tract_group(tracts) -> np.ndarray:
+    """tract_1000_grp of each tract, -1 where missing or out of range."""
+    tracts = np.ceil(np.asarray(tracts, dtype=np.float64))
+    valid = np.isfinite(tracts) & (tracts > 0) & (tracts < TRACT_RADIX)
+    groups = np.full(len(tracts), -1, dtype=np.int16)
+    groups[valid] = TRACT_GROUP_LOOKUP[tracts[valid].astype(np.int64)]
+    return groups
+
+
+def borough_code(counties) -> np.ndarray:
+    """Borough code from county FIPS (061) or any GEOID starting with state + county (36061...)."""
+    codes, uniques = pd.factorize(pd.Series(counties), use_na_sentinel=True)
+    values = pd.Series(uniques).astype('string').str.strip()
+    county = values.where(values.str.len() <= 3, values.str[2:5])
+    county = pd.to_numeric(county, errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    boroughs = np.append(BOROUGH_BY_COUNTY[np.clip(county, 0, 999)], 0).astype(np.int8)
+    return boroughs[codes]
+
+
+def _roll_period(keys: np.ndarray, source: str, target: str) -> np.ndarray:
+    if source == target:
+        return keys
+    if source == 'D' and target == 'W':
+        return (keys + 3) // 7
+    if source == 'D' and target == 'M':
+        return keys.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if source == 'D' and target == 'Y':
+        return keys.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+    if source == 'M' and target == 'Y':
+        return keys // 12 + 1970
+    raise ValueError(f'Cannot roll {source} periods up to {target}')
+
+
+def _roll_geo(codes: np.ndarray, source: str, target: str) -> np.ndarray:
+    if source == target:
+        return codes
+    if source == 'tract' and target == 'tract_1000_grp':
+        return TRACT_GROUP_LOOKUP[codes % TRACT_RADIX].astype(np.int64)
+    if source == 'tract' and target == 'borough':
+        return codes // TRACT_RADIX
+    raise ValueError(f'Cannot roll {source} geography up to {target}')
+
+
+def _reduce(periods: np.ndarray, geos: np.ndarray, measures: Dict[str, np.ndarray]) -> Tuple:
+    """Sum every measure per (period, geo) cell with one bincount per measure over the combined key."""
+    if len(periods) == 0:
+        return periods, geos, {name: values[:0] for name, values in measures.items()}
+    geo_idx, geo_codes = pd.factorize(geos, sort=True)
+    period_min = periods.min()
+    combined = (periods - period_min) * len(geo_codes) + geo_idx
+    size = int(combined.max()) + 1
+    if size <= DENSE_LIMIT:
+        cells, idx = None, combined
+    else:
+        idx, cells = pd.factorize(combined, sort=True)
+        size = len(cells)
+    sums = {name: np.bincount(idx, weights=values, minlength=size) for name, values in measures.items()}
+    occupied = np.flatnonzero(sums['rows']) if cells is None else np.arange(size)
+    keys = occupied if cells is None else cells
+    return (keys // len(geo_codes) + period_min, geo_codes[keys % len(geo_codes)],
+            {name: values[occupied] for name, values in sums.items()})
+
+
+class RollupCube:
+    """Counts and sums per occupied (period, geography) cell at one resolution."""
+
+    def __init__(self, freq: str, geo: str, periods: np.ndarray, geos: np.ndarray, measures: Dict[str, np.ndarray]):
+        self.freq = freq
+        self.geo = geo
+        self.periods = periods
+        self.geos = geos
+        self.measures = measures
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, value_cols: Iterable[str] = (), freq: str = 'M', date_col: str = 'date',
+              tract_col: str = 'tract', county_col: str = None) -> 'RollupCube':
+        """
+        Aggregate raw rows into a tract level cube in a single pass.
+
+        :param df: Rows with a parsed date column and a census tract column.
+        :param value_cols: Numeric columns to keep sums and non-null counts of.
+        :param freq: Finest period to keep, one of PERIOD_LEVELS.
+        :param date_col: Datetime column.
+        :param tract_col: 6 digit census tract column.
+        :param county_col: County FIPS or GEOID column; without it every row lands in borough 0 (unknown).
+        :return: RollupCube at (freq, 'tract').
+        """
+        dates = df[date_col]
+        periods = dates.dt.year.to_numpy(dtype=np.float64) if freq == 'Y' else period_key(dates, freq)
+        # rounded up like tract_group, so a fractional tract's code and group agree
+        tracts = np.ceil(df[tract_col].to_numpy(dtype=np.float64))
+        keep = np.isfinite(tracts) & (tracts >= 0) & (tracts < TRACT_RADIX) & dates.notna().to_numpy()
+        if freq != 'Y':
+            keep &= periods != NAT_KEY
+        boroughs = borough_code(df[county_col]) if county_col else np.zeros(len(df), dtype=np.int8)
+        geos = boroughs[keep].astype(np.int64) * TRACT_RADIX + tracts[keep].astype(np.int64)
+
+        measures = {'rows': np.ones(keep.sum())}
+        for col in value_cols:
+            values = df[col].to_numpy(dtype=np.float64)[keep]
+            present = ~np.isnan(values)
+            measures[f'{col}:sum'] = np.where(present, values, 0.0)
+            measures[f'{col}:count'] = present.astype(np.float64)
+        periods, geos, measures = _reduce(periods[keep].astype(np.int64), geos, measures)
+        return cls(freq, 'tract', periods, geos, measures)
+
+    def rollup(self, freq: str = None, geo: str = None) -> 'RollupCube':
+        """Derive a coarser cube from this one's cells."""
+        freq, geo = freq or self.freq, geo or self.geo
+        periods = _roll_period(self.periods, self.freq, freq)
+        geos = _roll_geo(self.geos, self.geo, geo)
+        keep = geos >= 0
+        periods, geos, measures = _reduce(periods[keep], geos[keep],
+                                          {name: values[keep] for name, values in self.measures.items()})
+        return RollupCube(freq, geo, periods, geos, measures)
+
+    def geo_columns(self) -> Dict[str, np.ndarray]:
+        if self.geo == 'tract':
+            return {'borough': self.geos // TRACT_RADIX, 'tract': self.geos % TRACT_RADIX}
+        return {self.geo: self.geos}
+
+    def frame(self, agg: Dict[str, str] = None) -> pd.DataFrame:
+        """
+        Cube cells as a DataFrame, one row per (period, geography).
+
+        :param agg: pandas style {column: 'count' | 'sum' | 'mean' | 'size'}; counting the tract column
+            gives the row count. Defaults to the row count in a 'rows' column.
+        :return: DataFrame with the period key column, the geography column(s) and one column per agg entry.
+        """
+        out = pd.DataFrame({PERIOD_COLUMNS[self.freq]: self.periods, **self.geo_columns()})
+        for col, func in (agg or {'rows': 'size'}).items():
+            if col in out.columns:
+                raise ValueError(f'{col} is already a key column of the {self.geo} cube')
+            if func == 'size' or (func == 'count' and f'{col}:count' not in self.measures):
+                values = self.measures['rows']
+            elif func == 'count':
+                values = self.measures[f'{col}:count']
+            elif func == 'sum':
+                values = self.measures[f'{col}:sum']
+            elif func == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = self.measures[f'{col}:sum'] / self.measures[f'{col}:count']
+            else:
+                raise ValueError(f'Unsupported aggregation {func} for {col}')
+            out[col] = values.astype(np.int64) if func in ('count', 'size') else values
+        return out
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, freq=self.freq, geo=self.geo, periods=self.periods, geos=self.geos,
+                            **{f'measure:{name}': values for name, values in self.measures.items()})
+
+    @classmethod
+    def load(cls, path: str) -> 'RollupCube':
+        with np.load(path) as data:
+            measures = {key.split(':', 1)[1]: data[key] for key in data.files if key.startswith('measure:')}
+            return cls(str(data['freq']), str(data['geo']), data['periods'], data['geos'], measures)
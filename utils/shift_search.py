@@ -0,0 +1,173 @@
+"""
+Purpose: Lag-shift search for the alt data features of the monthly sales model (optimize_shifts).
+
+The exhaustive version copied the frame, shifted, dropped NaNs and refit an XGBRegressor for each of the
+7^4 shift combinations. Here every candidate shift of every searched feature is computed once into a lag
+matrix, a candidate's design is a column gather from it, and its train/test DMatrix pair is built once and
+kept, so later evaluations of the same candidate (another sweep, the next halving rung) reuse it. The
+search itself is coordinate descent (one feature at a time, all of its shifts evaluated together) or
+successive halving over the full grid with boosting rounds as the budget, each rung continuing the
+previous rung's boosters. Candidates are scored on a thread pool: xgboost releases the GIL and DMatrix
+objects do not cross process boundaries.
+"""
+
+import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+# time_series_utils.train_model's XGBRegressor in native form; one thread per model, candidates run in parallel
+XGB_PARAMS = {'objective': 'reg:squarederror', 'eta': 0.1, 'max_depth': 5, 'nthread': 1}
+NUM_BOOST_ROUND = 100
+SHIFT_VALUES = range(1, 8)
+
+
+def lag_matrix(df: pd.DataFrame, cols: Iterable[str], shift_values: Iterable[int]) -> np.ndarray:
+    """(rows, len(cols), len(shift_values)): df[col].shift(s) for every searched column and shift."""
+    shift_values = list(shift_values)
+    values = df[list(cols)].to_numpy(dtype=np.float64)
+    lags = np.full(values.shape + (len(shift_values),), np.nan)
+    for i, s in enumerate(shift_values):
+        if s >= 0:
+            lags[s:, :, i] = values[:len(values) - s]
+        else:
+            lags[:s, :, i] = values[-s:]
+    return lags
+
+
+class ShiftSearch:
+    """Finds the shift per feature that minimizes the test MAE of the avg_sales model."""
+
+    def __init__(self, df: pd.DataFrame, cols: List[str], target: str = 'avg_sales', drop: Iterable[str] = ('sales_count',),
+                 shift_values: Iterable[int] = SHIFT_VALUES, fixed: Dict[str, int] = None, test_size: float = 0.2,
+                 random_state: int = 42, params: dict = None, num_boost_round: int = NUM_BOOST_ROUND,
+                 max_workers: int = None):
+        """
+        :param df: Monthly frame with the target, the features to shift and any others.
+        :param cols: Features to search a shift for.
+        :param target: Column the model predicts.
+        :param drop: Columns that only take part in the NaN filter (like the dropna before dropping them).
+        :param shift_values: Candidate shifts per feature.
+        :param fixed: Features shifted by a constant instead of searched.
+        :param test_size: Held out share, same random split as train_model.
+        :param random_state: Split seed.
+        :param params: xgboost training parameters, XGB_PARAMS by default.
+        :param num_boost_round: Trees per fully trained candidate.
+        :param max_workers: Thread pool size.
+        """
+        self.cols = list(cols)
+        self.fixed = fixed or {}
+        self.shift_values = list(shift_values)
+        self.test_size = test_size
+        self.random_state = random_state
+        self.params = params or XGB_PARAMS
+        self.num_boost_round = num_boost_round
+        self.max_workers = max_workers or os.cpu_count()
+
+        drop = [c for c in drop if c in df.columns]
+        self.features = [c for c in df.columns if c != target and c not in drop]
+        self.y = df[target].to_numpy(dtype=np.float64)
+        # rows the unshifted columns already rule out
+        self.base_valid = df[[target, *drop]].notna().all(axis=1).to_numpy()
+        self.lags = lag_matrix(df, self.cols, self.shift_values)
+        static = [c for c in self.features if c not in self.cols]
+        self.static = {c: df[c].shift(self.fixed[c]) if c in self.fixed else df[c] for c in static}
+        self._dmatrices: Dict[Tuple[int, ...], tuple] = {}
+        self.scores: Dict[Tuple[int, ...], float] = {}
+        self.evaluations = 0
+
+    def design(self, combo: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        """Features in frame order for one shift per searched column, and the rows without a missing value."""
+        searched = {c: self.lags[:, i, self.shift_values.index(s)] for i, (c, s) in enumerate(zip(self.cols, combo))}
+        X = np.column_stack([searched[c] if c in searched else self.static[c].to_numpy(dtype=np.float64)
+                             for c in self.features])
+        return X, self.base_valid & ~np.isnan(X).any(axis=1)
+
+    def dmatrices(self, combo: Tuple[int, ...]) -> tuple:
+        if combo not in self._dmatrices:
+            X, valid = self.design(combo)
+            X, y = X[valid], self.y[valid]
+            train, test = train_test_split(np.arange(len(y)), test_size=self.test_size, random_state=self.random_state)
+            self._dmatrices[combo] = (xgb.DMatrix(X[train], label=y[train], feature_names=self.features),
+                                      xgb.DMatrix(X[test], feature_names=self.features), y[test])
+        return self._dmatrices[combo]
+
+    def fit(self, combo: Tuple[int, ...], rounds: int = None, booster: xgb.Booster = None) -> Tuple[float, xgb.Booster]:
+        """Test MAE after training rounds more trees, continuing booster when given."""
+        dtrain, dtest, y_test = self.dmatrices(combo)
+        booster = xgb.train(self.params, dtrain, num_boost_round=rounds or self.num_boost_round, xgb_model=booster)
+        return float(np.mean(np.abs(y_test - booster.predict(dtest)))), booster
+
+    def score(self, combos: List[Tuple[int, ...]]) -> Dict[Tuple[int, ...], float]:
+        """Fully trained test MAE per combination, in parallel, each combination fit once."""
+        pending = [c for c in dict.fromkeys(combos) if c not in self.scores]
+        # DMatrix construction is not worth a thread; build them first so the pool only trains
+        for combo in pending:
+            self.dmatrices(combo)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for combo, (mae, _) in zip(pending, executor.map(self.fit, pending)):
+                self.scores[combo] = mae
+        self.evaluations += len(pending)
+        return {c: self.scores[c] for c in combos}
+
+    def coordinate_descent(self, start: Tuple[int, ...] = None, max_sweeps: int = 5) -> Tuple[Tuple[int, ...], float]:
+        """Improve one column's shift at a time, all of its candidate shifts scored together, until a sweep changes nothing."""
+        best = start or tuple(self.shift_values[0] for _ in self.cols)
+        best_mae = self.score([best])[best]
+        for sweep in range(max_sweeps):
+            improved = False
+            for i in range(len(self.cols)):
+                candidates = [best[:i] + (s,) + best[i + 1:] for s in self.shift_values]
+                combo, mae = min(self.score(candidates).items(), key=lambda item: item[1])
+                if mae < best_mae:
+                    best, best_mae, improved = combo, mae, True
+            print(f'Sweep {sweep + 1}: best shift {dict(zip(self.cols, best))}, MAE {best_mae:.3f} '
+                  f'({self.evaluations} models)')
+            if not improved:
+                break
+        return best, best_mae
+
+    def successive_halving(self, eta: int = 3, min_rounds: int = 4) -> Tuple[Tuple[int, ...], float]:
+        """Every combination gets min_rounds trees; the best 1/eta continue training, eta times more trees per rung."""
+        candidates = list(itertools.product(self.shift_values, repeat=len(self.cols)))
+        boosters, trained, rounds = {}, 0, min_rounds
+        while True:
+            rounds = min(rounds, self.num_boost_round)
+            for combo in candidates:
+                self.dmatrices(combo)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(lambda c: self.fit(c, rounds - trained, boosters.get(c)), candidates))
+            self.evaluations += len(candidates)
+            scores = {c: mae for c, (mae, _) in zip(candidates, results)}
+            boosters = {c: booster for c, (_, booster) in zip(candidates, results)}
+            print(f'{len(candidates)} candidates at {rounds} trees, best MAE {min(scores.values()):.3f}')
+            if rounds == self.num_boost_round or len(candidates) == 1:
+                break
+            trained = rounds
+            candidates = sorted(candidates, key=scores.get)[:max(1, len(candidates) // eta)]
+            # drop the DMatrices of eliminated candidates
+            self._dmatrices = {c: self._dmatrices[c] for c in candidates}
+            rounds *= eta
+        best = min(candidates, key=scores.get)
+        return best, scores[best]
+
+    def search(self, strategy: str = 'coordinate', **kwargs) -> Tuple[Dict[str, int], float]:
+        """
+        Best shift per column.
+
+        :param strategy: 'coordinate' (coordinate descent) or 'halving' (successive halving over the grid).
+        :param kwargs: Passed to the strategy.
+        :return: {column: shift} including the fixed columns, and its test MAE.
+        """
+        if strategy == 'coordinate':
+            best, mae = self.coordinate_descent(**kwargs)
+        elif strategy == 'halving':
+            best, mae = self.successive_halving(**kwargs)
+        else:
+            raise ValueError(f'Unknown search strategy {strategy}')
+        return {**dict(zip(self.cols, best)), **self.fixed}, mae
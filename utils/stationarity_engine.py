@@ -0,0 +1,124 @@
+"""
+Purpose: Stationarity engine: decides how many times each column has to be differenced to pass an ADF test.
+
+Replaces the per-column while loop of make_columns_stationary. Columns are tested in parallel, differencing
+stops at max_order, and adfuller runs with a short fixed lag count (the "short" Schwert rule) instead of an AIC search over every
+lag; the long rule leaves the test with almost no power on the 40-100 point monthly and weekly series used here. The
+order decided for a series is memoized by a hash of its values (and the test settings), so repeated
+preprocess_df calls on the same data skip the tests entirely. A fitted engine keeps the order per column,
+and transform applies those orders to new data without testing again.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.stattools import adfuller
+
+ADF_ALPHA = 0.05
+MAX_DIFF_ORDER = 2
+# differenced before testing, whatever the test decides (cumulative ride counts)
+PRE_DIFFERENCED = {'citibike_rides': 1}
+
+
+def adf_lags(nobs: int) -> int:
+    """Short Schwert rule, floor(4 * (n / 100) ** 0.25)."""
+    return int(np.floor(4 * (nobs / 100) ** 0.25))
+
+
+def is_stationary(values: np.ndarray, alpha: float = ADF_ALPHA, lags: int = None) -> bool:
+    values = values[~np.isnan(values)]
+    lags = adf_lags(len(values)) if lags is None else lags
+    # keep the regression identified on short series
+    lags = max(min(lags, len(values) // 2 - 2), 0)
+    return adfuller(values, maxlag=lags, autolag=None)[1] < alpha
+
+
+def differencing_order(values: np.ndarray, max_order: int = MAX_DIFF_ORDER, alpha: float = ADF_ALPHA,
+                       lags: int = None) -> int:
+    """Smallest number of differences (at most max_order) after which the ADF test rejects a unit root."""
+    for order in range(max_order):
+        if is_stationary(values, alpha, lags):
+            return order
+        values = np.diff(values)  # NaN gaps stay gaps, like Series.diff
+    return max_order
+
+
+def difference(series: pd.Series, order: int) -> pd.Series:
+    for _ in range(order):
+        series = series.diff()
+    return series
+
+
+_order_cache: Dict[str, int] = {}
+
+
+def series_key(values: np.ndarray, *args) -> str:
+    digest = hashlib.sha256(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    digest.update(repr(args).encode())
+    return digest.hexdigest()
+
+
+class StationarityEngine:
+    """Learns a differencing order per column (fit) and applies it to any frame with those columns (transform)."""
+
+    def __init__(self, max_order: int = MAX_DIFF_ORDER, alpha: float = ADF_ALPHA, lags: int = None,
+                 pre_differenced: Dict[str, int] = None, max_workers: int = None):
+        self.max_order = max_order
+        self.alpha = alpha
+        self.lags = lags
+        self.pre_differenced = PRE_DIFFERENCED if pre_differenced is None else pre_differenced
+        self.max_workers = max_workers
+        self.orders: Dict[str, int] = {}  # column -> total differences applied, pre-differencing included
+
+    def _pre_difference(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        for col, order in self.pre_differenced.items():
+            if col in df.columns:
+                df[col] = difference(df[col], order)
+        return df
+
+    def fit(self, df: pd.DataFrame, date_col: str = 'date', verbose: bool = False) -> 'StationarityEngine':
+        """
+        Decide the differencing order of every column but date_col.
+
+        :param df: Frame to learn from.
+        :param date_col: Column left untouched.
+        :param verbose: Print the columns that needed differencing.
+        :return: self
+        """
+        df = self._pre_difference(df)
+        series = {col: df[col].to_numpy(dtype=np.float64) for col in df.columns if col != date_col}
+        keys = {col: series_key(values, self.max_order, self.alpha, self.lags) for col, values in series.items()}
+        pending = [col for col in series if keys[col] not in _order_cache]
+
+        args = ([series[col] for col in pending], [self.max_order] * len(pending), [self.alpha] * len(pending),
+                [self.lags] * len(pending))
+        if self.max_workers == 1 or len(pending) < 2:
+            orders = list(map(differencing_order, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers or os.cpu_count()) as executor:
+                orders = list(executor.map(differencing_order, *args))
+        _order_cache.update(zip((keys[col] for col in pending), orders))
+
+        self.orders = {}
+        for col in series:
+            order = _order_cache[keys[col]]
+            if verbose and order:
+                print(f'{col} is not stationary, requires order {order} differencing')
+            self.orders[col] = order + self.pre_differenced.get(col, 0)
+        return self
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Difference each fitted column by its learned order; other columns pass through."""
+        df = df.copy()
+        for col, order in self.orders.items():
+            if col in df.columns:
+                df[col] = difference(df[col], order)
+        return df
+
+    def fit_transform(self, df: pd.DataFrame, date_col: str = 'date', verbose: bool = False) -> pd.DataFrame:
+        return self.fit(df, date_col=date_col, verbose=verbose).transform(df)
@@ -2,7 +2,6 @@
 Purpose: Custom models and utility functions for ts analysis and preprocessing
 """
 
-import itertools
 import numpy as np
 import pandas as pd
 import xgboost as xgb
@@ -12,9 +11,13 @@ import matplotlib.pyplot as plt
 from typing import Dict, List, Tuple, Union
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.model_selection import train_test_split
-from statsmodels.tsa.stattools import adfuller, grangercausalitytests
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 
+from utils.granger_engine import granger_pvalues, sliding_granger_pvalues
+from utils.resample_pyramid import FREQ_ALIASES, get_pyramid
+from utils.shift_search import ShiftSearch
+from utils.stationarity_engine import MAX_DIFF_ORDER, StationarityEngine
+
 
 
 def set_range_nan(df: pd.DataFrame, start: str, end: str, col: str) -> None:
@@ -40,20 +43,26 @@ def normalize_df(df: pd.DataFrame, start_date: str = '2018-01', date_col: str =
     df_norm = (df_norm - df_norm.mean()) / df_norm.std()
     return df_norm.reset_index()
 
-def preprocess_df(df: pd.DataFrame, start_date: str = '2016-01', RESAMPLE_FREQ: str = None, verbose: bool = True) -> pd.DataFrame:
+def preprocess_df(df: pd.DataFrame, start_date: str = '2016-01', RESAMPLE_FREQ: str = None, verbose: bool = True,
+                  stationarity: StationarityEngine = None) -> pd.DataFrame:
+    """stationarity: an already fitted engine whose differencing orders are applied instead of retesting"""
     df = nullify_ranges_with_variability(df)
     if RESAMPLE_FREQ:
         df = resample_ts(df, freq=RESAMPLE_FREQ)
-    df = make_columns_stationary(df, verbose=False)
+    df = stationarity.transform(df) if stationarity is not None else make_columns_stationary(df, verbose=False)
     df = normalize_df(df, start_date=start_date, date_col='date')
     if verbose: 
         print(df.head(2))
     return df
 
 def upsample_ts(df: pd.DataFrame, freq: str = 'D', date_col: str = 'date') -> pd.DataFrame:
-    return df.set_index(date_col).resample(freq).mean().reset_index()
+    return resample_ts(df, freq=freq, date_col=date_col)
 
 def resample_ts(df: pd.DataFrame, freq: str = 'D', date_col: str = 'date') -> pd.DataFrame:
+    """Mean per freq bucket; D/W/M/Q of tz-naive numeric frames come from the frame's cached ResamplePyramid"""
+    if (freq in FREQ_ALIASES and not isinstance(df[date_col].dtype, pd.DatetimeTZDtype)
+            and df.drop(columns=date_col).dtypes.map(pd.api.types.is_numeric_dtype).all()):
+        return get_pyramid(df, date_col=date_col).aggregate(freq)
     return df.set_index(date_col).resample(freq).mean().reset_index()
 
 def plotall(data: pd.DataFrame, date_col: str = 'date', verbose: bool = True, **kwargs):
@@ -74,62 +83,23 @@ def plotall(data: pd.DataFrame, date_col: str = 'date', verbose: bool = True, **
     fig.show()
     return fig if verbose else None
 
-def make_columns_stationary(df: pd.DataFrame, verbose: bool = True) -> pd.DataFrame:
-    df = df.copy()
-    if 'citibike_rides' in df.columns:
-        df['citibike_rides'] = df['citibike_rides'].diff()
-    stationary_df = df.copy()
-    for column in df.columns:
-        if column != 'date':
-            series = df[column]
-            is_stationary = adfuller(series.dropna(inplace=False))[1] < 0.05
-
-            if not is_stationary:
-                if verbose:
-                    print(f'{column} is not stationary')
-                order = 1
-                while not is_stationary:
-                    if verbose:
-                        print(f'{column} requires order {order} differencing')
-                    series = series.diff()
-                    is_stationary = adfuller(series.dropna(inplace=False))[1] < 0.05
-                    order += 1
-                
-            stationary_df[column] = series
-
-    return stationary_df
+def make_columns_stationary(df: pd.DataFrame, verbose: bool = True, max_order: int = MAX_DIFF_ORDER, max_workers: int = None) -> pd.DataFrame:
+    """
+    Difference every column until it passes an ADF test (at most max_order times, see stationarity_engine).
+
+    Unlike the old per column adfuller loop, the ADF test uses a short fixed lag (floor(4 * (n / 100) ** 0.25))
+    instead of an AIC lag search, and differencing stops at max_order (2 by default), so some columns get a
+    different order.
+    """
+    return StationarityEngine(max_order=max_order, max_workers=max_workers).fit_transform(df, verbose=verbose)
 
 def granger_causality_test(data: pd.DataFrame, max_lag: int, target_col: str = 'avg_price', 
                            date_col: str = 'date', agg_lags: int = 1, 
                            alpha: float = 0.05,
                            verbose: bool = True, return_df: bool = False, debug: bool = False, **kwargs) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
-    """Perform Granger causality test"""
-    columns = [col for col in list(data.columns) if col != date_col]
-    results = {}
-    
-    for col in [col for col in columns if col != target_col]:
-        df_temp = data[[col, target_col]].dropna()
-        df_temp = df_temp.groupby(np.arange(len(df_temp))//agg_lags).mean()
-        
-        try:
-            granger_test = grangercausalitytests(df_temp, maxlag=max_lag+1, verbose=False)
-        except Exception as e:
-            if debug:
-                print(f'Error with {col}, {e}')
-            columns.remove(col)
-            continue
-        
-        results[col] = [granger_test[i][0]['ssr_ftest'][1] for i in range(1, max_lag+1)]
-    
-    causality_results = pd.DataFrame.from_dict(results, orient='index', columns=[f'Lag {i*agg_lags}' for i in range(1, max_lag+1)])
-    if debug:
-        a = set(causality_results.index)
-        b = set(columns)
-        print((a - b).union(b - a))
-        print(causality_results.index)
-        print(columns)
-    columns.remove(target_col)
-    causality_results.index = columns
+    """Perform Granger causality test (ssr F-test p-values, computed in utils/granger_engine.py)"""
+    causality_results = granger_pvalues(data, max_lag, target_col=target_col, date_col=date_col,
+                                        agg_lags=agg_lags, debug=debug)
     causality_results = causality_results.round(6)
     
     if verbose:
@@ -137,29 +107,19 @@ def granger_causality_test(data: pd.DataFrame, max_lag: int, target_col: str = '
     
     return causality_results_style, causality_results if return_df else causality_results_style
 
-def process_sliding_window(df: pd.DataFrame, RESAMPLE_FREQ: str, START_DATE: str, MAX_LAG: int, verbose: bool = True) -> Tuple[pd.DataFrame, Tuple[Dict[str, pd.Timestamp], pd.DataFrame]]:
-    """Process sliding window analysis using Granger causality test"""
+def process_sliding_window(df: pd.DataFrame, RESAMPLE_FREQ: str, START_DATE: str, MAX_LAG: int, verbose: bool = True,
+                           max_workers: int = None) -> Tuple[pd.DataFrame, Tuple[Dict[str, pd.Timestamp], pd.DataFrame]]:
+    """Process sliding window analysis using Granger causality test (every start date in one scan, see granger_engine)"""
     df_resampled = preprocess_df(df.copy(), start_date=START_DATE, RESAMPLE_FREQ=RESAMPLE_FREQ, verbose=False)
     
-    raw_sliding_window_results = []
-    sliding_window_results_above_95 = []
-    optimal_start_time_per_feature = {}
-    optimal_results = []
-    
-    for time_step in df_resampled['date']:
-        df_temp = df_resampled[df_resampled['date'] >= time_step]
-        
-        granger_results = granger_causality_test(df_temp, max_lag=MAX_LAG, target_col='avg_price', verbose=True, return_df=True)
+    window_results = sliding_granger_pvalues(df_resampled, MAX_LAG, target_col='avg_price',
+                                             max_workers=max_workers, progress=verbose).round(6)
+    features = window_results.index.unique('feature')
+    raw_sliding_window_results = window_results.iloc[:,:MAX_LAG].mean(axis=1).unstack('feature')[features]
+    raw_sliding_window_results = raw_sliding_window_results.dropna(axis=1, how='all')
         
-        raw_sliding_window_results.append(granger_results[1].iloc[:,:MAX_LAG].mean(axis=1).to_dict())
-        sliding_window_results_above_95.append((granger_results[1].iloc[:,:MAX_LAG] < 0.05).sum(axis=1).to_dict())
-        
-    optimal_start_time_per_feature = pd.DataFrame(raw_sliding_window_results, index=df_resampled['date']).idxmin(axis=0, skipna=True).to_dict()
-        
-    for feature, start_time in optimal_start_time_per_feature.items():
-        df_temp = df_resampled[df_resampled['date'] >= start_time]
-        granger_results = granger_causality_test(df_temp, max_lag=MAX_LAG, target_col='avg_price', verbose=True, return_df=True)
-        optimal_results.append(granger_results[1].loc[feature])
+    optimal_start_time_per_feature = raw_sliding_window_results.idxmin(axis=0, skipna=True).to_dict()
+    optimal_results = [window_results.loc[(start_time, feature)] for feature, start_time in optimal_start_time_per_feature.items()]
     
     df_optimal_results = pd.DataFrame(optimal_results, index=optimal_start_time_per_feature.keys())
     
@@ -174,30 +134,19 @@ def process_sliding_window(df: pd.DataFrame, RESAMPLE_FREQ: str, START_DATE: str
     return df_resampled, (optimal_start_time_per_feature, df_optimal_results)
 
 
-def optimize_shifts(df, shifts, train_model, evaluate):
-    cols = ["target_ci", "target_citi", "target_op", "target_ev", "target_hi"]
-    best_mae = np.inf
-    best_shift = None
-    shift_values = range(1, 8)
-    all_shifts = list(itertools.product(shift_values, repeat=4))
-    for shift in all_shifts:
-        shift = list(shift)
-        shift.append(1)
-        shifts = dict(zip(shifts.keys(), shift))
-        data = df.copy()
-        for col, shift in shifts.items():
-            data[col] = data[col].shift(shift)
-        data = data.dropna()
-        data = data.drop(columns=["sales_count"])
-        X_test, y_test, y_pred, model = train_model(data)
-        mse, mae, r2 = evaluate_model(y_test, y_pred)
-
-        if mae < best_mae:
-
-            best_mae = mae
-            best_shift = shifts
-        print("Best Shift", best_shift, best_mae)
-    print("Best Shifts: ", best_shift)
+def optimize_shifts(df, shifts, strategy='coordinate', shift_values=range(1, 8), max_workers=None):
+    """
+    Shift per alt data feature that minimizes the test MAE of train_model's XGBoost model.
+
+    The last key of shifts stays at 1 and the others are searched over shift_values with utils/shift_search.py
+    (coordinate descent by default, 'halving' for successive halving over the whole grid), which trains the
+    same model as train_model (XGB_PARAMS) through xgboost's native API.
+    """
+    cols = list(shifts.keys())
+    search = ShiftSearch(df, cols[:-1], fixed={cols[-1]: 1}, shift_values=shift_values, max_workers=max_workers)
+    best, best_mae = search.search(strategy)
+    best_shift = {col: best[col] for col in cols}
+    print("Best Shifts: ", best_shift, best_mae)
 
     return best_shift
 